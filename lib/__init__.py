@@ -0,0 +1,38 @@
+"""Reusable analysis code for the price concession notebooks
+
+Modules in here are imported from the notebooks (which run with the
+repository root on `PYTHONPATH`), e.g. `from lib import rolling`.
+
+The computational modules (`ingest`, `episodes`, `forecast`, `features`,
+`postconcession` and so on) only need NumPy and pandas.  Plotting,
+scraping and warehouse clients are imported inside the functions that
+use them, so loading a cache or running a forecast doesn't pay for
+matplotlib or BigQuery; `tests/test_import_time.py` keeps it that way.
+Notebooks can do the same for their own imports with `lazy_import`:
+
+    from lib import lazy_import
+    bq = lazy_import("ebmdatalab.bq")
+
+"""
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Return module `name`, which is only executed when first used
+
+    The module's parent packages are imported straight away.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
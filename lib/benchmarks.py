@@ -0,0 +1,281 @@
+"""Time and memory benchmarks for each stage of the analysis
+
+The notebook checks in `run_tests.sh` only assert that outputs haven't
+changed.  This runs each pipeline stage on synthetic data (see
+`lib.synthetic`) at several scales, entirely offline, and records wall
+time and peak Python memory per stage as JSON, so two commits can be
+compared:
+
+    python -m lib.benchmarks run --scales small medium
+    python -m lib.benchmarks compare benchmarks/abc1234.json benchmarks/def5678.json
+
+`compare` exits non-zero if any stage got slower (or hungrier) by more
+than the threshold.
+
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from lib import bnf, forecast, ingest, synthetic
+from lib.episodes import find_episodes
+from lib.postconcession import post_concession_costs, window_mean_prices
+
+SCALES = {
+    "small": {"n_vmpps": 500, "n_years": 3},
+    "medium": {"n_vmpps": 5000, "n_years": 10},
+    "large": {"n_vmpps": 50000, "n_years": 20},
+}
+
+DEFAULT_OUTPUT_DIR = "benchmarks"
+
+
+def _load_caches(directory):
+    """Read the cache-shaped CSVs, parsing dates with their recorded formats
+    """
+    frames = {}
+    for name in synthetic.CACHE_SCHEMAS:
+        if name in ingest.SCHEMAS:
+            frames[name] = ingest.read_cache(name, directory)
+        else:
+            frames[name] = pd.read_csv(os.path.join(directory, f"{name}.csv"))
+    return frames
+
+
+def stages(directory, data):
+    """Return the pipeline as a list of (name, inputs, function) triples
+
+    Each function takes the dict of results so far and returns the dict
+    of results it adds, so stages run in order and later ones use the
+    outputs of earlier ones.  `inputs` names the frames the stage reads,
+    from the results or, failing that, `data`, which also supplies the
+    inputs that aren't cached as CSVs (monthly prescribing and bank
+    holidays).
+
+    """
+    return [
+        ("cache_load", tuple(synthetic.CACHE_SCHEMAS), lambda r: _load_caches(directory)),
+        ("episode_detection", ("ncso_dates",), lambda r: {"episodes": find_episodes(r["ncso_dates"])}),
+        ("rolling_tariff_means", ("tariff",), lambda r: {"means": window_mean_prices(r["tariff"], 3)}),
+        (
+            "pre_post_merges",
+            ("episodes", "tariff", "rx"),
+            lambda r: {
+                "costs": post_concession_costs(
+                    r["episodes"], r["tariff"], data["rx"], horizons=(1, 3, 6, 12), price_windows=(3,)
+                )
+            },
+        ),
+        (
+            "forecast",
+            ("ncso_df",),
+            lambda r: {"monthly": forecast.monthly_totals(forecast.predict_costs(r["ncso_df"]))},
+        ),
+        (
+            "reweighting",
+            ("monthly", "nadp_fixed", "bank_holidays", "annual_profile_df"),
+            lambda r: {
+                "reweighted": forecast.reweight(
+                    r["monthly"],
+                    forecast.weightings(
+                        r["monthly"]["month"],
+                        r["nadp_fixed"],
+                        data["bank_holidays"]["date"],
+                        r["annual_profile_df"],
+                    ),
+                )
+            },
+        ),
+        ("fy_rollups", ("reweighted",), lambda r: {"fy": forecast.financial_year_totals(r["reweighted"])}),
+        (
+            "bnf_rollups",
+            ("ncso_df",),
+            lambda r: {
+                "sections": bnf.Hierarchy(r["ncso_df"]["bnf_code"]).rollup_frame(
+                    r["ncso_df"], "section", ["actual_cost"], by="month"
+                )
+            },
+        ),
+    ]
+
+
+def _rows(frames, names=None):
+    """Return the total rows of the frames in `frames` (those in `names`, if given)
+    """
+    if names is not None:
+        frames = {name: frames[name] for name in names}
+    return int(sum(len(v) for v in frames.values() if isinstance(v, pd.DataFrame)))
+
+
+def run_scale(params, repeat=3, seed=0):
+    """Return {stage: measurements} for synthetic data generated with `params`
+
+    Each stage is timed `repeat` times and the fastest kept; memory is
+    measured in a separate run under `tracemalloc`, so its overhead
+    doesn't affect the timings.  `rows_in` counts the rows of the
+    stage's inputs only.
+
+    """
+    data = synthetic.generate(seed=seed, **params)
+    measurements = {}
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic.write_synthetic(data, directory)
+        results = {}
+        for name, inputs, stage in stages(directory, data):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                added = stage(results)
+                timings.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            stage(results)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            measurements[name] = {
+                "seconds": min(timings),
+                "peak_mb": peak / 2 ** 20,
+                "rows_in": _rows({**data, **results}, inputs),
+                "rows_out": _rows(added),
+            }
+            results.update(added)
+    return measurements
+
+
+def git_commit():
+    """Return the short hash of HEAD, or None outside a git checkout
+    """
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.decode("utf8").strip()
+
+
+def run(scales, repeat=3, seed=0):
+    """Return a JSON-serialisable benchmark report for `scales`
+    """
+    report = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "repeat": repeat,
+        "seed": seed,
+        "scales": {},
+    }
+    for scale in scales:
+        print(f"Benchmarking {scale} ({SCALES[scale]})...", file=sys.stderr)
+        report["scales"][scale] = {
+            "params": SCALES[scale],
+            "stages": run_scale(SCALES[scale], repeat=repeat, seed=seed),
+        }
+    return report
+
+
+def compare(base, new, threshold=0.2, min_seconds=0.005):
+    """Return a list of regressions between two reports
+
+    A stage regresses if its time or peak memory grew by more than
+    `threshold` (a fraction).  Stages taking under `min_seconds` in both
+    reports are too noisy to judge on time.
+
+    """
+    regressions = []
+    for scale, new_scale in new["scales"].items():
+        base_stages = base["scales"].get(scale, {}).get("stages", {})
+        for stage, after in new_scale["stages"].items():
+            before = base_stages.get(stage)
+            if before is None:
+                continue
+            for metric in ("seconds", "peak_mb"):
+                if metric == "seconds" and max(before[metric], after[metric]) < min_seconds:
+                    continue
+                if before[metric] and after[metric] > before[metric] * (1 + threshold):
+                    regressions.append(
+                        {
+                            "scale": scale,
+                            "stage": stage,
+                            "metric": metric,
+                            "before": before[metric],
+                            "after": after[metric],
+                            "change": after[metric] / before[metric] - 1,
+                        }
+                    )
+    return regressions
+
+
+def format_report(report):
+    """Return a plain-text table of a report
+    """
+    lines = []
+    for scale, results in report["scales"].items():
+        lines.append(f"{scale}: {results['params']}")
+        for stage, m in results["stages"].items():
+            lines.append(
+                f"  {stage:<22}{m['seconds']:>10.4f}s{m['peak_mb']:>10.1f}MB{m['rows_out']:>12,} rows"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"])
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--output", help=f"JSON file to write (default {DEFAULT_OUTPUT_DIR}/<commit>.json)"
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        report = run(args.scales, repeat=args.repeat, seed=args.seed)
+        output = args.output or os.path.join(
+            DEFAULT_OUTPUT_DIR, f"{report['commit'] or 'results'}.json"
+        )
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(format_report(report))
+        print(f"Results written to {output}")
+        return 0
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(base, new, threshold=args.threshold)
+    for r in regressions:
+        print(
+            f"{r['scale']}/{r['stage']} {r['metric']}: "
+            f"{r['before']:.4g} -> {r['after']:.4g} ({r['change']:+.0%})"
+        )
+    if regressions:
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Roll BNF codes up to chapters, sections, paragraphs and beyond
+
+A BNF presentation code is a path down the hierarchy, two characters
+(one for the subparagraph) per level:
+
+    04 07 01 0 B0 AA AB AB
+    |  |  |    |  |
+    |  |  |    |  product (11 characters)
+    |  |  |    chemical substance (9)
+    |  |  paragraph (6)
+    |  section (4)
+    chapter (2)
+
+The warehouse queries pick levels with `SUBSTR(bnf_code, 0, 2) IN
+(...)`, and locally every rollup has been a groupby on the full code or
+on string prefixes.  A `Hierarchy` sorts the codes once and gives each
+code an integer id at every level; codes sharing a prefix are then a
+contiguous run of ids, so a rollup is one `np.bincount` and a
+drill-down is a `searchsorted`:
+
+    hierarchy = bnf.Hierarchy(ncso_df["bnf_code"])
+    positions = hierarchy.positions(ncso_df["bnf_code"])    # once per frame
+    hierarchy.rollup(positions, ncso_df["actual_cost"], "chapter")
+    hierarchy.rollup_frame(ncso_df, "section", ["actual_cost"], by="month", positions=positions)
+    hierarchy.children("0407")                              # its paragraphs
+
+"""
+import numpy as np
+import pandas as pd
+
+# level -> characters of the code that identify it, top down
+LEVELS = {"chapter": 2, "section": 4, "paragraph": 6, "chemical": 9, "product": 11, "presentation": 15}
+
+_BY_WIDTH = {width: level for level, width in LEVELS.items()}
+
+
+def level_of(label):
+    """Return the level of a code prefix, from its length
+    """
+    try:
+        return _BY_WIDTH[len(label)]
+    except KeyError:
+        raise ValueError(f"{label!r} isn't a BNF chapter, section, paragraph, chemical, product or presentation")
+
+
+class Hierarchy:
+    """Integer ids at every BNF level for a set of codes
+
+    `codes` are the sorted unique codes; `ids[level][i]` is the group of
+    `codes[i]` at `level` and `labels[level][g]` the prefix of group `g`.
+    """
+
+    def __init__(self, codes):
+        codes = pd.unique(np.asarray(codes, dtype=object).ravel())
+        self.codes = np.sort(np.asarray(codes[pd.notna(codes)], dtype=str))
+        self.ids = {}
+        self.labels = {}
+        for level, width in LEVELS.items():
+            prefixes = self.codes.astype(f"U{width}")
+            starts = np.ones(len(prefixes), dtype=bool)
+            starts[1:] = prefixes[1:] != prefixes[:-1]
+            self.ids[level] = np.cumsum(starts) - 1
+            self.labels[level] = prefixes[starts]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        sizes = ", ".join(f"{len(labels)} {level}" for level, labels in self.labels.items())
+        return f"<Hierarchy of {sizes}>"
+
+    def positions(self, codes):
+        """Return the position of each code in `codes`, or -1 where it isn't in the hierarchy
+
+        Each distinct code is looked up once, so this is about the cost
+        of one groupby; keep the result to roll the same rows up
+        repeatedly.
+        """
+        inverse, uniques = pd.factorize(np.asarray(codes, dtype=object).ravel())
+        uniques = np.asarray(uniques, dtype=str)
+        if not len(self.codes) or not len(uniques):
+            return np.full(len(inverse), -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.codes, uniques), len(self.codes) - 1)
+        found = np.where(self.codes[found] == uniques, found, -1)
+        return np.where(inverse >= 0, found[inverse], -1)
+
+    def group_ids(self, codes, level):
+        """Return the group id at `level` of each code (or position from `positions`)
+        """
+        positions = self._positions(codes)
+        return self.ids[level][positions]
+
+    def _positions(self, codes):
+        """Return positions for codes or positions, raising KeyError for unknown codes
+        """
+        codes = np.asarray(codes)
+        positions = codes.astype(np.int64) if np.issubdtype(codes.dtype, np.integer) else self.positions(codes)
+        missing = positions < 0
+        if missing.any():
+            unknown = pd.unique(codes[missing])[:5] if not np.issubdtype(codes.dtype, np.integer) else []
+            raise KeyError(f"{int(missing.sum())} rows have codes not in the hierarchy, e.g. {list(unknown)}")
+        return positions
+
+    def rollup(self, codes, values, level="chapter"):
+        """Return `values` summed by the `level` group of each code
+
+        `codes` are BNF codes or positions from `positions`; `values` is
+        one column (giving a Series) or several (a 2-d array or frame,
+        giving a frame).  Every group at `level` appears, zero if none of
+        the rows fall in it.
+        """
+        groups = self.group_ids(codes, level)
+        index = pd.Index(self.labels[level], name=level)
+        n_groups = len(index)
+        if isinstance(values, pd.DataFrame):
+            columns = values.columns
+            values = values.to_numpy(dtype=np.float64)
+        else:
+            values = np.asarray(values, dtype=np.float64)
+            columns = None if values.ndim == 1 else range(values.shape[1])
+        if columns is None:
+            return pd.Series(np.bincount(groups, weights=values, minlength=n_groups), index=index)
+        totals = np.column_stack([np.bincount(groups, weights=v, minlength=n_groups) for v in values.T])
+        return pd.DataFrame(totals, index=index, columns=columns)
+
+    def rollup_frame(self, df, level, columns, by=None, code_col="bnf_code", positions=None):
+        """Return `columns` of `df` summed by the `by` columns and the `level` group
+
+        The result has the `by` columns, a `level` column of prefixes and
+        the totals, for the combinations that have rows, sorted by `by`
+        then code.  Pass `positions` (from `positions`) to skip looking
+        the codes up again.
+        """
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        by = [] if by is None else [by] if isinstance(by, str) else list(by)
+        groups = self.group_ids(df[code_col].to_numpy() if positions is None else positions, level)
+        n_groups = len(self.labels[level])
+        rows = slice(None)
+        if by:
+            if len(by) == 1:
+                key_idx, keys = pd.factorize(df[by[0]], sort=True)
+                keys = pd.Index(keys, name=by[0])
+            else:
+                key_idx, keys = pd.factorize(pd.MultiIndex.from_frame(df[by]), sort=True)
+            # like groupby, rows with a missing key are left out
+            rows = key_idx >= 0
+            cells = key_idx[rows].astype(np.int64) * n_groups + groups[rows]
+            n_cells = n_groups * len(keys)
+        else:
+            cells = groups
+            n_cells = n_groups
+        used = np.flatnonzero(np.bincount(cells, minlength=n_cells))
+        result = pd.DataFrame({level: self.labels[level][used % n_groups]})
+        if by:
+            result = pd.concat([keys[used // n_groups].to_frame(index=False), result], axis=1)
+        for column in columns:
+            values = df[column].to_numpy(dtype=np.float64)[rows]
+            totals = np.bincount(cells, weights=values, minlength=n_cells)
+            result[column] = totals[used]
+        return result
+
+    def members(self, label, level="presentation"):
+        """Return the labels at `level` under the prefix `label`
+        """
+        if LEVELS[level] < len(label):
+            raise ValueError(f"{level} is above {level_of(label)} {label!r}")
+        labels = self.labels[level]
+        lo = np.searchsorted(labels, label, side="left")
+        hi = np.searchsorted(labels, label + "\uffff", side="left")
+        return labels[lo:hi]
+
+    def children(self, label):
+        """Return the groups one level down from the prefix `label`
+        """
+        names = list(LEVELS)
+        position = names.index(level_of(label))
+        if position == len(names) - 1:
+            return self.labels["presentation"][:0]
+        return self.members(label, names[position + 1])
+
+    def parents(self, level, parent_level):
+        """Return the `parent_level` group id of each `level` group
+        """
+        if LEVELS[parent_level] > LEVELS[level]:
+            raise ValueError(f"{parent_level} is below {level}")
+        starts = np.searchsorted(self.ids[level], np.arange(len(self.labels[level])))
+        return self.ids[parent_level][starts]
@@ -0,0 +1,260 @@
+"""Render the standard charts to files, without a notebook
+
+`priceconcessions.ipynb` draws each chart with `plt.show()`, so the
+charts only exist as notebook output.  This draws them from the result
+tables straight to PNG and/or SVG:
+
+* `monthly_perc_difference` - % difference per month, current method
+  and NADP-adjusted (from `forecast.reweight`)
+* `fy_methods` - % difference per financial year for every methodology
+  (from `forecast.financial_year_totals`)
+* `post_concession_costs` - additional cost after concessions end, per
+  month and horizon (from `postconcession.monthly_totals`)
+
+Figures are built with the Agg canvas directly rather than through
+`pyplot`, so nothing needs a display and importing this module doesn't
+change the backend of a notebook that uses it.  Charts are rendered in
+parallel worker processes, and a chart is skipped if the data it's
+drawn from hashes the same as when it was last rendered (recorded in
+`charts.json` in the output directory).
+
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from lib import forecast, profiling
+
+MANIFEST_FILE = "charts.json"
+FORMATS = ("png", "svg")
+
+# bumped when the drawing code changes, so old files are redrawn
+CHART_VERSION = 1
+
+FIGSIZE = (12, 6)
+
+
+def _figure():
+    """Return a (figure, axes) pair on an Agg canvas
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot(111)
+
+
+def _percent_axis(ax):
+    """Label the y axis as percentages of 1
+    """
+    from matplotlib import ticker
+
+    ax.yaxis.set_major_formatter(ticker.PercentFormatter(1, decimals=None))
+
+
+def _grouped_bars(ax, labels, series, rotation=90):
+    """Draw bars for each of `series` ({legend label: values}) side by side
+    """
+    width = 0.8 / max(len(series), 1)
+    positions = range(len(labels))
+    for i, (label, values) in enumerate(series.items()):
+        ax.bar([p + (i - (len(series) - 1) / 2) * width for p in positions], values, width, label=label)
+    ax.set_xticks(list(positions))
+    ax.set_xticklabels(labels, rotation=rotation)
+    if len(series) > 1:
+        ax.legend()
+
+
+def monthly_perc_difference(monthly):
+    """Bar chart of the monthly % difference, with the NADP-adjusted one if present
+    """
+    fig, ax = _figure()
+    series = {"Current method": monthly["perc_difference"]}
+    if "nadp_perc_difference" in monthly:
+        series["Monthly NADP"] = monthly["nadp_perc_difference"]
+    _grouped_bars(ax, monthly["month"].dt.strftime("%b %Y"), series)
+    _percent_axis(ax)
+    ax.set_title("Percentage difference between forecasted price concession costs and actual spend")
+    return fig
+
+
+def fy_methods(fy):
+    """Bar chart of the financial year % difference for each methodology
+    """
+    fig, ax = _figure()
+    series = {"Current method": fy["perc_difference"]}
+    for method in forecast.METHODS:
+        column = f"{method}_perc_difference"
+        if column in fy:
+            series[method.replace("_", " + ")] = fy[column]
+    _grouped_bars(ax, fy["financial_year"].astype(str), series, rotation=0)
+    _percent_axis(ax)
+    ax.set_xlabel("Financial Year ending")
+    ax.set_title(
+        "Percentage difference between forecasted price concession costs and actual spend "
+        "(financial year)\n using different methodologies"
+    )
+    return fig
+
+
+def post_concession_costs(totals):
+    """Line chart of additional cost per month, for each horizon and price window
+    """
+    fig, ax = _figure()
+    for (horizon, price_window), df in totals.groupby(["horizon", "price_window"]):
+        df = df.sort_values("rx_start_month")
+        ax.plot(
+            df["rx_start_month"],
+            df["additional_cost"],
+            marker="o",
+            label=f"{horizon} months after (price over {price_window} months)",
+        )
+    ax.set_ylabel("Additional cost (£)")
+    ax.set_xlabel("First month after concession")
+    ax.set_title("Additional cost after price concessions end")
+    ax.legend()
+    return fig
+
+
+# chart name -> (drawing function, the table it's drawn from, the columns it uses)
+CHARTS = {
+    "monthly_perc_difference": (
+        monthly_perc_difference,
+        "monthly",
+        ["month", "perc_difference", "nadp_perc_difference"],
+    ),
+    "fy_methods": (
+        fy_methods,
+        "fy",
+        ["financial_year", "perc_difference"] + [f"{m}_perc_difference" for m in forecast.METHODS],
+    ),
+    "post_concession_costs": (
+        post_concession_costs,
+        "post_concession",
+        ["rx_start_month", "horizon", "price_window", "additional_cost"],
+    ),
+}
+
+
+def chart_data(name, tables):
+    """Return the columns of `tables` that chart `name` is drawn from, or None
+
+    `tables` maps table names ("monthly", "fy", "post_concession") to
+    frames; None means the table isn't available.
+    """
+    _, table, columns = CHARTS[name]
+    df = tables.get(table)
+    if df is None:
+        return None
+    return df[[c for c in columns if c in df]].reset_index(drop=True)
+
+
+def data_hash(name, df, fmt):
+    """Return a hash identifying chart `name` drawn from `df` as `fmt`
+    """
+    digest = hashlib.sha256(f"{name}:{fmt}:{CHART_VERSION}:{list(df.columns)}".encode("utf8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    """Return {filename: data hash} for the charts last rendered into `directory`
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(directory, manifest):
+    """Record {filename: data hash} for the charts rendered into `directory`
+    """
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=1)
+
+
+def _render(name, df, path):
+    """Draw chart `name` from `df` and save it to `path` (run in a worker)
+    """
+    draw = CHARTS[name][0]
+    fig = draw(df)
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+
+def render_all(tables, directory, names=None, formats=FORMATS, workers=None, force=False):
+    """Render charts from `tables` into `directory`, and return what was done
+
+    Returns {filename: "rendered", "unchanged" or "no data"}.  Charts
+    whose file exists and whose data hash matches the manifest are left
+    alone unless `force`.  `workers` is the number of processes (default
+    one per CPU); with 0 or 1 charts are rendered in this process.
+
+    If a chart fails the error is raised once the others are done, and
+    the manifest still records every chart that was rendered, so they
+    aren't redrawn next time.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    status = {}
+    jobs = []
+    for name in names or CHARTS:
+        df = chart_data(name, tables)
+        for fmt in formats:
+            filename = f"{name}.{fmt}"
+            if df is None:
+                status[filename] = "no data"
+                continue
+            digest = data_hash(name, df, fmt)
+            path = os.path.join(directory, filename)
+            if not force and manifest.get(filename) == digest and os.path.exists(path):
+                status[filename] = "unchanged"
+                continue
+            jobs.append((filename, digest, (name, df, path)))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    try:
+        with profiling.stage(
+            "render_charts",
+            rows_in=sum(len(args[1]) for _, _, args in jobs),
+            cache="hit" if not jobs else "miss",
+            charts=len(jobs),
+            processes=workers > 1 and len(jobs) > 1,
+        ):
+            _render_jobs(jobs, workers, manifest, status)
+    finally:
+        write_manifest(directory, manifest)
+    return status
+
+
+def _render_jobs(jobs, workers, manifest, status):
+    """Render (filename, digest, args) `jobs`, recording them in `manifest` and `status`
+
+    Each chart is recorded as soon as it's rendered.  In a pool, the
+    first error is raised after the other charts have finished.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for filename, digest, args in jobs:
+            _render(*args)
+            manifest[filename] = digest
+            status[filename] = "rendered"
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_render, *args): (filename, digest) for filename, digest, args in jobs}
+            error = None
+            for future in concurrent.futures.as_completed(futures):
+                filename, digest = futures[future]
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                manifest[filename] = digest
+                status[filename] = "rendered"
+        if error is not None:
+            raise error
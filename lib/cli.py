@@ -0,0 +1,356 @@
+"""Command line entry point for the analysis
+
+Runs the forecast accuracy pipeline from the cached extracts without
+Jupyter or Docker:
+
+    python -m lib run --from 2017-01 --to 2023-12 --methods all
+
+The steps are:
+
+* fetch - read `ncso_df.csv`, `nadp_fixed.csv`, `annual_profile_df.csv`
+  and the bank holidays (`bank_holidays.csv`, or the saved gov.uk JSON;
+  see `features.read_bank_holidays`) from `--data-dir`
+* forecast - OpenPrescribing's predicted cost, summed by month
+* reweight - the predictions adjusted by each of `--methods`
+* rollup - totals and % differences by financial year
+* export - `monthly` and `financial_year` tables to `--output-dir`
+
+The stages up to the rollup form a `lib.dag` graph, so on a second run
+only those whose inputs (files, parameters or upstream results) have
+changed are recomputed; the rest come from the stage cache.
+
+The warehouse queries live in the notebooks, so "fetch" reads the
+extracts they cache rather than querying BigQuery; refresh those by
+running the notebooks.  The other modules' command lines are available
+as subcommands too (`report`, `reconcile`, `store`, `benchmarks`,
+`cube`).
+
+Progress is logged one line per event, as `key=value` pairs or (with
+`--log-format json`) JSON objects, to stderr.  `--profile` and
+`--prometheus` record each stage's time, memory and rows (see
+`lib.profiling`).  Exit codes are 0 on success, 2 for bad arguments, 3
+if an input file is missing and 1 if a stage fails.
+
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import sys
+import time
+import warnings
+
+from lib import profiling
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_MISSING_INPUT = 3
+
+EXPORT_FORMATS = ("csv", "parquet", "xlsx")
+
+# subcommand -> module whose `main(argv)` it runs
+DELEGATED = {
+    "report": "lib.report",
+    "reconcile": "lib.reconcile",
+    "store": "lib.store",
+    "benchmarks": "lib.benchmarks",
+    "cube": "lib.cube",
+    "lazy": "lib.lazy",
+}
+
+logger = logging.getLogger("lib.cli")
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Format records as `time=... level=... event=... key=value ...`
+    """
+
+    def fields(self, record):
+        fields = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        fields.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            fields["traceback"] = self.formatException(record.exc_info)
+        return fields
+
+    def format(self, record):
+        return " ".join(f"{key}={_quote(value)}" for key, value in self.fields(record).items())
+
+
+class JsonFormatter(KeyValueFormatter):
+    """Format records as one JSON object per line
+    """
+
+    def format(self, record):
+        return json.dumps(self.fields(record), default=str)
+
+
+def _quote(value):
+    value = str(value)
+    return json.dumps(value) if (" " in value or "=" in value or not value) else value
+
+
+def configure_logging(log_format="text", verbose=False):
+    """Send `lib` log records to stderr, one line per event
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else KeyValueFormatter())
+    root = logging.getLogger("lib")
+    root.handlers[:] = [handler]
+    root.setLevel(logging.DEBUG if verbose else logging.INFO)
+    root.propagate = False
+    warnings.showwarning = _log_warning
+
+
+def _log_warning(message, category, filename, lineno, file=None, line=None):
+    """Log warnings (e.g. months without NADP weightings) as events
+    """
+    log("warning", logging.WARNING, category=category.__name__, message=str(message))
+
+
+def log(event, level=logging.INFO, **fields):
+    """Log `event` with `fields` as structured key/values
+    """
+    logger.log(level, event, extra={"fields": fields})
+
+
+class MissingInput(Exception):
+    """An input file the pipeline needs doesn't exist"""
+
+
+def _month(value):
+    """argparse type for "YYYY-MM" months
+    """
+    from lib import monthtime
+
+    try:
+        return monthtime.to_month(value)
+    except (ValueError, TypeError):
+        raise argparse.ArgumentTypeError(f"not a month: {value!r} (use YYYY-MM)")
+
+
+def _methods(value):
+    """argparse type for "all" or a comma-separated list of methods
+    """
+    from lib import forecast
+
+    if value == "all":
+        return list(forecast.METHODS)
+    methods = [m.strip() for m in value.split(",") if m.strip()]
+    unknown = [m for m in methods if m not in forecast.METHODS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown methods {unknown}; use 'all' or some of {list(forecast.METHODS)}")
+    return methods
+
+
+def build_pipeline(data_dir, cache_dir=None):
+    """Return the forecast accuracy stages as a `dag.Pipeline`
+
+    Parameters `start`, `end` (month ordinals or None) and `methods` are
+    supplied when it's run.
+    """
+    import numpy as np
+    import pandas as pd
+
+    from lib import dag, features, forecast, ingest, monthtime
+
+    pipeline = dag.Pipeline(cache_dir=cache_dir)
+
+    def path(name):
+        return os.path.join(data_dir, f"{name}.csv")
+
+    @pipeline.stage(outputs=["ncso_df"], files=[path("ncso_df")])
+    def load_ncso():
+        return ingest.read_cache("ncso_df", data_dir)
+
+    @pipeline.stage(outputs=["nadp_df"], files=[path("nadp_fixed")])
+    def load_nadp():
+        return ingest.read_cache("nadp_fixed", data_dir)
+
+    @pipeline.stage(outputs=["annual_profile_df"], files=[path("annual_profile_df")])
+    def load_profile():
+        return pd.read_csv(path("annual_profile_df"))
+
+    bank_holidays_path = features.bank_holidays_path(data_dir) or os.path.join(data_dir, features.BANK_HOLIDAYS_FILE)
+
+    @pipeline.stage(outputs=["bank_holidays"], files=[bank_holidays_path])
+    def load_bank_holidays():
+        return features.read_bank_holidays(data_dir)
+
+    @pipeline.stage(inputs=["ncso_df", "start", "end"], outputs=["selected"])
+    def select_months(ncso_df, start, end):
+        months = monthtime.to_months(ncso_df["month"])
+        keep = np.ones(len(months), dtype=bool)
+        if start is not None:
+            keep &= months >= start
+        if end is not None:
+            keep &= months <= end
+        if not keep.any():
+            raise ValueError("No concession data in the requested months")
+        return ncso_df[keep].reset_index(drop=True)
+
+    @pipeline.stage(inputs=["selected"], outputs=["totals"])
+    def forecast_costs(selected):
+        return forecast.monthly_totals(forecast.predict_costs(selected))
+
+    @pipeline.stage(inputs=["totals", "nadp_df", "bank_holidays", "annual_profile_df"], outputs=["weights"])
+    def weightings(totals, nadp_df, bank_holidays, annual_profile_df):
+        return features.monthly_features(totals["month"], nadp_df, bank_holidays, annual_profile_df)
+
+    @pipeline.stage(inputs=["totals", "weights", "methods"], outputs=["monthly"])
+    def reweight(totals, weights, methods):
+        return forecast.reweight(totals, weights, {m: forecast.METHODS[m] for m in methods})
+
+    @pipeline.stage(inputs=["monthly", "methods"], outputs=["financial_year"])
+    def rollup(monthly, methods):
+        return forecast.financial_year_totals(monthly, list(methods))
+
+    return pipeline
+
+
+def run_pipeline(args):
+    """Run the stages that need running, export the results and return them
+    """
+    from lib import export, features
+
+    for name in ("ncso_df", "nadp_fixed", "annual_profile_df"):
+        path = os.path.join(args.data_dir, f"{name}.csv")
+        if not os.path.exists(path):
+            raise MissingInput(path)
+    if features.bank_holidays_path(args.data_dir) is None:
+        raise MissingInput(os.path.join(args.data_dir, features.BANK_HOLIDAYS_FILE))
+
+    cache_dir = None if args.no_cache else (args.cache_dir or os.path.join(args.output_dir, ".pipeline_cache"))
+    pipeline = build_pipeline(args.data_dir, cache_dir)
+    values = pipeline.run(
+        {"start": args.start, "end": args.end, "methods": tuple(args.methods)},
+        targets=["monthly", "financial_year"],
+    )
+    log(
+        "stages_done",
+        ran=sum(status == "ran" for status in pipeline.last_run.values()),
+        cached=sum(status == "cached" for status in pipeline.last_run.values()),
+    )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    results = {name: values[name] for name in ("monthly", "financial_year")}
+    for name, df in results.items():
+        path = os.path.join(args.output_dir, f"{name}.{args.format}")
+        with profiling.stage(f"export:{name}", rows_in=len(df)):
+            rows = export.write_chunks(df, path, fmt=args.format)
+        log("exported", table=name, rows=rows, path=path)
+    return results
+
+
+class GlobalOptionsParser(argparse.ArgumentParser):
+    """A parser that raises ArgumentError rather than exiting on a bad option
+
+    (`exit_on_error=False` would do, but needs Python 3.9.)
+    """
+
+    def error(self, message):
+        raise argparse.ArgumentError(None, message)
+
+
+def build_global_parser():
+    """Return a parser for the options that come before the subcommand
+    """
+    parser = GlobalOptionsParser(add_help=False)
+    parser.add_argument("--log-format", choices=["text", "json"], default="text")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--profile", metavar="TRACE", help="append per-stage timings to this JSON-lines file")
+    parser.add_argument("--prometheus", metavar="PATH", help="write per-stage totals as a Prometheus textfile")
+    return parser
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m lib", description=__doc__.splitlines()[0], parents=[build_global_parser()]
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the forecast accuracy pipeline")
+    run_parser.add_argument("--data-dir", default="data")
+    run_parser.add_argument("--output-dir", default="output")
+    run_parser.add_argument("--from", dest="start", type=_month, help="first month, YYYY-MM")
+    run_parser.add_argument("--to", dest="end", type=_month, help="last month, YYYY-MM")
+    run_parser.add_argument("--methods", type=_methods, default="all", help="'all' or comma-separated methods")
+    run_parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    run_parser.add_argument("--cache-dir", help="stage cache (default <output-dir>/.pipeline_cache)")
+    run_parser.add_argument("--no-cache", action="store_true", help="run every stage")
+
+    for name, module in DELEGATED.items():
+        delegated = subparsers.add_parser(name, help=f"run {module}", add_help=False)
+        delegated.add_argument("args", nargs=argparse.REMAINDER)
+    return parser
+
+
+def split_delegated(argv):
+    """Return (global options, subcommand, its arguments) if `argv` runs a delegated subcommand, else None
+
+    The subcommand is the first of `DELEGATED` that follows nothing but
+    valid global options (so `--profile store` is a trace file, not a
+    subcommand).
+    """
+    global_parser = build_global_parser()
+    for i, arg in enumerate(argv):
+        if arg not in DELEGATED:
+            continue
+        try:
+            options, unknown = global_parser.parse_known_args(argv[:i])
+        except argparse.ArgumentError:
+            continue
+        if not unknown:
+            return options, arg, argv[i + 1 :]
+    return None
+
+
+def run_delegated(options, command, argv):
+    """Run subcommand `command` with the global `options` applied
+    """
+    configure_logging(options.log_format, options.verbose)
+    if options.profile or options.prometheus:
+        profiling.PROFILER.enable(options.profile, options.prometheus)
+    try:
+        return importlib.import_module(DELEGATED[command]).main(argv)
+    finally:
+        profiling.PROFILER.disable()
+
+
+def main(argv=None):
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # delegated subcommands take all their own arguments, including
+    # --help, so they're split off before the full parse
+    delegated = split_delegated(argv)
+    if delegated is not None:
+        return run_delegated(*delegated)
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_USAGE if e.code else EXIT_OK
+    configure_logging(args.log_format, args.verbose)
+
+    if args.start is not None and args.end is not None and args.start > args.end:
+        log("bad_arguments", logging.ERROR, reason="--from is after --to")
+        return EXIT_USAGE
+    if args.profile or args.prometheus:
+        profiling.PROFILER.enable(args.profile, args.prometheus)
+    start = time.perf_counter()
+    try:
+        run_pipeline(args)
+    except MissingInput as e:
+        log("missing_input", logging.ERROR, path=str(e))
+        return EXIT_MISSING_INPUT
+    except Exception as e:
+        logger.exception("failed", extra={"fields": {"error": f"{type(e).__name__}: {e}"}})
+        return EXIT_FAILED
+    finally:
+        profiling.PROFILER.disable()
+    log("finished", seconds=round(time.perf_counter() - start, 3))
+    return EXIT_OK
@@ -0,0 +1,232 @@
+"""A memory-mapped month x BNF code cube of prescribing measures
+
+Most of the analysis is lookups of "quantity (or cost) of code b in
+month m", but the data is spread over long-format CSVs that are re-read
+and re-merged for every question.  Here it's laid out once on disk as
+dense arrays, one per measure ("layer"), with a row per month and a
+column per BNF code:
+
+    <cube>/meta.json          first month ordinal, layers
+    <cube>/codes.npy          the BNF codes, sorted (column order)
+    <cube>/quantity.npy       float64, months x codes
+    <cube>/net_cost.npy
+    <cube>/actual_cost.npy
+    <cube>/observed.npy       bool, whether the source had a row
+
+Opening a cube reads `meta.json` and memory-maps the arrays, so it
+costs the same however long the history; only the pages a lookup
+touches are read.  Lags, rolling windows and BNF chapter totals are
+then slices and cumulative sums of a layer:
+
+    cube = Cube.open("data/cube")
+    cube.get("quantity", months, codes)
+    cube.lag("quantity", 2)
+    cube.rolling("quantity", 3)
+    cube.totals("actual_cost", level="chapter")
+
+Build one from the cached concessions extract with
+
+    python -m lib.cube build --data-dir data --cube data/cube
+
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+from lib import bnf, ingest, monthtime, rolling
+
+META_FILE = "meta.json"
+CODES_FILE = "codes.npy"
+
+LAYERS = ("quantity", "net_cost", "actual_cost")
+
+# characters of the BNF code that identify each level of the hierarchy
+BNF_LEVELS = bnf.LEVELS
+
+# cached extract -> {layer: source column}, for `build`
+SOURCES = {
+    "ncso_df": {"quantity": "quantity", "net_cost": "nic", "actual_cost": "actual_cost"},
+}
+
+
+def build_cube(df, directory, layers=None, month_col="month", code_col="bnf_code"):
+    """Write a cube of the long frame `df` to `directory`, and open it
+
+    `layers` maps layer names to columns of `df` (default the columns
+    of `df` named in `LAYERS`).  Rows are every month from the earliest
+    to the latest, columns the sorted unique BNF codes; duplicate
+    (month, code) rows are summed and missing cells are zero.  Layers
+    are written straight to memory-mapped files, so the cube never has
+    to fit in memory twice.
+
+    """
+    if layers is None:
+        layers = {name: name for name in LAYERS if name in df}
+    if not layers:
+        raise ValueError(f"No layers to build; pass `layers` or include some of {LAYERS}")
+
+    ordinals = monthtime.to_months(df[month_col])
+    codes, code_idx = np.unique(df[code_col].to_numpy().astype(str), return_inverse=True)
+    first = int(ordinals.min()) if len(ordinals) else 0
+    n_months = int(ordinals.max()) - first + 1 if len(ordinals) else 0
+    month_idx = ordinals - first
+    shape = (n_months, len(codes))
+
+    tmp_dir = f"{directory.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, CODES_FILE), codes)
+    for name, column in layers.items():
+        values = np.lib.format.open_memmap(os.path.join(tmp_dir, f"{name}.npy"), mode="w+", dtype=np.float64, shape=shape)
+        np.add.at(values, (month_idx, code_idx), df[column].to_numpy(dtype=np.float64))
+        values.flush()
+        del values
+    observed = np.lib.format.open_memmap(os.path.join(tmp_dir, "observed.npy"), mode="w+", dtype=bool, shape=shape)
+    observed[month_idx, code_idx] = True
+    observed.flush()
+    del observed
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+        json.dump({"first_month": first, "n_months": n_months, "n_codes": len(codes), "layers": list(layers)}, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return Cube.open(directory)
+
+
+def _ordinals(months):
+    """Return month ordinals for ordinals or date-like `months`
+    """
+    months = np.asarray(months)
+    if np.issubdtype(months.dtype, np.integer):
+        return months.astype(np.int64)
+    return monthtime.to_months(months).astype(np.int64)
+
+
+class Cube:
+    """An opened cube; layers are read-only memory maps
+    """
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.first_month = meta["first_month"]
+        self.layers = list(meta["layers"])
+        self.months = np.arange(self.first_month, self.first_month + meta["n_months"], dtype=monthtime.DTYPE)
+        self.codes = np.load(os.path.join(directory, CODES_FILE), mmap_mode="r")
+        self._maps = {}
+
+    @classmethod
+    def open(cls, directory):
+        with open(os.path.join(directory, META_FILE)) as f:
+            return cls(directory, json.load(f))
+
+    @property
+    def shape(self):
+        return (len(self.months), len(self.codes))
+
+    def layer(self, name):
+        """Return layer `name` (or "observed") as a months x codes array
+        """
+        if name not in self._maps:
+            if name != "observed" and name not in self.layers:
+                raise KeyError(f"No layer {name!r}; the cube has {self.layers}")
+            self._maps[name] = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r")
+        return self._maps[name]
+
+    def code_index(self, codes):
+        """Return the column of each BNF code, or -1 where it isn't in the cube
+        """
+        codes = np.asarray(codes).astype(self.codes.dtype)
+        if not len(self.codes):
+            return np.full(codes.shape, -1)
+        idx = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+        return np.where(self.codes[idx] == codes, idx, -1)
+
+    def month_index(self, months):
+        """Return the row of each month (ordinal or date), or -1 outside the cube
+        """
+        idx = _ordinals(months) - self.first_month
+        return np.where((idx >= 0) & (idx < len(self.months)), idx, -1)
+
+    def get(self, layer, months, codes, fill=np.nan):
+        """Return layer values for pairs of months and codes, `fill` where either is missing
+        """
+        rows = self.month_index(months)
+        columns = self.code_index(codes)
+        ok = (rows >= 0) & (columns >= 0)
+        result = np.full(ok.shape, fill, dtype=np.float64)
+        result[ok] = self.layer(layer)[rows[ok], columns[ok]]
+        return result
+
+    def window(self, layer, start=None, end=None):
+        """Return the rows of `layer` for months `start` to `end` inclusive, as a view
+        """
+        lo = 0 if start is None else max(int(_ordinals([start])[0]) - self.first_month, 0)
+        hi = len(self.months) if end is None else max(int(_ordinals([end])[0]) - self.first_month + 1, lo)
+        return self.layer(layer)[lo:hi]
+
+    def lag(self, layer, months, fill=np.nan):
+        """Return `layer` shifted down `months` rows (the value `months` earlier)
+        """
+        values = self.layer(layer)
+        result = np.full(values.shape, fill, dtype=np.float64)
+        if abs(months) >= len(values):
+            return result
+        if months >= 0:
+            result[months:] = values[: len(values) - months]
+        else:
+            result[:months] = values[-months:]
+        return result
+
+    def rolling(self, layer, width, direction="forward", complete_only=True):
+        """Return rolling sums of `width` months of `layer` (see `rolling.rolling_sum`)
+        """
+        return rolling.rolling_sum(self.layer(layer), width, direction, complete_only=complete_only)
+
+    def totals(self, layer, level="chapter"):
+        """Return `layer` summed by BNF `level`, as a months x groups frame
+
+        Codes are sorted, so each group is a contiguous run of columns
+        and the totals are one `np.add.reduceat` over the layer.
+        """
+        prefixes = self.codes.astype(f"U{BNF_LEVELS[level]}")
+        if not len(prefixes):
+            return pd.DataFrame(index=monthtime.to_timestamps(self.months))
+        starts = np.flatnonzero(np.r_[True, prefixes[1:] != prefixes[:-1]])
+        values = np.add.reduceat(self.layer(layer), starts, axis=1)
+        return pd.DataFrame(values, index=monthtime.to_timestamps(self.months), columns=prefixes[starts])
+
+    def grid(self, layer="quantity"):
+        """Return `layer` as a `rolling.QuantityGrid`, for `postconcession`
+        """
+        return rolling.QuantityGrid(self.months, np.asarray(self.codes), self.layer(layer), self.layer("observed"))
+
+
+def build(data_dir, directory, name="ncso_df"):
+    """Build the cube for cached extract `name` in `data_dir`
+    """
+    layers = SOURCES[name]
+    df = ingest.read_cache(name, data_dir, usecols=["month", "bnf_code"] + list(layers.values()))
+    return build_cube(df, directory, layers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build a cube from a cached extract")
+    build_parser.add_argument("--data-dir", default="data")
+    build_parser.add_argument("--cube", default=os.path.join("data", "cube"))
+    build_parser.add_argument("--source", choices=sorted(SOURCES), default="ncso_df")
+    args = parser.parse_args(argv)
+
+    cube = build(args.data_dir, args.cube, args.source)
+    print(f"{args.cube}: {cube.shape[0]} months x {cube.shape[1]} codes, layers {', '.join(cube.layers)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""Incremental stage graph for the pipeline
+
+The notebooks are long chains of frames (`ncso_df` -> `ncso_sum_df` ->
+NADP merge -> dates merge -> FY tables), so changing one cell means
+re-running everything below it.  Here each stage declares the named
+values it reads and writes:
+
+    pipeline = dag.Pipeline(cache_dir=".pipeline_cache")
+
+    @pipeline.stage(outputs=["ncso_df"], files=["data/ncso_df.csv"])
+    def load_ncso():
+        return ingest.read_cache("ncso_df", "data")
+
+    @pipeline.stage(inputs=["ncso_df"], outputs=["monthly"])
+    def forecast_costs(ncso_df):
+        return forecast.monthly_totals(forecast.predict_costs(ncso_df))
+
+    values = pipeline.run()
+
+A stage's key is a hash of its code, the source of the library it
+calls (every module of the packages in `code`, by default `lib`), its
+`version`, the content of the files it names and the content of its
+inputs.  So editing `forecast.reweight`, say, re-runs the stages even
+though their own source hasn't changed.  If a stage's key hasn't
+changed its outputs are reused - from memory, or from `cache_dir` (as
+pickles) in a new process - instead of being recomputed.  The cache
+keeps the `keep` most recently used entries per stage, so switching
+back and forth between a few sets of inputs doesn't recompute each
+time.  Outputs are
+hashed by content too, so a stage that re-runs but produces the same
+result doesn't invalidate the stages after it.  Stages whose inputs are
+all ready run at the same time in a thread pool (the heavy lifting is in
+NumPy and pandas, which release the GIL for most of it).
+
+The same pipeline object works in a notebook, where re-running a cell
+that calls `pipeline.run()` only redoes what changed, and from the
+command line (see `lib.cli`).
+
+"""
+import concurrent.futures
+import hashlib
+import importlib.util
+import inspect
+import logging
+import os
+import pickle
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from lib import profiling
+
+logger = logging.getLogger("lib.dag")
+
+# packages whose source is part of every stage's key
+DEFAULT_CODE = ("lib",)
+
+# cached entries kept per stage
+KEEP = 4
+
+Stage = namedtuple("Stage", ["name", "function", "inputs", "outputs", "files", "version"])
+
+
+def fingerprint(value):
+    """Return a content hash of `value`
+
+    Frames and Series are hashed by their values, index, column names
+    and dtypes; arrays by their bytes, shape and dtype; anything else by
+    its pickle.
+    """
+    digest = hashlib.sha256()
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(type(value).__name__.encode("utf8"))
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(list(zip(value.columns, map(str, value.dtypes)))).encode("utf8"))
+        else:
+            digest.update(repr((value.name, str(value.dtype))).encode("utf8"))
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.shape, str(value.dtype))).encode("utf8"))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    else:
+        digest.update(pickle.dumps(value, protocol=4))
+    return digest.hexdigest()
+
+
+def file_fingerprint(path):
+    """Return a content hash of the file at `path`, or "missing"
+    """
+    if not os.path.exists(path):
+        return "missing"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+_file_hashes = {}
+
+
+def _cached_file_fingerprint(path):
+    """Return `file_fingerprint(path)`, rehashing only when the file's size or time changes
+    """
+    stat = os.stat(path)
+    cache_key = (path, stat.st_size, stat.st_mtime_ns)
+    if cache_key not in _file_hashes:
+        _file_hashes[cache_key] = file_fingerprint(path)
+    return _file_hashes[cache_key]
+
+
+def source_fingerprint(names):
+    """Return a hash of the source files of the modules or packages `names`
+    """
+    digest = hashlib.sha256()
+    for name in names:
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+        if spec.submodule_search_locations:
+            paths = sorted(
+                os.path.join(root, filename)
+                for location in spec.submodule_search_locations
+                for root, _, filenames in os.walk(location)
+                for filename in filenames
+                if filename.endswith(".py")
+            )
+        else:
+            paths = [spec.origin]
+        for path in paths:
+            digest.update(f"{name}:{os.path.basename(path)}={_cached_file_fingerprint(path)}".encode("utf8"))
+    return digest.hexdigest()
+
+
+def _code_fingerprint(function):
+    try:
+        source = inspect.getsource(function)
+    except (OSError, TypeError):
+        source = getattr(function, "__qualname__", repr(function))
+    return hashlib.sha256(source.encode("utf8")).hexdigest()
+
+
+class Pipeline:
+    """A set of stages, run in dependency order with cached results
+    """
+
+    def __init__(self, cache_dir=None, code=DEFAULT_CODE, keep=KEEP):
+        self.cache_dir = cache_dir
+        self.code = tuple(code)
+        self.keep = keep
+        self.stages = {}
+        self.producers = {}
+        self.last_run = {}
+        self._memory = {}
+
+    def add(self, name, function, inputs=(), outputs=None, files=(), version=0):
+        """Add a stage; `function` takes the inputs as keyword arguments
+
+        It returns the single output, or a tuple of outputs in the order
+        of `outputs` (default `[name]`).
+        """
+        outputs = list(outputs) if outputs is not None else [name]
+        if name in self.stages:
+            raise ValueError(f"There's already a stage called {name!r}")
+        for output in outputs:
+            if output in self.producers:
+                raise ValueError(f"{output!r} is already an output of {self.producers[output]!r}")
+        self.stages[name] = Stage(name, function, list(inputs), outputs, list(files), version)
+        for output in outputs:
+            self.producers[output] = name
+        return function
+
+    def stage(self, inputs=(), outputs=None, files=(), version=0, name=None):
+        """Decorator form of `add`, naming the stage after the function
+        """
+
+        def decorator(function):
+            return self.add(name or function.__name__, function, inputs, outputs, files, version)
+
+        return decorator
+
+    def order(self, targets=None, provided=()):
+        """Return the stages needed for `targets` (default all), dependencies first
+        """
+        provided = set(provided)
+        wanted = list(targets) if targets is not None else [o for s in self.stages.values() for o in s.outputs]
+        ordered = []
+        state = {}
+
+        def visit(value, chain):
+            if value in provided:
+                return
+            if value not in self.producers:
+                raise KeyError(f"Nothing produces {value!r}, and it wasn't given (needed by {chain[-1]!r})")
+            name = self.producers[value]
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Stages depend on each other in a cycle: {' -> '.join(chain + [name])}")
+            state[name] = "visiting"
+            for needed in self.stages[name].inputs:
+                visit(needed, chain + [name])
+            state[name] = "done"
+            ordered.append(self.stages[name])
+
+        for value in wanted:
+            visit(value, ["(target)"])
+        return ordered
+
+    def key(self, stage, input_fingerprints):
+        """Return the cache key of `stage` given the fingerprints of its inputs
+        """
+        digest = hashlib.sha256(f"{stage.name}:{stage.version}".encode("utf8"))
+        digest.update(_code_fingerprint(stage.function).encode("utf8"))
+        digest.update(source_fingerprint(self.code).encode("utf8"))
+        for name in stage.inputs:
+            digest.update(f"{name}={input_fingerprints[name]}".encode("utf8"))
+        for path in stage.files:
+            digest.update(f"{path}={file_fingerprint(path)}".encode("utf8"))
+        return digest.hexdigest()
+
+    def _cache_path(self, stage, key):
+        return os.path.join(self.cache_dir, f"{stage.name}-{key[:20]}.pkl")
+
+    def _load(self, stage, key):
+        """Return the cached (outputs, fingerprints) for `key`, or None
+        """
+        if key in self._memory:
+            return self._memory[key]
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(stage, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            cached = pickle.load(f)
+        # the modification time is when the entry was last used
+        os.utime(path)
+        self._memory[key] = cached
+        return cached
+
+    def _save(self, stage, key, cached):
+        self._memory[key] = cached
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(stage, key)
+        # keep the `keep` most recently used entries for the stage, this one included
+        old = [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.startswith(f"{stage.name}-") and name.endswith(".pkl") and len(name) == len(os.path.basename(path))
+        ]
+        old = sorted((p for p in old if p != path), key=os.path.getmtime, reverse=True)
+        for stale in old[max(self.keep - 1, 0) :]:
+            os.remove(stale)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(cached, f, protocol=4)
+        os.replace(path + ".tmp", path)
+
+    def _execute(self, stage, values, fingerprints, force):
+        """Run `stage` (or reuse its cached outputs)
+
+        Returns (outputs, output fingerprints, status, seconds).
+        """
+        start = time.perf_counter()
+        inputs = {name: values[name] for name in stage.inputs}
+        with profiling.stage(f"dag:{stage.name}", rows_in=profiling.rows(inputs)) as record:
+            key = self.key(stage, fingerprints)
+            cached = None if force else self._load(stage, key)
+            if cached is not None:
+                record.cache = "hit"
+                record.rows_out = profiling.rows(cached[0])
+                return cached[0], cached[1], "cached", time.perf_counter() - start
+            record.cache = "miss"
+            result = stage.function(**inputs)
+            if len(stage.outputs) == 1:
+                result = (result,)
+            if len(result) != len(stage.outputs):
+                raise ValueError(f"Stage {stage.name!r} returned {len(result)} values for outputs {stage.outputs}")
+            outputs = dict(zip(stage.outputs, result))
+            record.rows_out = profiling.rows(outputs)
+            output_fingerprints = {name: fingerprint(value) for name, value in outputs.items()}
+            self._save(stage, key, (outputs, output_fingerprints))
+        return outputs, output_fingerprints, "ran", time.perf_counter() - start
+
+    def run(self, values=None, targets=None, workers=None, force=()):
+        """Run the stages needed for `targets`, and return every value
+
+        `values` supplies named inputs that no stage produces (e.g.
+        parameters).  Stages named in `force` run even if cached.
+        `workers` is the number of threads (default one per CPU, at least
+        2); `self.last_run` records whether each stage "ran" or was
+        "cached".
+        """
+        values = dict(values or {})
+        fingerprints = {name: fingerprint(value) for name, value in values.items()}
+        pending = self.order(targets, provided=values)
+        self.last_run = {}
+        force = set(force)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or max(os.cpu_count() or 1, 2)) as pool:
+            running = {}
+            while pending or running:
+                for stage in [s for s in pending if all(name in fingerprints for name in s.inputs)]:
+                    pending.remove(stage)
+                    logger.debug("stage_start", extra={"fields": {"stage": stage.name}})
+                    running[pool.submit(self._execute, stage, values, dict(fingerprints), stage.name in force)] = stage
+                if not running:
+                    raise RuntimeError(f"Stages can't run: {[s.name for s in pending]}")
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    outputs, output_fingerprints, status, seconds = future.result()
+                    values.update(outputs)
+                    fingerprints.update(output_fingerprints)
+                    self.last_run[stage.name] = status
+                    logger.info(
+                        "stage", extra={"fields": {"stage": stage.name, "status": status, "seconds": round(seconds, 3)}}
+                    )
+        return values
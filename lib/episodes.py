@@ -0,0 +1,56 @@
+"""Find runs of consecutive concession months ("episodes") per VMPP
+
+The post-concession notebook does this by unstacking `ncso_dates.csv`
+into a month x vmpp grid, then labelling runs with
+`(x != x.shift()).cumsum()` and grouping by `['vmpp', 'Consecutive']`.
+Grouping by run *length* merges two separate concessions of the same
+length for one VMPP into a single row.  Here runs are found directly
+from the sorted (vmpp, month) pairs, so each episode is its own row and
+no grid needs to be built.
+
+"""
+import numpy as np
+import pandas as pd
+
+from lib import monthtime
+
+
+def find_episodes(df, key_col="vmpp", month_col="month", flag_col="concession_bool"):
+    """Return one row per run of consecutive months for each `key_col`
+
+    `df` is in the shape of `ncso_dates.csv`.  Rows with a zero
+    `flag_col` (if present) are ignored, and duplicate months are
+    collapsed.  The result has `key_col`, `first_month`, `last_month`,
+    `months` (the run length) and `ongoing`, which is True where the
+    run reaches the latest month in the data and so may not have ended.
+
+    """
+    if flag_col in df.columns:
+        df = df[df[flag_col] > 0]
+    keys = df[key_col].to_numpy()
+    ordinals = monthtime.to_months(df[month_col])
+
+    order = np.lexsort((ordinals, keys))
+    keys = keys[order]
+    ordinals = ordinals[order]
+
+    duplicate = np.zeros(len(keys), dtype=bool)
+    duplicate[1:] = (keys[1:] == keys[:-1]) & (ordinals[1:] == ordinals[:-1])
+    keys = keys[~duplicate]
+    ordinals = ordinals[~duplicate]
+
+    new_run = np.ones(len(keys), dtype=bool)
+    new_run[1:] = (keys[1:] != keys[:-1]) | (np.diff(ordinals) != 1)
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(keys))[: len(starts)] - 1
+
+    latest = ordinals.max() if len(ordinals) else 0
+    return pd.DataFrame(
+        {
+            key_col: keys[starts],
+            "first_month": monthtime.to_timestamps(ordinals[starts]),
+            "last_month": monthtime.to_timestamps(ordinals[ends]),
+            "months": (ends - starts + 1).astype(np.int64),
+            "ongoing": ordinals[ends] == latest,
+        }
+    )
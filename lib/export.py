@@ -0,0 +1,176 @@
+"""Write result tables in chunks, to CSV, Parquet or XLSX
+
+The notebooks build each result (e.g. `rx_df_merge`) as one frame and
+write it with a single `to_csv`, so the whole table has to fit in memory
+before any of it is written.  Here a table is an iterable of frames -
+from `postconcession.iter_post_concession_costs`, say, or `chunks` of an
+existing frame - and each chunk is written as soon as it arrives, so
+peak memory is one chunk however many rows are exported:
+
+    export.write_chunks(chunks, "3_months_post.csv.gz")
+    export.write_chunks(chunks, "3_months_post.parquet", compression="zstd")
+    export.write_chunks(chunks, "3_months_post.xlsx")
+
+The format is taken from the file extension unless given.  CSV can be
+gzip, bz2 or xz compressed (from a `.gz`, `.bz2` or `.xz` suffix, or
+`compression`); Parquet takes any codec `pyarrow` supports; XLSX is
+written with `openpyxl` in write-only mode, and starts a new sheet when
+one is full.  `pyarrow` and `openpyxl` (both in `requirements.txt`)
+are only needed for their formats.
+
+"""
+import bz2
+import gzip
+import lzma
+import os
+
+import pandas as pd
+
+FORMATS = ("csv", "parquet", "xlsx")
+
+CSV_COMPRESSION = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+_SUFFIX_COMPRESSION = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+XLSX_MAX_ROWS = 1048576  # including the header row
+
+
+def chunks(df, rows=100000):
+    """Yield `df` in slices of `rows` rows
+    """
+    for start in range(0, max(len(df), 1), rows):
+        yield df.iloc[start : start + rows]
+
+
+def infer_format(path):
+    """Return (format, compression) from a file name like "x.csv.gz"
+    """
+    root, suffix = os.path.splitext(path.lower())
+    compression = _SUFFIX_COMPRESSION.get(suffix)
+    if compression is not None:
+        root, suffix = os.path.splitext(root)
+    fmt = suffix.lstrip(".")
+    if fmt not in FORMATS:
+        raise ValueError(f"Can't tell the format of {path}; pass one of {FORMATS}")
+    return fmt, compression
+
+
+class CsvWriter:
+    """Append frames to a (possibly compressed) CSV, writing the header once
+    """
+
+    def __init__(self, path, compression=None):
+        if compression is not None and compression not in CSV_COMPRESSION:
+            raise ValueError(f"Unknown CSV compression {compression!r}; use one of {list(CSV_COMPRESSION)}")
+        opener = CSV_COMPRESSION.get(compression, open)
+        self._file = opener(path, "wt", newline="")
+        self._columns = None
+
+    def write(self, df):
+        if self._columns is None:
+            self._columns = list(df.columns)
+            df.to_csv(self._file, index=False)
+        else:
+            df[self._columns].to_csv(self._file, index=False, header=False)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Append frames to a Parquet file as row groups, with the first frame's schema
+    """
+
+    def __init__(self, path, compression=None):
+        import pyarrow.parquet
+
+        self._path = path
+        self._compression = compression or "snappy"
+        self._parquet = pyarrow.parquet
+        self._writer = None
+
+    def write(self, df):
+        import pyarrow
+
+        if self._writer is None:
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            self._writer = self._parquet.ParquetWriter(self._path, table.schema, compression=self._compression)
+        else:
+            table = pyarrow.Table.from_pandas(df, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class XlsxWriter:
+    """Append frames to a write-only XLSX workbook, one row at a time
+
+    Rows are streamed to a temporary file by `openpyxl`, so the workbook
+    isn't held in memory.  When a sheet reaches Excel's row limit the
+    rest go on a new sheet, with the header repeated.
+    """
+
+    def __init__(self, path, compression=None, sheet_name="data"):
+        import openpyxl
+
+        if compression is not None:
+            raise ValueError("XLSX files are already compressed; compression isn't supported")
+        self._path = path
+        self._sheet_name = sheet_name
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheets = 0
+        self._sheet = None
+        self._rows = 0
+        self._columns = None
+
+    def _new_sheet(self):
+        self._sheets += 1
+        title = self._sheet_name if self._sheets == 1 else f"{self._sheet_name}_{self._sheets}"
+        self._sheet = self._workbook.create_sheet(title)
+        self._sheet.append(self._columns)
+        self._rows = 1
+
+    def write(self, df):
+        if self._columns is None:
+            self._columns = [str(c) for c in df.columns]
+            self._new_sheet()
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            if self._rows >= XLSX_MAX_ROWS:
+                self._new_sheet()
+            self._sheet.append(row)
+            self._rows += 1
+
+    def close(self):
+        if self._columns is None:
+            self._workbook.create_sheet(self._sheet_name)
+        self._workbook.save(self._path)
+
+
+WRITERS = {"csv": CsvWriter, "parquet": ParquetWriter, "xlsx": XlsxWriter}
+
+
+def write_chunks(frames, path, fmt=None, compression=None):
+    """Write a frame, or an iterable of frames, to `path`, and return the row count
+
+    Every frame must have the same columns as the first.  `fmt` and a
+    CSV `compression` are taken from `path` unless given.
+    """
+    inferred_fmt, inferred_compression = infer_format(path) if fmt is None else (fmt, None)
+    fmt = fmt or inferred_fmt
+    compression = compression or inferred_compression
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown format {fmt!r}; use one of {FORMATS}")
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+
+    writer = WRITERS[fmt](path, compression=compression)
+    rows = 0
+    try:
+        for df in frames:
+            writer.write(df)
+            rows += len(df)
+    finally:
+        writer.close()
+    return rows
@@ -0,0 +1,169 @@
+"""Monthly weighting inputs, as one month-indexed table
+
+`priceconcessions.ipynb` builds the forecast weightings by merging the
+monthly totals with `nadp_df`, then with a calendar of day counts, then
+with `annual_profile_df`.  Each merge copies the frame, and an inner
+merge quietly drops any month one of the reference series doesn't
+cover.  Here every input is aligned to a single run of consecutive
+months by month ordinal (see `lib.monthtime`) in one pass:
+
+* NADP and `nadp_weighting`
+* work and dispensing day counts, and their ratio to `lag` months
+  earlier (`*_predict_weighting`)
+* the seasonal profile `proportion`, and its ratio to `lag` months
+  earlier (`profile_weighting`)
+
+Months a reference series doesn't cover are left as NaN rather than
+dropped, and `missing_months` says which they are.
+
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib import monthtime
+
+ASSUMED_NADP = 7.2  # percent; the discount the OpenPrescribing tool assumes
+
+# weekmasks for the day counts; bank holidays are excluded unless noted
+DAY_COUNTS = {
+    "workdays": ("Mon Tue Wed Thu Fri", True),
+    "nobhworkdays": ("Mon Tue Wed Thu Fri", False),  # bank holidays count
+    "dispdays": ("Mon Tue Wed Thu Fri Sat", True),
+}
+
+# every weighting column, for `missing_months`
+WEIGHTINGS = ["nadp_weighting", "profile_weighting"] + [f"{name}_predict_weighting" for name in DAY_COUNTS]
+
+BANK_HOLIDAYS_FILE = "bank_holidays.csv"
+BANK_HOLIDAYS_URL = "https://www.gov.uk/bank-holidays.json"
+BANK_HOLIDAYS_DIVISION = "england-and-wales"
+
+
+def bank_holidays_path(data_dir):
+    """Return the bank holiday file to read from `data_dir`, or None if there isn't one
+
+    That's `bank_holidays.csv` if it exists, otherwise the saved copy
+    of `BANK_HOLIDAYS_URL` that the notebooks read under test (see
+    `lib.fixtures`).
+    """
+    from lib import fixtures
+
+    for path in (
+        os.path.join(data_dir, BANK_HOLIDAYS_FILE),
+        fixtures.url_fixture_path(data_dir, "read_json", BANK_HOLIDAYS_URL),
+    ):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_bank_holidays(data_dir):
+    """Return the bank holiday dates in `data_dir`
+
+    Read from `bank_holidays.csv` (a `date` column) or the England and
+    Wales events of the saved gov.uk JSON (see `bank_holidays_path`).
+    Without either the work day weightings would be wrong, so
+    FileNotFoundError is raised.
+    """
+    path = bank_holidays_path(data_dir)
+    if path is None:
+        raise FileNotFoundError(
+            f"No bank holidays in {data_dir}: add {BANK_HOLIDAYS_FILE} (a date column) "
+            f"or a saved copy of {BANK_HOLIDAYS_URL}"
+        )
+    if path.endswith(".json"):
+        with open(path, encoding="utf8") as f:
+            events = json.load(f)[BANK_HOLIDAYS_DIVISION]["events"]
+        return pd.to_datetime(pd.Series([event["date"] for event in events], name="date"))
+    return pd.to_datetime(pd.read_csv(path)["date"])
+
+
+def day_counts(months, bank_holidays):
+    """Return the number of work and dispensing days in each month
+
+    `months` are month start dates and `bank_holidays` a list of dates.
+    """
+    ordinals = monthtime.to_months(pd.Series(months))
+    counts = pd.DataFrame({"month": monthtime.to_timestamps(ordinals)})
+    for name, values in _day_counts(ordinals, bank_holidays).items():
+        counts[name] = values
+    return counts
+
+
+def _day_counts(ordinals, bank_holidays):
+    """Return {name: array of day counts} for month ordinals
+    """
+    begin = monthtime.to_timestamps(ordinals).to_numpy().astype("datetime64[D]")
+    end = monthtime.to_timestamps(monthtime.shift(ordinals, 1)).to_numpy().astype("datetime64[D]")
+    holidays = pd.to_datetime(pd.Series(bank_holidays)).to_numpy().astype("datetime64[D]")
+    return {
+        name: np.busday_count(begin, end, weekmask=weekmask, holidays=holidays if exclude_holidays else [])
+        for name, (weekmask, exclude_holidays) in DAY_COUNTS.items()
+    }
+
+
+def monthly_features(months, nadp_df, bank_holidays, annual_profile_df, lag=2, assumed_nadp=ASSUMED_NADP):
+    """Return one row of weighting inputs per month
+
+    Rows are every month from the earliest to the latest of `months`,
+    in order, with a `month` column of month start timestamps.
+    `nadp_df` has `month` and `nadp` (percent), `annual_profile_df` has
+    `mon` (1-12) and `proportion`.  The lag ratios compare each month with
+    the month `lag` earlier by calendar, so they don't depend on that
+    month being in `months`.
+
+    """
+    requested = monthtime.to_months(pd.Series(months))
+    if len(requested):
+        ordinals = monthtime.month_range(requested.min(), requested.max())
+    else:
+        ordinals = np.array([], dtype=monthtime.DTYPE)
+    earlier = monthtime.shift(ordinals, -lag)
+
+    features = pd.DataFrame({"month": monthtime.to_timestamps(ordinals)})
+
+    nadp = pd.Series(
+        nadp_df["nadp"].to_numpy(dtype=np.float64), index=monthtime.to_months(nadp_df["month"])
+    )
+    if nadp.index.has_duplicates:
+        raise ValueError("nadp_df has more than one row for a month")
+    features["nadp"] = nadp.reindex(ordinals).to_numpy()
+    features["nadp_weighting"] = (1 - features["nadp"] / 100) / (1 - assumed_nadp / 100)
+
+    now = _day_counts(ordinals, bank_holidays)
+    before = _day_counts(earlier, bank_holidays)
+    for name in DAY_COUNTS:
+        features[name] = now[name]
+        features[f"{name}_predict_weighting"] = now[name] / before[name]
+
+    profile = pd.Series(
+        annual_profile_df["proportion"].to_numpy(dtype=np.float64),
+        index=annual_profile_df["mon"].to_numpy(),
+    )
+    features["mon"] = monthtime.month(ordinals)
+    features["proportion"] = profile.reindex(features["mon"]).to_numpy()
+    features["profile_weighting"] = features["proportion"] / profile.reindex(monthtime.month(earlier)).to_numpy()
+    return features
+
+
+def missing_months(features, columns=None):
+    """Return the months of `features` with a missing value, and which columns
+
+    The result has one row per month with any NaN among `columns`
+    (default all the weightings), with those column names comma-separated
+    in `missing`.
+    """
+    if columns is None:
+        columns = [c for c in WEIGHTINGS if c in features]
+    isna = features[columns].isna()
+    rows = isna.any(axis=1).to_numpy()
+    names = np.asarray(columns, dtype=object)
+    return pd.DataFrame(
+        {
+            "month": features["month"].to_numpy()[rows],
+            "missing": [", ".join(names[mask]) for mask in isna.to_numpy()[rows]],
+        }
+    )
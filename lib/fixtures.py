@@ -0,0 +1,179 @@
+"""Serve the notebooks' warehouse reads and scrapes from local fixtures
+
+Under test the notebooks shouldn't touch BigQuery or the NHSBSA website:
+the results would drift, and every notebook would spend most of its run
+waiting on the network.  With `NOTEBOOK_FIXTURES` set to a directory the
+test kernel (see `config/kernel.json`) calls `install()` before running
+any cells, which
+
+* makes `bq.cached_read(sql, csv_path=...)` return the snapshot in the
+  fixture directory with the same file name as `csv_path`, whatever
+  `use_cache` says
+* makes the pandas readers in `URL_READERS` (`pd.read_html(url, ...)`,
+  `pd.read_json(url, ...)`) read `<reader>-<hash of url>.<ext>` from
+  the fixture directory
+* refuses connections to anything but this machine, so a notebook that
+  reaches for the network fails instead of quietly passing
+
+Parsed fixtures are pickled in `NOTEBOOK_FIXTURES_CACHE` (keyed by the
+fixture's content), so when several notebooks read the same snapshot in
+one test session only the first parses the CSV.  Set
+`NOTEBOOK_FIXTURES_RECORD=1` (with network and BigQuery access) to
+save the pages and snapshots there isn't a fixture for yet.
+
+A notebook whose snapshots (`NOTEBOOK_SNAPSHOTS`) haven't all been
+recorded is skipped, with the missing files as the reason, rather than
+failing part way through (see `notebooks/conftest.py`).
+
+"""
+import functools
+import hashlib
+import os
+import pickle
+import socket
+
+FIXTURES_ENV = "NOTEBOOK_FIXTURES"
+CACHE_ENV = "NOTEBOOK_FIXTURES_CACHE"
+RECORD_ENV = "NOTEBOOK_FIXTURES_RECORD"
+
+# pandas readers that fetch URLs -> extension of their fixtures
+URL_READERS = {"read_html": "html", "read_json": "json"}
+
+# notebook -> the `bq.cached_read` snapshots it reads
+NOTEBOOK_SNAPSHOTS = {
+    "Post price concession changes.ipynb": ("ncso_dates.csv", "tariff.csv", "rx_qty.csv"),
+    "priceconcessions.ipynb": ("ncso_df.csv", "annual_profile_df.csv"),
+}
+
+
+class MissingFixture(Exception):
+    """A notebook asked for data there's no fixture for"""
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _cached(path, parse, cache_dir):
+    """Return `parse(path)`, reusing a pickle of the result from `cache_dir`
+    """
+    if cache_dir is None:
+        return parse(path)
+    with open(path, "rb") as f:
+        key = _digest(f.read())
+    cache_path = os.path.join(cache_dir, f"{os.path.basename(path)}-{key}.pkl")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    value = parse(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # written under a unique name and renamed, as other kernels may be
+    # writing the same file at the same time
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=4)
+    os.replace(tmp_path, cache_path)
+    return value
+
+
+def cached_read(fixture_dir, cache_dir=None, original=None, record=False):
+    """Return a stand-in for `bq.cached_read` reading snapshots from `fixture_dir`
+
+    When recording, a missing snapshot is fetched with `original` and
+    saved to the fixture directory.
+    """
+    import pandas as pd
+
+    def cached_read(sql, csv_path=None, use_cache=True, **kwargs):
+        if csv_path is None:
+            raise MissingFixture("bq.cached_read needs a csv_path to find its fixture")
+        path = os.path.join(fixture_dir, os.path.basename(csv_path))
+        if not os.path.exists(path):
+            if not (record and original):
+                raise MissingFixture(f"No fixture for {csv_path} (looked for {path}; set {RECORD_ENV}=1 to save it)")
+            original(sql, csv_path=path, use_cache=False, **kwargs)
+        return _cached(path, pd.read_csv, cache_dir).copy()
+
+    return cached_read
+
+
+def missing_snapshots(notebook, fixture_dir):
+    """Return the snapshots notebook `notebook` reads that aren't in `fixture_dir`
+    """
+    names = NOTEBOOK_SNAPSHOTS.get(os.path.basename(notebook), ())
+    return [name for name in names if not os.path.exists(os.path.join(fixture_dir, name))]
+
+
+def url_fixture_path(fixture_dir, reader, url):
+    """Return the fixture file for `url` read with pandas reader `reader` (e.g. "read_json")
+    """
+    return os.path.join(fixture_dir, f"{reader}-{_digest(url.encode('utf8'))}.{URL_READERS[reader]}")
+
+
+def html_fixture_path(fixture_dir, url):
+    return url_fixture_path(fixture_dir, "read_html", url)
+
+
+def url_reader(original, fixture_dir, record=False):
+    """Return a stand-in for pandas reader `original` that reads URLs from fixtures
+    """
+    reader = original.__name__
+
+    @functools.wraps(original)
+    def read_url(io, *args, **kwargs):
+        if not (isinstance(io, str) and io.startswith(("http://", "https://"))):
+            return original(io, *args, **kwargs)
+        path = url_fixture_path(fixture_dir, reader, io)
+        if not os.path.exists(path):
+            if not record:
+                raise MissingFixture(f"No fixture for {io} (looked for {path}; set {RECORD_ENV}=1 to save it)")
+            import urllib.request
+
+            with urllib.request.urlopen(io) as response, open(path, "wb") as f:
+                f.write(response.read())
+        with open(path, encoding="utf8") as f:
+            return original(f, *args, **kwargs)
+
+    return read_url
+
+
+def _is_local(address):
+    if not isinstance(address, tuple):  # Unix socket
+        return True
+    return address[0] in ("localhost", "127.0.0.1", "::1", "")
+
+
+class LocalOnlySocket(socket.socket):
+    """A socket that refuses to connect to other machines"""
+
+    def connect(self, address):
+        if not _is_local(address):
+            raise MissingFixture(f"Network access to {address} while running from fixtures")
+        return super().connect(address)
+
+
+def install(fixture_dir=None, cache_dir=None, record=None):
+    """Point the notebooks' external reads at fixtures (see above)
+
+    Arguments default to the environment variables; does nothing if
+    there's no fixture directory.
+    """
+    fixture_dir = fixture_dir or os.environ.get(FIXTURES_ENV)
+    if not fixture_dir:
+        return False
+    cache_dir = cache_dir or os.environ.get(CACHE_ENV) or None
+    record = bool(os.environ.get(RECORD_ENV)) if record is None else record
+
+    import pandas as pd
+
+    try:
+        from ebmdatalab import bq
+    except ImportError:
+        bq = None
+    if bq is not None:
+        bq.cached_read = cached_read(fixture_dir, cache_dir, bq.cached_read, record)
+    for reader in URL_READERS:
+        setattr(pd, reader, url_reader(getattr(pd, reader), fixture_dir, record))
+    if not record:
+        socket.socket = LocalOnlySocket
+    return True
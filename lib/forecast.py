@@ -0,0 +1,134 @@
+"""OpenPrescribing price concession forecasts, and their accuracy
+
+The calculations from `priceconcessions.ipynb`, as functions:
+
+* `predict_costs` - the current OpenPrescribing method: quantity
+  dispensed two months earlier x concession price per unit, less a fixed
+  7.2% discount
+* `monthly_totals` - totals and % difference per month
+* `weightings` - the NADP, calendar and seasonal profile weightings
+  (built by `lib.features`)
+* `reweight` - predictions adjusted by each combination of weightings
+* `financial_year_totals` - all of the above rolled up by financial year
+
+Differences are always `actual - predicted`, so a negative difference is
+an overestimate.  (The notebook uses `predicted - actual` for the
+day-weighted methods.)
+
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from lib import features, monthtime
+from lib.features import ASSUMED_NADP, DAY_COUNTS, day_counts  # noqa: F401
+
+# method name -> the weighting columns multiplied into the prediction
+METHODS = {
+    "nadp": ["nadp_weighting"],
+    "profile": ["profile_weighting"],
+    "profile_nadp": ["nadp_weighting", "profile_weighting"],
+    "dispdays_nadp": ["nadp_weighting", "dispdays_predict_weighting"],
+    "workdays_nadp": ["nadp_weighting", "workdays_predict_weighting"],
+    "nobhworkdays_nadp": ["nadp_weighting", "nobhworkdays_predict_weighting"],
+}
+
+
+def predict_costs(ncso_df, nadp=ASSUMED_NADP):
+    """Add `predicted_actual_cost` and `prediction_difference` to `ncso_df`
+
+    `ncso_df` has the columns of `ncso_df.csv`.
+    """
+    df = ncso_df.copy()
+    df["predicted_actual_cost"] = (
+        df["quantity_2_months_previously"] * df["predicted_nic_per_unit"] * (1 - nadp / 100)
+    )
+    df["prediction_difference"] = df["actual_cost"] - df["predicted_actual_cost"]
+    return df
+
+
+def monthly_totals(predicted_df):
+    """Return actual and predicted cost per month, and the % difference
+    """
+    sum_df = (
+        predicted_df.groupby("month")[["actual_cost", "predicted_actual_cost", "prediction_difference"]]
+        .sum()
+        .reset_index()
+        .sort_values("month")
+        .reset_index(drop=True)
+    )
+    sum_df["month"] = pd.to_datetime(sum_df["month"])
+    sum_df["perc_difference"] = sum_df["prediction_difference"] / sum_df["actual_cost"]
+    sum_df["year"] = sum_df["month"].dt.year
+    return sum_df
+
+
+def weightings(months, nadp_df, bank_holidays, annual_profile_df, lag=2):
+    """Return each month's weightings for the prediction made `lag` months earlier
+
+    See `lib.features.monthly_features`; months that a reference series
+    doesn't cover have NaN weightings.
+    """
+    return features.monthly_features(months, nadp_df, bank_holidays, annual_profile_df, lag=lag)
+
+
+def reweight(sum_df, weights_df, methods=None):
+    """Add predicted cost, difference and % difference for each method
+
+    `sum_df` is from `monthly_totals` and `weights_df` from
+    `weightings`, and they're joined once on month.  For method `m` the
+    new columns are `m_predicted_actual_cost`, `m_prediction_difference`
+    and `m_perc_difference`.  Every month is kept: where a method lacks
+    one of its weightings (e.g. months after the last published NADP)
+    its columns are NaN, with a warning naming the months.
+
+    """
+    if methods is None:
+        methods = METHODS
+    columns = sorted({c for cols in methods.values() for c in cols})
+    df = sum_df.join(weights_df.set_index("month")[columns], on="month")
+    unweighted = {}
+    for method, cols in methods.items():
+        missing = df[cols].isna().any(axis=1)
+        if missing.any():
+            months = ", ".join(df.loc[missing, "month"].dt.strftime("%Y-%m"))
+            unweighted.setdefault(months, []).append(method)
+        predicted = df["predicted_actual_cost"] * np.prod([df[c] for c in cols], axis=0)
+        df[f"{method}_predicted_actual_cost"] = predicted
+        df[f"{method}_prediction_difference"] = df["actual_cost"] - predicted
+        df[f"{method}_perc_difference"] = df[f"{method}_prediction_difference"] / df["actual_cost"]
+    for months, names in unweighted.items():
+        warnings.warn(f"No weightings for {', '.join(names)} in: {months}")
+    return df
+
+
+def financial_year(months):
+    """Return the year each financial year (April - March) ends in
+    """
+    return pd.Index(monthtime.financial_year(monthtime.to_months(months)))
+
+
+def financial_year_totals(reweighted_df, methods=None):
+    """Return costs and % differences for each method per financial year
+
+    Sums every `*actual_cost` and `*prediction_difference` column by
+    financial year (labelled by the year it ends), then recalculates the
+    % differences from the sums.  A method's totals are NaN for a year
+    with any month it has no result for, rather than a partial sum.
+
+    """
+    if methods is None:
+        methods = [m for m in METHODS if f"{m}_prediction_difference" in reweighted_df]
+    prefixes = [""] + [f"{m}_" for m in methods]
+    columns = ["actual_cost"]
+    for prefix in prefixes:
+        columns += [f"{prefix}predicted_actual_cost", f"{prefix}prediction_difference"]
+
+    grouped = reweighted_df.assign(financial_year=financial_year(reweighted_df["month"])).groupby("financial_year")
+    fy_df = grouped[columns].sum()
+    fy_df = fy_df.mask(grouped[columns].count() < grouped.size().to_numpy()[:, None])
+    fy_df["months"] = reweighted_df.groupby(financial_year(reweighted_df["month"])).size()
+    for prefix in prefixes:
+        fy_df[f"{prefix}perc_difference"] = fy_df[f"{prefix}prediction_difference"] / fy_df["actual_cost"]
+    return fy_df.reset_index()
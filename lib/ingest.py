@@ -0,0 +1,191 @@
+"""Fixed-format date parsing for the cached CSVs
+
+The notebooks read every cache with `bq.cached_read` or `pd.read_csv`
+and then convert the dates with `pd.to_datetime` or
+`astype('datetime64[ns]')`, which has to work out the format (and, for
+`ncso_df.csv`, the timezone) from the strings each time.  The formats
+don't change, so they're recorded here once per cached file:
+
+    ncso_df.csv        2017-01-01 00:00:00+00:00
+    3_months_post.csv  2022-01-01
+    test_cons.csv      10/11/1999
+
+and parsed by position.  A cache column holds only a few hundred
+distinct dates, so each distinct string is parsed once: they're laid
+out as a fixed-width byte array and the year, month and day digits are
+read straight out of the right columns.  Literal characters
+(separators, the constant "+00:00" offset) are checked, so a file whose format has drifted raises rather
+than being misread.  Dates are truncated to month starts by default,
+which is all the analysis uses, and come back timezone-naive.
+
+    df = ingest.read_cache("rx_qty", data_dir)
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib import monthtime, profiling
+
+# cached file -> {date column: format}
+SCHEMAS = {
+    "ncso_df": {"month": "%Y-%m-%d %H:%M:%S+00:00"},
+    "ncso_test_df": {"month": "%Y-%m-%d"},
+    "ncso_dates": {"month": "%Y-%m-%d"},
+    "pc_df": {"month": "%Y-%m-%d"},
+    "price_df": {"month": "%Y-%m-%d"},
+    "rx_qty": {"date_3m_start": "%Y-%m-%d"},
+    "tariff": {"date": "%Y-%m-%d"},
+    "nadp_fixed": {"month": "%Y-%m-%d"},
+    "3_months_post": {
+        "first_month": "%Y-%m-%d",
+        "last_month": "%Y-%m-%d",
+        "rx_merge_date": "%Y-%m-%d",
+        "date_3m_start": "%Y-%m-%d",
+    },
+    "test_cons": {"month": "%d/%m/%Y"},
+    "test_cons_2": {"month": "%d/%m/%Y"},
+    "test_cons_3": {"month": "%d/%m/%Y"},
+    "test_vmpp": {"date": "%d/%m/%Y"},
+}
+
+UNITS = ("M", "D")
+
+# strftime directive -> digits
+_FIELD_WIDTHS = {"Y": 4, "m": 2, "d": 2, "H": 2, "M": 2, "S": 2}
+
+
+def layout(fmt):
+    """Return (width, fields, literals) for a fixed-width date format
+
+    `fields` maps each directive ("Y", "m", ...) to its (start, end)
+    character offsets, and `literals` lists (offset, character) for
+    everything else.  Only the fixed-width directives %Y, %m, %d, %H, %M
+    and %S are supported.
+
+    """
+    fields = {}
+    literals = []
+    position = 0
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == "%":
+            directive = fmt[i + 1 : i + 2]
+            if directive not in _FIELD_WIDTHS:
+                raise ValueError(f"Unsupported directive %{directive} in {fmt!r}")
+            fields[directive] = (position, position + _FIELD_WIDTHS[directive])
+            position += _FIELD_WIDTHS[directive]
+            i += 2
+        else:
+            literals.append((position, fmt[i]))
+            position += 1
+            i += 1
+    return position, fields, literals
+
+
+def _digits(chars, start, end):
+    """Return the integers in character columns `start` to `end` of `chars`
+    """
+    digits = chars[:, start:end].astype(np.int64) - ord("0")
+    if ((digits < 0) | (digits > 9)).any():
+        raise ValueError("Non-digit characters in a numeric date field")
+    return digits @ (10 ** np.arange(end - start - 1, -1, -1))
+
+
+def parse_months(values, fmt):
+    """Return int32 month ordinals (see `lib.monthtime`) for date strings
+
+    Every string must be exactly in format `fmt`; anything else raises
+    ValueError.  Ordinals can't be missing, so neither can the dates.
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    if (codes < 0).any():
+        raise ValueError("Can't convert missing dates to months")
+    return _parse(uniques, fmt, "M")[codes]
+
+
+def parse_dates(values, fmt, unit="M"):
+    """Return timezone-naive datetime64[ns] values for date strings
+
+    With `unit` "M" the dates are truncated to month starts; with "D"
+    they keep the day (for the daily test files).  Times of day are
+    ignored either way, and missing values become NaT.
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    parsed = _parse(uniques, fmt, unit)
+    if unit == "M":
+        parsed = monthtime.to_timestamps(parsed).to_numpy()
+    parsed = np.append(parsed.astype("datetime64[ns]"), np.datetime64("NaT", "ns"))
+    return parsed[codes]
+
+
+def _parse(strings, fmt, unit):
+    """Parse an array of distinct, non-missing date strings in format `fmt`
+
+    Returns month ordinals for `unit` "M" and datetime64[D] for "D".
+    """
+    if unit not in UNITS:
+        raise ValueError(f"Unknown unit {unit!r}; use one of {UNITS}")
+    width, fields, literals = layout(fmt)
+    if "Y" not in fields or "m" not in fields or (unit == "D" and "d" not in fields):
+        raise ValueError(f"Format {fmt!r} doesn't give the {'day' if unit == 'D' else 'month'}")
+
+    # one spare column, which must be empty, catches strings that are too long
+    chars = np.asarray(strings).astype(f"S{width + 1}").view(np.uint8).reshape(len(strings), width + 1)
+    if chars[:, width].any() or (len(chars) and not chars[:, width - 1].all()):
+        raise ValueError(f"Dates don't all have the {width} characters of {fmt!r}")
+    for offset, literal in literals:
+        if (chars[:, offset] != ord(literal)).any():
+            raise ValueError(f"Dates don't all match {fmt!r} (expected {literal!r} at {offset})")
+
+    years = _digits(chars, *fields["Y"])
+    months = _digits(chars, *fields["m"])
+    if ((months < 1) | (months > 12)).any():
+        raise ValueError("Month out of range")
+    ordinals = monthtime.from_year_month(years, months)
+    if unit == "M":
+        return ordinals
+
+    days = _digits(chars, *fields["d"])
+    starts = monthtime.to_timestamps(ordinals).to_numpy().astype("datetime64[M]")
+    month_lengths = ((starts + 1).astype("datetime64[D]") - starts.astype("datetime64[D]")).astype(np.int64)
+    if ((days < 1) | (days > month_lengths)).any():
+        raise ValueError("Day out of range")
+    return starts.astype("datetime64[D]") + (days - 1)
+
+
+def read_csv(path, date_formats, unit="M", ordinals=False, **kwargs):
+    """Read a CSV and parse its date columns with fixed formats
+
+    `date_formats` maps column names to formats; columns missing from
+    the file (or left out by `usecols`) are skipped.  With `ordinals`
+    month columns are returned as month ordinals rather than timestamps.
+    Other keyword arguments go to `pd.read_csv`.
+
+    """
+    dtype = dict(kwargs.pop("dtype", None) or {})
+    dtype.update({column: object for column in date_formats})
+    with profiling.stage(f"read_csv:{os.path.basename(str(path))}") as record:
+        df = pd.read_csv(path, dtype=dtype, **kwargs)
+        for column, fmt in date_formats.items():
+            if column not in df:
+                continue
+            try:
+                if ordinals and unit == "M":
+                    df[column] = parse_months(df[column].to_numpy(), fmt)
+                else:
+                    df[column] = parse_dates(df[column].to_numpy(), fmt, unit=unit)
+            except ValueError as e:
+                raise ValueError(f"{path}: column {column!r}: {e}") from e
+        record.rows_out = len(df)
+    return df
+
+
+def read_cache(name, data_dir, unit="M", ordinals=False, **kwargs):
+    """Read cached file `name` (e.g. "rx_qty") from `data_dir` with its recorded formats
+    """
+    if name not in SCHEMAS:
+        raise KeyError(f"No date formats recorded for {name!r}; add them to SCHEMAS")
+    path = os.path.join(data_dir, f"{name}.csv")
+    return read_csv(path, SCHEMAS[name], unit=unit, ordinals=ordinals, **kwargs)
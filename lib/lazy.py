@@ -0,0 +1,388 @@
+"""A lazy Polars backend for the post-concession cost chain
+
+`Post price concession changes.ipynb` builds its result as a chain of
+eager pandas steps (unstack, groupby/transform, query, aggregate, three
+merges), each of which materialises a full intermediate frame; on
+practice-level prescribing it's the intermediates, not the inputs or the
+result, that run out of memory.  Here the same chain is one Polars query
+plan over the cached CSVs:
+
+    plan = lazy.post_concession_plan("data")
+    print(plan.explain())
+    costs = lazy.collect(plan)
+
+Nothing is read until `collect`.  The optimiser pushes the filters
+(`concession_bool > 0`, the complete-months cut-off on `rx_qty`) and the
+column selections down into the CSV scans, so unused columns are never
+parsed, and runs the plan on every core (`POLARS_MAX_THREADS` to limit
+it).  `collect(plan, streaming=True)` uses the streaming engine, which
+works through the scans in batches rather than loading them whole.
+
+The result has a row per `rx_qty.csv` row that's within the complete
+3 months, as the notebook's right merge does (`vmpp` etc. are missing
+for codes/months with no ending concession), with the columns of
+`3_months_post.csv` except that episodes are found as in
+`lib.episodes` (`months` replaces the notebook's `Consecutive`, and
+two concessions of the same length aren't merged) and a 3 month mean
+price is missing unless all 3 months have a price.
+
+`eager_post_concession` is the same chain in pandas, kept as the
+reference; check the two agree on a data directory with
+
+    python -m lib.lazy check --data-dir data
+
+Checks that need a cache the directory doesn't have (`tariff.csv` isn't
+checked in) are skipped; `--synthetic N` checks on a generated data set
+of N VMPPs as well.  Polars (in `requirements.txt`) is only needed
+for this module.
+
+"""
+import argparse
+import inspect
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from lib import ingest, monthtime, profiling
+from lib.episodes import find_episodes
+
+# months of prices averaged before and after a concession, and months of
+# prescribing counted after it ends (`roll_3m_quantity`)
+WINDOW = 3
+
+COLUMNS = [
+    "vmpp",
+    "first_month",
+    "last_month",
+    "months",
+    "bnf_code",
+    "nm",
+    "unit_qty",
+    "pre_pc_price",
+    "post_pc_price",
+    "perc_difference",
+    "rx_merge_date",
+    "date_3m_start",
+    "roll_3m_quantity",
+    "3_m_additional_cost",
+]
+
+# rows are ordered as the notebook's `rx_qty` query, latest first
+SORT_COLUMNS = ["date_3m_start", "bnf_code", "vmpp", "first_month"]
+SORT_DESCENDING = [True, False, False, False]
+
+# the caches the chain reads, with the dtypes of their other columns
+CACHES = {
+    "ncso_dates": {"vmpp": "Int64", "concession_bool": "Int64"},
+    "tariff": {"bnf_code": "String", "nm": "String", "unit_qty": "Float64", "vmpp": "Int64", "price_pence": "Float64"},
+    "rx_qty": {"bnf_code": "String", "roll_3m_quantity": "Float64"},
+}
+
+
+def _polars():
+    try:
+        import polars
+    except ImportError as e:
+        raise ImportError("The lazy backend needs Polars: pip install polars") from e
+    return polars
+
+
+def scan_cache(name, data_dir):
+    """Return a LazyFrame of cached file `name`, with month columns as dates
+
+    Dates are parsed with the formats in `ingest.SCHEMAS` and truncated
+    to month starts, as `ingest.read_cache` does.
+    """
+    pl = _polars()
+    date_formats = ingest.SCHEMAS[name]
+    dtypes = {column: getattr(pl, dtype) for column, dtype in CACHES.get(name, {}).items()}
+    dtypes.update({column: pl.String for column in date_formats})
+    frame = pl.scan_csv(os.path.join(data_dir, f"{name}.csv"), schema_overrides=dtypes)
+    return frame.with_columns(
+        pl.col(column).str.to_datetime(fmt).dt.truncate("1mo").cast(pl.Date)
+        for column, fmt in date_formats.items()
+    )
+
+
+def _ordinal(column):
+    """Return an expression for the month ordinal of date `column` (see `lib.monthtime`)
+    """
+    pl = _polars()
+    return (pl.col(column).dt.year() * 12 + pl.col(column).dt.month() - 1).cast(pl.Int32)
+
+
+def _date(ordinals):
+    """Return an expression for the month start of month ordinal expression `ordinals`
+    """
+    pl = _polars()
+    return pl.date(ordinals // 12, ordinals % 12 + 1, 1)
+
+
+def episodes_plan(ncso_dates):
+    """Return a plan for the complete concession episodes in `ncso_dates`
+
+    Like `lib.episodes.find_episodes`, less the episodes that end in the
+    last `WINDOW` months (so there's a full window of prices after them,
+    as the notebook's `last_month < @max_date`).  A run of consecutive
+    months has a constant month ordinal minus position within the VMPP,
+    so grouping on that finds the runs without building a month grid.
+    """
+    pl = _polars()
+    months = (
+        ncso_dates.filter(pl.col("concession_bool") > 0)
+        .select("vmpp", _ordinal("month").alias("m"))
+        .unique()
+        .sort("vmpp", "m")
+    )
+    return (
+        months.with_columns(run=pl.col("m") - pl.int_range(pl.len()).over("vmpp"), latest=pl.col("m").max())
+        .group_by("vmpp", "run")
+        .agg(first_m=pl.col("m").min(), last_m=pl.col("m").max(), months=pl.len(), latest=pl.col("latest").first())
+        .filter(pl.col("last_m") < pl.col("latest") - WINDOW)
+        .select("vmpp", "first_m", "last_m", pl.col("months").cast(pl.Int64))
+    )
+
+
+def window_prices_plan(tariff):
+    """Return a plan for the `WINDOW` month mean price of each VMPP, by month
+
+    `price` in month `m` is the mean over months `m - WINDOW + 1` to `m`,
+    missing unless every one of them has a price.
+    """
+    pl = _polars()
+    by_vmpp = tariff.select("vmpp", _ordinal("date").alias("m"), "price_pence").sort("vmpp", "m")
+    spans_window = (pl.col("m") - pl.col("m").shift(WINDOW - 1)).over("vmpp") == WINDOW - 1
+    return by_vmpp.select(
+        "vmpp",
+        "m",
+        pl.when(spans_window).then(pl.col("price_pence").rolling_mean(WINDOW).over("vmpp")).alias("price"),
+    )
+
+
+def post_concession_plan(data_dir):
+    """Return the lazy plan for the post-concession cost table from the caches in `data_dir`
+    """
+    pl = _polars()
+    episodes = episodes_plan(scan_cache("ncso_dates", data_dir))
+    tariff = scan_cache("tariff", data_dir)
+    prices = window_prices_plan(tariff)
+
+    # price rows are joined by the month their window ends: the month
+    # before the concession starts, and `WINDOW` months after it ends
+    pre = tariff.select("vmpp", _ordinal("date").alias("m"), "bnf_code", "nm", "unit_qty").join(
+        prices, on=["vmpp", "m"], how="left"
+    )
+    costs = (
+        episodes.with_columns(pre_m=pl.col("first_m") - 1, post_m=pl.col("last_m") + WINDOW)
+        .join(
+            pre.rename({"m": "pre_m", "price": "pre_pc_price"}), on=["vmpp", "pre_m"], how="left"
+        )
+        .join(
+            prices.rename({"m": "post_m", "price": "post_pc_price"}), on=["vmpp", "post_m"], how="left"
+        )
+        .with_columns(rx_m=pl.col("last_m") + 1)
+    )
+
+    rx = scan_cache("rx_qty", data_dir).with_columns(rx_m=_ordinal("date_3m_start"))
+    rx = rx.filter(pl.col("rx_m") <= pl.col("rx_m").max() - (WINDOW - 1))
+
+    return (
+        rx.join(costs, on=["bnf_code", "rx_m"], how="left")
+        .with_columns(
+            first_month=_date(pl.col("first_m")),
+            last_month=_date(pl.col("last_m")),
+            rx_merge_date=pl.when(pl.col("vmpp").is_not_null()).then(_date(pl.col("rx_m"))),
+            perc_difference=pl.col("post_pc_price") / pl.col("pre_pc_price") - 1,
+            additional_cost=0.01
+            * (pl.col("roll_3m_quantity") / pl.col("unit_qty"))
+            * (pl.col("post_pc_price") - pl.col("pre_pc_price")),
+        )
+        .rename({"additional_cost": "3_m_additional_cost"})
+        .select(COLUMNS)
+        .sort(SORT_COLUMNS, descending=SORT_DESCENDING, nulls_last=True)
+    )
+
+
+def collect(plan, streaming=False):
+    """Run `plan` and return the result as a pandas DataFrame
+    """
+    if "streaming" in inspect.signature(plan.collect).parameters:
+        # older Polars, as pinned for Python 3.8
+        options = {"streaming": streaming}
+    else:
+        options = {"engine": "streaming" if streaming else "auto"}
+    with profiling.stage("lazy:collect") as record:
+        result = plan.collect(**options).to_pandas()
+        record.rows_out = len(result)
+    return result
+
+
+def post_concession_costs(data_dir, streaming=False):
+    """Return the post-concession cost table for the caches in `data_dir`
+    """
+    return collect(post_concession_plan(data_dir), streaming=streaming)
+
+
+def eager_post_concession(data_dir):
+    """The same table as `post_concession_costs`, computed eagerly in pandas
+    """
+    dates_df = ingest.read_cache("ncso_dates", data_dir)
+    episodes = find_episodes(dates_df)
+    latest = monthtime.to_months(dates_df.loc[dates_df["concession_bool"] > 0, "month"]).max()
+    episodes = episodes[monthtime.to_months(episodes["last_month"]) < latest - WINDOW]
+    episodes = episodes.drop(columns="ongoing")
+
+    tariff_df = ingest.read_cache("tariff", data_dir).sort_values(["vmpp", "date"])
+    ordinals = pd.Series(monthtime.to_months(tariff_df["date"]), index=tariff_df.index)
+    spans_window = ordinals - ordinals.groupby(tariff_df["vmpp"]).shift(WINDOW - 1) == WINDOW - 1
+    rolled = tariff_df.groupby("vmpp")["price_pence"].rolling(WINDOW, WINDOW).mean()
+    tariff_df["3_month_price"] = rolled.reset_index(level=0, drop=True).where(spans_window)
+    tariff_df["pre_month"] = tariff_df["date"] + pd.DateOffset(months=1)
+    tariff_df["post_month"] = tariff_df["date"] + pd.DateOffset(months=-WINDOW)
+
+    merged = episodes.merge(
+        tariff_df[["bnf_code", "nm", "unit_qty", "vmpp", "pre_month", "3_month_price"]],
+        how="left",
+        left_on=["vmpp", "first_month"],
+        right_on=["vmpp", "pre_month"],
+    ).rename(columns={"3_month_price": "pre_pc_price"})
+    merged = merged.merge(
+        tariff_df[["vmpp", "post_month", "3_month_price"]],
+        how="left",
+        left_on=["vmpp", "last_month"],
+        right_on=["vmpp", "post_month"],
+    ).rename(columns={"3_month_price": "post_pc_price"})
+    merged["perc_difference"] = merged["post_pc_price"] / merged["pre_pc_price"] - 1
+    merged["rx_merge_date"] = merged["last_month"] + pd.DateOffset(months=1)
+
+    rx_df = ingest.read_cache("rx_qty", data_dir)
+    rx_df = rx_df[rx_df["date_3m_start"] <= rx_df["date_3m_start"].max() + pd.DateOffset(months=-(WINDOW - 1))]
+    result = rx_df.merge(
+        merged, how="left", left_on=["bnf_code", "date_3m_start"], right_on=["bnf_code", "rx_merge_date"]
+    )
+    result["3_m_additional_cost"] = (
+        0.01 * (result["roll_3m_quantity"] / result["unit_qty"]) * (result["post_pc_price"] - result["pre_pc_price"])
+    )
+    return (
+        result[COLUMNS]
+        .sort_values(SORT_COLUMNS, ascending=[not d for d in SORT_DESCENDING], kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def _normalise(df):
+    """Return `df` with comparable dtypes: dates as datetime64[ns], numbers as float64, strings as objects
+    """
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            df[column] = values.astype("datetime64[ns]")
+        elif pd.api.types.is_numeric_dtype(values):
+            df[column] = values.astype(np.float64)
+        else:
+            df[column] = values.astype(object).where(values.notna(), None)
+    return df
+
+
+def differences(lazy_df, eager_df, rtol=1e-9):
+    """Return a list of the ways two results differ (empty if they agree)
+    """
+    if list(lazy_df.columns) != list(eager_df.columns):
+        return [f"columns differ: {list(lazy_df.columns)} != {list(eager_df.columns)}"]
+    if len(lazy_df) != len(eager_df):
+        return [f"row counts differ: {len(lazy_df)} != {len(eager_df)}"]
+    lazy_df, eager_df = _normalise(lazy_df), _normalise(eager_df)
+    found = []
+    for column in lazy_df.columns:
+        a, b = lazy_df[column], eager_df[column]
+        if a.dtype == np.float64:
+            same = np.isclose(a, b, rtol=rtol, atol=0, equal_nan=True) | (a == b)
+        else:
+            same = (a == b) | (a.isna() & b.isna())
+        if not same.all():
+            row = int(np.flatnonzero(~same.to_numpy())[0])
+            found.append(f"{column}: {(~same).sum()} rows differ, first at row {row} ({a.iloc[row]!r} != {b.iloc[row]!r})")
+    return found
+
+
+def missing_caches(data_dir):
+    """Return the caches the chain reads that aren't in `data_dir`
+    """
+    return [name for name in CACHES if not os.path.exists(os.path.join(data_dir, f"{name}.csv"))]
+
+
+def check(data_dir, streaming=False):
+    """Compare the lazy and eager results on the caches in `data_dir`
+
+    Returns a list of differences, or None if `data_dir` doesn't have
+    every cache the chain reads.
+    """
+    if missing_caches(data_dir):
+        return None
+    return differences(post_concession_costs(data_dir, streaming=streaming), eager_post_concession(data_dir))
+
+
+def check_episodes(data_dir):
+    """Compare lazy episode detection with `lib.episodes` on `ncso_dates.csv` in `data_dir`
+    """
+    pl = _polars()
+    lazy_df = collect(
+        episodes_plan(scan_cache("ncso_dates", data_dir))
+        .select("vmpp", first_month=_date(pl.col("first_m")), last_month=_date(pl.col("last_m")), months="months")
+        .sort("vmpp", "first_month")
+    )
+    dates_df = ingest.read_cache("ncso_dates", data_dir)
+    latest = monthtime.to_months(dates_df.loc[dates_df["concession_bool"] > 0, "month"]).max()
+    eager_df = find_episodes(dates_df)
+    eager_df = eager_df[monthtime.to_months(eager_df["last_month"]) < latest - WINDOW]
+    return differences(lazy_df, eager_df.drop(columns="ongoing").reset_index(drop=True))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check_parser = subparsers.add_parser("check", help="compare the lazy and pandas results")
+    check_parser.add_argument("--data-dir", default="data")
+    check_parser.add_argument("--synthetic", type=int, metavar="N", help="also check a synthetic data set of N VMPPs")
+    check_parser.add_argument("--streaming", action="store_true")
+    explain_parser = subparsers.add_parser("explain", help="print the optimised plan")
+    explain_parser.add_argument("--data-dir", default="data")
+    args = parser.parse_args(argv)
+
+    if args.command == "explain":
+        missing = missing_caches(args.data_dir)
+        if missing:
+            print(f"{args.data_dir} has no {', '.join(m + '.csv' for m in missing)}", file=sys.stderr)
+            return 3
+        print(post_concession_plan(args.data_dir).explain())
+        return 0
+
+    results = {f"{args.data_dir} episodes": check_episodes(args.data_dir)}
+    results[f"{args.data_dir} costs"] = check(args.data_dir, args.streaming)
+    if args.synthetic:
+        from lib import synthetic
+
+        with tempfile.TemporaryDirectory() as directory:
+            synthetic.write_synthetic(synthetic.generate(n_vmpps=args.synthetic, n_years=4, seed=1), directory)
+            results[f"synthetic({args.synthetic}) costs"] = check(directory, args.streaming)
+
+    failed = False
+    for name, found in results.items():
+        if found is None:
+            print(f"{name}: skipped (missing caches)")
+        elif found:
+            failed = True
+            print(f"{name}: differ")
+            for line in found:
+                print(f"  {line}")
+        else:
+            print(f"{name}: agree")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""Memoise notebook cells and functions on disk
+
+Re-opening `priceconcessions.ipynb` means re-running the SQL, the NADP
+scrape, the bank holiday fetch and every transformation, even if only a
+chart cell has changed.  With
+
+    %load_ext lib.memo
+
+an expensive cell can start with `%%memo`:
+
+    %%memo
+    ncso_df = bq.cached_read(sql, csv_path=exportfile, use_cache=False)
+    ncso_df["month"] = ncso_df["month"].astype("datetime64[ns]")
+
+The cell is keyed by its source and the content of the variables it
+reads (see `dag.fingerprint`; functions defined in the notebook are
+keyed by their source).  The first run executes it and saves the
+variables it assigns or changes (`df["p"] = ...`, `df.loc[...] = ...`,
+or anything whose content differs after the run, so in-place methods
+count too), and its printed and displayed output.  Later runs
+with the same key, including after a kernel restart, restore those
+variables and replay the output instead of running it.  `%%memo
+--refresh` runs the cell anyway, and `%%memo --dir PATH` uses another
+cache.
+
+Functions can be memoised the same way, keyed by their source and
+arguments:
+
+    @memo.memoize()
+    def fetch_bank_holidays():
+        ...
+
+DataFrames are saved as Parquet when `pyarrow` is installed and the
+frame can be (everything else is pickled).  When the cache grows past
+`max_bytes` (default 2GB, or `MEMO_CACHE_BYTES`) the least recently
+used entries are removed.
+
+A memoised cell shouldn't have effects beyond its variables and its
+output (writing files, say), as those are skipped when it's replayed.
+A cell (or call) reading a value that can't be fingerprinted, such as a
+connection, just runs uncached.
+
+"""
+import argparse
+import ast
+import builtins
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+import types
+
+from lib import dag
+
+CACHE_DIR = ".memo_cache"
+MAX_BYTES = int(os.environ.get("MEMO_CACHE_BYTES", 2 * 1024 ** 3))
+
+MANIFEST_FILE = "manifest.json"
+OUTPUT_FILE = "output.pkl"
+
+# raised by `fingerprint` for values it can't hash by content
+FINGERPRINT_ERRORS = (pickle.PicklingError, TypeError, AttributeError)
+
+
+def _source_fingerprint(function):
+    try:
+        source = inspect.getsource(function)
+    except (OSError, TypeError):
+        return getattr(function, "__qualname__", repr(function))
+    return hashlib.sha256(source.encode("utf8")).hexdigest()
+
+
+def fingerprint(value):
+    """Return a content hash of `value`, for a cache key
+
+    Modules are keyed by name, and functions and classes by their
+    source, so that importing or redefining them the same way doesn't
+    change the key.  Raises one of `FINGERPRINT_ERRORS` for values that
+    can't be pickled (connections, figures).
+    """
+    if isinstance(value, types.ModuleType):
+        return f"module:{value.__name__}"
+    if isinstance(value, (types.FunctionType, type)):
+        return f"source:{_source_fingerprint(value)}"
+    return dag.fingerprint(value)
+
+
+def key(source, values):
+    """Return the cache key for `source` run with {name: value} `values`
+    """
+    return _key(source, {name: fingerprint(value) for name, value in values.items()})
+
+
+def _key(source, fingerprints):
+    digest = hashlib.sha256(source.strip().encode("utf8"))
+    for name in sorted(fingerprints):
+        digest.update(f"\0{name}={fingerprints[name]}".encode("utf8"))
+    return digest.hexdigest()[:32]
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+class Store:
+    """A directory of cached entries, each a set of named values plus output
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return (values, output) stored under `key`, or None
+        """
+        path = self._path(key)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        values = {name: _read(os.path.join(path, entry["file"]), entry["format"]) for name, entry in manifest.items()}
+        output = None
+        if os.path.exists(os.path.join(path, OUTPUT_FILE)):
+            with open(os.path.join(path, OUTPUT_FILE), "rb") as f:
+                output = pickle.load(f)
+        # the manifest's modification time is when the entry was last used
+        os.utime(manifest_path)
+        return values, output
+
+    def put(self, key, values, output=None):
+        """Store {name: value} `values` and `output` under `key`, then evict
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f".{key}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        try:
+            manifest = {}
+            for i, (name, value) in enumerate(values.items()):
+                fmt, suffix = _write(os.path.join(tmp_path, str(i)), value)
+                manifest[name] = {"file": f"{i}{suffix}", "format": fmt}
+            if output is not None:
+                with open(os.path.join(tmp_path, OUTPUT_FILE), "wb") as f:
+                    pickle.dump(output, f, protocol=4)
+            with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+                json.dump(manifest, f, indent=1)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        shutil.rmtree(self._path(key), ignore_errors=True)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def entries(self):
+        """Return [(key, bytes, last used)] for every entry, least recently used first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            manifest_path = os.path.join(self.directory, name, MANIFEST_FILE)
+            if name.startswith(".") or not os.path.exists(manifest_path):
+                continue
+            entries.append((name, _directory_size(self._path(name)), os.path.getmtime(manifest_path)))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, max_bytes=None):
+        """Remove the least recently used entries until the total is under `max_bytes`
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for name, size, _ in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(self._path(name), ignore_errors=True)
+            total -= size
+            removed.append(name)
+        return removed
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _write(path, value):
+    """Write `value` to `path` plus a suffix; return (format, suffix)
+    """
+    import pandas as pd
+
+    if isinstance(value, pd.DataFrame):
+        try:
+            value.to_parquet(path + ".parquet", engine="pyarrow")
+            return "parquet", ".parquet"
+        except (ImportError, ValueError, TypeError, NotImplementedError):
+            # no pyarrow, or a frame Parquet can't hold (mixed object
+            # columns, non-string column names); pyarrow's errors
+            # subclass these
+            if os.path.exists(path + ".parquet"):
+                os.remove(path + ".parquet")
+    with open(path + ".pkl", "wb") as f:
+        pickle.dump(value, f, protocol=4)
+    return "pickle", ".pkl"
+
+
+def _read(path, fmt):
+    if fmt == "parquet":
+        import pandas as pd
+
+        return pd.read_parquet(path, engine="pyarrow")
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def memoize(store=None):
+    """Decorator caching a function's result on disk, keyed by its source and arguments
+    """
+    store = store or Store()
+
+    def decorator(function):
+        source = f"{function.__module__}.{function.__qualname__}:{_source_fingerprint(function)}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            bound = inspect.signature(function).bind(*args, **kwargs)
+            bound.apply_defaults()
+            try:
+                entry_key = key(source, dict(bound.arguments))
+            except FINGERPRINT_ERRORS:
+                return function(*args, **kwargs)
+            cached = store.get(entry_key)
+            if cached is not None:
+                return cached[0]["result"]
+            result = function(*args, **kwargs)
+            store.put(entry_key, {"result": result})
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _base_name(node):
+    """Return the variable at the root of `df.loc[...]`, `df["p"]` or `obj.attr`, if any
+    """
+    while isinstance(node, (ast.Subscript, ast.Attribute)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+class _NameVisitor(ast.NodeVisitor):
+    """Record the names a cell reads before assigning them, and the names it assigns
+
+    Assigning to (or deleting) an item or attribute of a variable counts
+    as reading and assigning the variable.
+    """
+
+    def __init__(self):
+        self.loaded = set()
+        self.stored = set()
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            if node.id not in self.stored:
+                self.loaded.add(node.id)
+        else:
+            self.stored.add(node.id)
+
+    def visit_Assign(self, node):
+        # the value is evaluated before the targets are assigned
+        self.visit(node.value)
+        for target in node.targets:
+            self.visit(target)
+
+    def visit_AugAssign(self, node):
+        self.visit(node.value)
+        if isinstance(node.target, ast.Name) and node.target.id not in self.stored:
+            self.loaded.add(node.target.id)
+        self.visit(node.target)
+
+    def _visit_item(self, node):
+        self.generic_visit(node)
+        name = _base_name(node)
+        if not isinstance(node.ctx, ast.Load) and name is not None:
+            self.stored.add(name)
+
+    visit_Subscript = visit_Attribute = _visit_item
+
+    def visit_Import(self, node):
+        self.stored.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+
+    visit_ImportFrom = visit_Import
+
+    def visit_FunctionDef(self, node):
+        # the body runs later, so everything it reads counts as read
+        for child in node.decorator_list + node.body:
+            self.visit(child)
+        self.stored.add(node.name)
+
+    visit_AsyncFunctionDef = visit_ClassDef = visit_FunctionDef
+
+
+def cell_names(source):
+    """Return (names the cell reads before assigning, names it assigns)
+    """
+    visitor = _NameVisitor()
+    visitor.visit(ast.parse(source))
+    return visitor.loaded, visitor.stored
+
+
+def _parse_args(line):
+    parser = argparse.ArgumentParser(prog="%%memo", add_help=False)
+    parser.add_argument("--dir", default=CACHE_DIR)
+    parser.add_argument("--refresh", action="store_true")
+    return parser.parse_args(line.split())
+
+
+def memo_magic(line, cell):
+    """%%memo [--refresh] [--dir PATH]: run the cell, or replay it from the cache
+    """
+    from IPython import get_ipython
+    from IPython.display import display
+    from IPython.utils.capture import capture_output
+
+    shell = get_ipython()
+    args = _parse_args(line)
+    store = Store(args.dir)
+    loaded, stored = cell_names(cell)
+    inputs = {name: shell.user_ns[name] for name in loaded if name in shell.user_ns}
+    try:
+        before = {name: fingerprint(value) for name, value in inputs.items()}
+    except FINGERPRINT_ERRORS as e:
+        print(f"%%memo: not cached, as an input couldn't be fingerprinted ({e})")
+        shell.run_cell(cell, store_history=False)
+        return
+    entry_key = _key(cell, before)
+
+    cached = None if args.refresh else store.get(entry_key)
+    if cached is not None:
+        values, output = cached
+        shell.user_ns.update(values)
+        stdout, stderr, outputs = output or ("", "", [])
+        print(stdout, end="")
+        print(stderr, end="", file=sys.stderr)
+        for data, metadata in outputs:
+            display(data, metadata=metadata, raw=True)
+        return
+
+    with capture_output() as captured:
+        result = shell.run_cell(cell, store_history=False)
+    captured.show()
+    if not result.success:
+        return
+    # inputs changed in place (`df.sort_values(inplace=True)`) are saved too
+    changed = {
+        name for name in inputs if name in shell.user_ns and _fingerprint_or_none(shell.user_ns[name]) != before[name]
+    }
+    values = {
+        name: shell.user_ns[name]
+        for name in sorted(stored | changed)
+        if name in shell.user_ns
+        and not hasattr(builtins, name)
+        and not isinstance(shell.user_ns[name], types.ModuleType)
+    }
+    outputs = [(o.data, o.metadata) for o in captured.outputs]
+    try:
+        store.put(entry_key, values, (captured.stdout, captured.stderr, outputs))
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        print(f"%%memo: not cached, as a variable couldn't be saved ({e})")
+
+
+def _fingerprint_or_none(value):
+    try:
+        return fingerprint(value)
+    except FINGERPRINT_ERRORS:
+        return None
+
+
+def load_ipython_extension(ipython):
+    """Register `%%memo` (see `memo_magic`) with `%load_ext lib.memo`
+    """
+    ipython.register_magic_function(memo_magic, "cell", "memo")
@@ -0,0 +1,125 @@
+"""Months as integers
+
+Month arithmetic in the notebooks goes through `pd.DateOffset` over
+whole columns (`pre_month`, `post_month`, `rx_merge_date`, `max_date`),
+which is slow and warns that it isn't vectorised, and lags are taken with
+`shift(2)`, which is only right if the rows happen to be one per month in
+order.  Here a month is a single int32, its "ordinal":
+
+    ordinal = year * 12 + (month - 1)
+
+so January 2022 is 24264 and March 2022 is 24266.  (Months are counted
+from zero so that `divmod(ordinal, 12)` gives the year and month
+index.)  Shifting, differencing, ranges and financial years are then
+plain integer arithmetic, and frames can be joined or lagged on the
+ordinal without depending on row order.  Convert to timestamps only when
+reading or writing.
+
+"""
+import numpy as np
+import pandas as pd
+
+DTYPE = np.int32
+_EPOCH = 1970 * 12  # ordinal of January 1970, where datetime64[M] counts from
+
+
+def to_months(values):
+    """Return int32 month ordinals for date-like `values`
+
+    Accepts anything `pd.to_datetime` does (strings, datetimes, a
+    Series or Index); timezone-aware values are taken at their local
+    wall time.  Days within the month are ignored.
+
+    """
+    if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+        dates = values
+    else:
+        dates = pd.DatetimeIndex(pd.to_datetime(values))
+        if dates.tz is not None:
+            dates = dates.tz_localize(None)
+        dates = dates.to_numpy()
+    if np.isnat(dates).any():
+        raise ValueError("Can't convert missing dates (NaT) to months")
+    return (dates.astype("datetime64[M]").astype(np.int64) + _EPOCH).astype(DTYPE)
+
+
+def to_month(value):
+    """Return the month ordinal of a single date-like value, e.g. "2022-07"
+    """
+    return int(to_months([pd.Timestamp(value)])[0])
+
+
+def to_timestamps(ordinals):
+    """Return a DatetimeIndex of month start dates for `ordinals`
+    """
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    return pd.DatetimeIndex((ordinals - _EPOCH).astype("datetime64[M]").astype("datetime64[ns]"))
+
+
+def to_strings(ordinals, sep="-"):
+    """Return "YYYY-MM" strings for `ordinals`
+    """
+    years, months = np.divmod(np.asarray(ordinals, dtype=np.int64), 12)
+    return np.array([f"{y:04d}{sep}{m + 1:02d}" for y, m in zip(years, months)])
+
+
+def from_year_month(years, months):
+    """Return ordinals for arrays of years and months (1-12)
+    """
+    return (np.asarray(years, dtype=np.int64) * 12 + np.asarray(months, dtype=np.int64) - 1).astype(DTYPE)
+
+
+def year(ordinals):
+    """Return the calendar year of each ordinal
+    """
+    return np.asarray(ordinals) // 12
+
+
+def month(ordinals):
+    """Return the month of the year (1-12) of each ordinal
+    """
+    return np.asarray(ordinals) % 12 + 1
+
+
+def shift(ordinals, months):
+    """Return `ordinals` moved by `months` (negative is earlier)
+    """
+    return (np.asarray(ordinals) + months).astype(DTYPE)
+
+
+def diff(later, earlier):
+    """Return the number of months from `earlier` to `later`
+    """
+    return np.asarray(later, dtype=np.int64) - np.asarray(earlier, dtype=np.int64)
+
+
+def month_range(start, end):
+    """Return every ordinal from `start` to `end` inclusive
+
+    `start` and `end` can be ordinals or anything `to_month` accepts.
+    """
+    if not isinstance(start, (int, np.integer)):
+        start = to_month(start)
+    if not isinstance(end, (int, np.integer)):
+        end = to_month(end)
+    return np.arange(start, end + 1, dtype=DTYPE)
+
+
+def financial_year(ordinals, first_month=4):
+    """Return the calendar year each financial year ends in
+
+    Financial years start in `first_month` (April), so March 2022 is in
+    2022 and April 2022 in 2023.
+    """
+    # years starting in January end in the same calendar year
+    return (np.asarray(ordinals, dtype=np.int64) - (first_month - 1)) // 12 + (first_month > 1)
+
+
+def lag(values, ordinals, months):
+    """Return `values` as they were `months` before each ordinal
+
+    `values` is a Series indexed by month ordinal.  The lookup is by
+    month, not by position, so gaps and ordering don't matter; months
+    with no value give NaN.
+    """
+    return values.reindex(np.asarray(ordinals, dtype=np.int64) - months).to_numpy()
@@ -0,0 +1,148 @@
+"""Choose one pack size per BNF code and month for price concessions
+
+Concessions are granted per pack (VMPP), but prescribing data is per
+presentation (BNF code), which can have several packs.  The notebooks
+pick one pack in SQL with
+
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY ncso.date, vmpp.bnf_code
+                               ORDER BY increased_ppu DESC) = 1
+
+`pc_df.csv` holds the concession rows before that step (with
+`vmpp_code` and `qtyval`), so the choice can be made locally instead,
+and compared between policies without re-running the join:
+
+* `max_increase` - the pack with the highest increase in price per unit
+  (what the SQL does)
+* `most_prescribed` - the pack with the most packs dispensed
+* `weighted` - a per-unit price averaged over packs, weighted by packs
+  dispensed
+* `all` - every pack, unchanged
+
+Every policy adds `pc_ppu` and `dt_ppu` (concession and Drug Tariff
+price per unit, in pence) so the results can be used interchangeably.
+
+"""
+import numpy as np
+import pandas as pd
+
+from lib import monthtime
+
+POLICIES = ("max_increase", "most_prescribed", "weighted", "all")
+
+
+def group_ids(df, month_col="month", code_col="bnf_code"):
+    """Return an int64 group id for each (month, bnf_code) row
+    """
+    codes, code_idx = np.unique(df[code_col].to_numpy(), return_inverse=True)
+    return monthtime.to_months(df[month_col]).astype(np.int64) * len(codes) + code_idx
+
+
+def group_argmax(groups, values, tiebreak=None):
+    """Return the row positions of the largest `values` in each group
+
+    Rows are sorted once by (group, value descending, tiebreak) and the
+    first row of each group is taken.  Ties go to the smallest
+    `tiebreak` (or the earliest row), so unlike `ROW_NUMBER()` the result
+    is deterministic.  NaN values are only chosen if the whole group is
+    NaN.
+
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype=np.float64)
+    if tiebreak is None:
+        tiebreak = np.arange(len(groups))
+    order = np.lexsort((tiebreak, -values, groups))
+    sorted_groups = groups[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    return order[first]
+
+
+def _pack_quantities(df, pack_quantities, month_col):
+    """Return packs dispensed for each row of `df`, from `pack_quantities`
+
+    `pack_quantities` has `vmpp_code` and `quantity` columns, and
+    optionally `month_col` to give a different volume each month.
+
+    """
+    if pack_quantities is None:
+        raise ValueError("This policy needs pack_quantities (vmpp_code, quantity)")
+    on = ["vmpp_code"]
+    if month_col in pack_quantities.columns:
+        on = [month_col, "vmpp_code"]
+    volumes = pack_quantities.groupby(on)["quantity"].sum()
+    return df.join(volumes, on=on)["quantity"].fillna(0).to_numpy(dtype=np.float64)
+
+
+def select_packs(
+    pc_df, policy="max_increase", pack_quantities=None, month_col="month", code_col="bnf_code"
+):
+    """Return `pc_df` reduced to one row per month and BNF code
+
+    See the module docstring for the policies.  For `weighted`, the
+    pack-level columns (`vmpp_code`, prices per pack, `qtyval`) have no
+    single value and are dropped; `pc_ppu`, `dt_ppu` and
+    `increased_ppu` are the weighted means.
+
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown pack policy {policy!r}; use one of {POLICIES}")
+
+    df = pc_df.reset_index(drop=True)
+    qtyval = df["qtyval"].to_numpy(dtype=np.float64)
+    df["pc_ppu"] = df["pc_price_pence"].to_numpy(dtype=np.float64) / qtyval
+    df["dt_ppu"] = df["dt_price_pence"].to_numpy(dtype=np.float64) / qtyval
+    if policy == "all":
+        return df
+
+    groups = group_ids(df, month_col=month_col, code_col=code_col)
+    tiebreak = df["vmpp_code"].to_numpy() if "vmpp_code" in df.columns else None
+
+    if policy == "max_increase":
+        # same expression as the SQL, so float ties break the same way
+        increase = (df["pc_price_pence"] - df["dt_price_pence"]).to_numpy(dtype=np.float64) / qtyval
+        rows = group_argmax(groups, increase, tiebreak)
+        return df.iloc[np.sort(rows)].reset_index(drop=True)
+
+    weights = _pack_quantities(df, pack_quantities, month_col)
+    if policy == "most_prescribed":
+        rows = group_argmax(groups, weights, tiebreak)
+        return df.iloc[np.sort(rows)].reset_index(drop=True)
+
+    # weighted: bincount over dense group indices; groups with no recorded
+    # volume fall back to an unweighted mean
+    _, group_idx, counts = np.unique(groups, return_inverse=True, return_counts=True)
+    total_weight = np.bincount(group_idx, weights=weights)
+    no_volume = total_weight[group_idx] == 0
+    weights = np.where(no_volume, 1.0, weights)
+    total_weight = np.where(total_weight == 0, counts, total_weight)
+
+    first_rows = group_argmax(groups, np.zeros(len(groups)))
+    result = df.iloc[first_rows][[month_col, "name", code_col]].reset_index(drop=True)
+    for col in ("pc_ppu", "dt_ppu"):
+        result[col] = np.bincount(group_idx, weights=weights * df[col].to_numpy()) / total_weight
+    result["increased_ppu"] = result["pc_ppu"] - result["dt_ppu"]
+    result["packs"] = counts
+    return result.sort_values([month_col, code_col]).reset_index(drop=True)
+
+
+def compare_policies(pc_df, pack_quantities=None, policies=None, month_col="month", code_col="bnf_code"):
+    """Return per-unit prices under several policies side by side
+
+    One row per month and BNF code, with `pc_ppu_<policy>` and
+    `dt_ppu_<policy>` columns.  `all` is skipped because it doesn't give
+    one row per code.
+
+    """
+    if policies is None:
+        policies = [p for p in POLICIES if p != "all"]
+        if pack_quantities is None:
+            policies = ["max_increase"]
+    result = None
+    for policy in policies:
+        selected = select_packs(pc_df, policy, pack_quantities, month_col, code_col)
+        selected = selected[[month_col, code_col, "pc_ppu", "dt_ppu"]].rename(
+            columns={"pc_ppu": f"pc_ppu_{policy}", "dt_ppu": f"dt_ppu_{policy}"}
+        )
+        result = selected if result is None else result.merge(selected, on=[month_col, code_col])
+    return result
@@ -0,0 +1,418 @@
+"""Exact cost arithmetic in integer pence
+
+Drug Tariff and concession prices are whole pence per pack
+(`price_pence`, `pc_price_pence`, `dt_price_pence`), but the SQL and the
+notebooks turn them into float pounds per unit with `/(100*qtyval)`
+straight away, then multiply by quantities and sum over thousands of
+rows.  The rounding error that builds up is small, but it's enough to
+show in reconciliation diffs and to make totals depend on row order.
+
+Here a cost is kept exact until it's presented.  `pack_costs(price,
+quantity, qtyval)` is `price x quantity / qtyval` pence: an int64 array
+of whole pence plus an int64 array of remainders over one shared
+denominator (an `Amounts`).  Sums, differences, group totals and
+discounts are integer operations on those arrays, so
+
+    costs = pence.pack_costs(pc_df["pc_price_pence"], quantity, pc_df["qtyval"])
+    keys, totals = costs.group_sum(pc_df["month"])
+    totals.pence()        # int64, rounded half to even, once
+    totals.pounds()       # float, for display
+
+give the same answer in any order.  Quantities and pack sizes may have
+decimals (e.g. a pack of 13.5 ml); they're scaled to integers by the
+smallest power of ten that makes them exact.  Anything that would
+overflow int64 raises `OverflowError` rather than wrapping.
+
+When only totals are needed, `group_costs` (or `group_totals`, on a
+frame) sums `price x quantity` per group, pack size and discount before
+dividing, so there's one division per cell rather than per row.
+
+A change in the 3 month mean price is exact too: the difference of the
+two 3 month sums, with `qtyval * 3` as the pack size.
+
+"""
+import functools
+import math
+
+import numpy as np
+import pandas as pd
+
+MAX_SCALE = 10 ** 6
+
+# values checked before trying a scale on a whole array
+SAMPLE = 1024
+
+# largest magnitude any intermediate is allowed to reach
+LIMIT = 2 ** 62
+
+
+def integers(values, max_scale=MAX_SCALE):
+    """Return (int64 array, scale) such that `values == array / scale` exactly
+
+    `scale` is the smallest power of ten up to `max_scale` that makes
+    every value whole; raises ValueError if there isn't one, or if any
+    value is missing.
+    """
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64, copy=False), 1
+    whole, scale = _whole_floats(values, max_scale)
+    return whole.astype(np.int64), scale
+
+
+def _whole_floats(values, max_scale=MAX_SCALE):
+    """Return `integers(values)` as float64 (exact, as they're below 2 ** 62)
+    """
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        _check(_bound(values))
+        return values.astype(np.float64), 1
+    values = values.astype(np.float64, copy=False)
+    scales = [10 ** i for i in range(int(math.log10(max_scale)) + 1)]
+    largest = max(abs(float(values.max(initial=0))), abs(float(values.min(initial=0))))
+    if not math.isfinite(largest):
+        raise ValueError("Missing or infinite values can't be used in exact costs")
+    # exact first (whole numbers, halves), then allowing for binary
+    # representation error (0.3 * 10 != 3.0); most scales are ruled out
+    # by the first few values without a pass over the whole array
+    for exact in (True, False):
+        for scale in scales:
+            _check(largest * scale)
+            if not _whole(values.ravel()[:SAMPLE] * scale, exact)[0]:
+                continue
+            whole, rounded = _whole(values * scale if scale > 1 else values, exact)
+            if whole:
+                return rounded, scale
+    raise ValueError(f"Values have more than {int(math.log10(max_scale))} decimal places")
+
+
+def _whole(values, exact):
+    """Return (whether `values` are whole numbers, `values` rounded)
+    """
+    rounded = np.rint(values)
+    if exact:
+        return np.array_equal(rounded, values), rounded
+    return np.allclose(values, rounded, rtol=1e-12, atol=1e-9), rounded
+
+
+def _check(bound):
+    if bound >= LIMIT:
+        raise OverflowError("Exact cost arithmetic would overflow int64")
+
+
+def _lcm(*values):
+    """Return the lowest common multiple of positive ints (`math.lcm` needs Python 3.9)
+    """
+    return functools.reduce(lambda a, b: a * b // math.gcd(a, b), values, 1)
+
+
+def _bound(values):
+    values = np.asarray(values)
+    if not values.size:
+        return 0
+    return max(abs(int(values.max())), abs(int(values.min())))
+
+
+class Amounts:
+    """An array of exact amounts in pence: `whole + numerator / denominator`
+
+    `whole` and `numerator` are int64 arrays of the same shape, with
+    `0 <= numerator < denominator`; `denominator` is a positive int
+    shared by every element.
+    """
+
+    def __init__(self, whole, numerator=None, denominator=1):
+        self.whole = np.asarray(whole, dtype=np.int64)
+        self.numerator = np.zeros_like(self.whole) if numerator is None else np.asarray(numerator, dtype=np.int64)
+        self.denominator = int(denominator)
+
+    @classmethod
+    def from_fraction(cls, numerator, denominator):
+        """Return `numerator / denominator` pence, for int64 arrays of both
+
+        The denominators are put over their lowest common multiple.
+        """
+        numerator = np.asarray(numerator, dtype=np.int64)
+        denominator = np.broadcast_to(np.asarray(denominator, dtype=np.int64), numerator.shape)
+        if (denominator <= 0).any():
+            raise ValueError("Denominators must be positive")
+        whole, remainder = np.divmod(numerator, denominator)
+        common = _lcm(*(int(d) for d in pd.unique(denominator.ravel())))
+        _check(common)
+        return cls(whole, remainder * (common // denominator), common)._reduced()
+
+    def __len__(self):
+        return len(self.whole)
+
+    def __repr__(self):
+        return f"Amounts({self.pounds()!r} pounds)"
+
+    def _reduced(self):
+        """Return the same amounts over the smallest shared denominator
+        """
+        divisor = math.gcd(self.denominator, int(np.gcd.reduce(self.numerator, axis=None, initial=0)))
+        if divisor <= 1:
+            return self
+        return Amounts(self.whole, self.numerator // divisor, self.denominator // divisor)
+
+    def _over(self, denominator):
+        """Return the numerators over `denominator`, a multiple of this one
+        """
+        factor = denominator // self.denominator
+        _check(_bound(self.numerator) * factor)
+        return self.numerator * factor
+
+    def _carry(self, whole, numerator, denominator):
+        """Return Amounts from numerators that may be >= `denominator` (or negative)
+        """
+        carry, numerator = np.divmod(numerator, denominator)
+        _check(_bound(whole) + _bound(carry))
+        return Amounts(whole + carry, numerator, denominator)._reduced()
+
+    def __add__(self, other):
+        if not isinstance(other, Amounts):
+            other = Amounts(other)
+        common = _lcm(self.denominator, other.denominator)
+        _check(_bound(self.whole) + _bound(other.whole))
+        return self._carry(self.whole + other.whole, self._over(common) + other._over(common), common)
+
+    def __neg__(self):
+        has_fraction = self.numerator > 0
+        return Amounts(-self.whole - has_fraction, np.where(has_fraction, self.denominator - self.numerator, 0), self.denominator)
+
+    def __sub__(self, other):
+        if not isinstance(other, Amounts):
+            other = Amounts(other)
+        return self + (-other)
+
+    def multiply(self, numerator, denominator=1):
+        """Return the amounts times `numerator / denominator` (int64 array or int, and int)
+        """
+        numerator = np.asarray(numerator, dtype=np.int64)
+        denominator = int(denominator)
+        if denominator <= 0:
+            raise ValueError("Denominators must be positive")
+        factor = _bound(numerator)
+        _check(_bound(self.whole) * factor)
+        _check(self.denominator * denominator)
+        # (w + n / d) * k / b = (w * k) / b + n * k / (d * b)
+        whole, remainder = np.divmod(self.whole * numerator, denominator)
+        _check(_bound(remainder) * self.denominator + self.denominator * factor)
+        return self._carry(whole, remainder * self.denominator + self.numerator * numerator, self.denominator * denominator)
+
+    def discount(self, percent):
+        """Return the amounts less `percent` per cent (a number or array, e.g. NADP)
+        """
+        keep, scale = integers(100 - np.asarray(percent, dtype=np.float64))
+        return self.multiply(keep, 100 * scale)
+
+    def sum(self):
+        """Return the total, as an Amounts of one element
+        """
+        _check(_bound(self.whole) * max(len(self.whole.ravel()), 1))
+        _check(self.denominator * max(len(self.numerator.ravel()), 1))
+        return self._carry(self.whole.sum(keepdims=True).ravel(), self.numerator.sum(keepdims=True).ravel(), self.denominator)
+
+    def group_sum(self, groups):
+        """Return (sorted unique groups, Amounts of each group's total)
+
+        `groups` is an array, or a list of arrays for several keys, as
+        long as the amounts; the groups come back as an Index (or a
+        MultiIndex).
+        """
+        codes, keys = _group_codes(groups)
+        counts = np.bincount(codes, minlength=len(keys))
+        largest = int(counts.max(initial=0))
+        _check(_bound(self.whole) * largest)
+        _check(self.denominator * largest)
+        whole = _integer_bincount(codes, self.whole, len(keys), largest)
+        numerator = _integer_bincount(codes, self.numerator, len(keys), largest)
+        return keys, self._carry(whole, numerator, self.denominator)
+
+    def pence(self):
+        """Return the amounts rounded to whole pence, half to even
+        """
+        twice = 2 * self.numerator
+        up = (twice > self.denominator) | ((twice == self.denominator) & (self.whole % 2 == 1))
+        return self.whole + up
+
+    def pounds(self):
+        """Return the amounts in pounds as floats, for presentation
+        """
+        return (self.whole + self.numerator / self.denominator) / 100
+
+    def fractions(self):
+        """Return the exact amounts in pence as a list of `fractions.Fraction`
+        """
+        from fractions import Fraction
+
+        return [Fraction(int(w) * self.denominator + int(n), self.denominator) for w, n in zip(self.whole.ravel(), self.numerator.ravel())]
+
+
+def _factorize(values):
+    """Return (codes, sorted uniques) like `pd.factorize(values, sort=True)`
+
+    Integers in a narrow range (month ordinals, small ids) are numbered
+    by offset from the smallest, without hashing or sorting.
+    """
+    if np.issubdtype(values.dtype, np.integer) and len(values):
+        low = int(values.min())
+        span = int(values.max()) - low + 1
+        if span <= 4 * len(values):
+            offsets = values - low if low else values
+            present = np.bincount(offsets, minlength=span) > 0
+            if present.all():
+                return offsets, np.arange(low, low + span, dtype=values.dtype)
+            numbers = np.cumsum(present) - 1
+            return numbers[offsets], np.flatnonzero(present).astype(values.dtype) + low
+    return pd.factorize(values, sort=True)
+
+
+def _group_codes(groups):
+    """Return (group number of each row, sorted unique groups) for one or more key arrays
+    """
+    if not (isinstance(groups, (list, tuple)) and len(groups) and np.ndim(groups[0])):
+        codes, uniques = _factorize(np.asarray(groups))
+        return codes, pd.Index(uniques)
+    if len(groups) == 1:
+        codes, uniques = _factorize(np.asarray(groups[0]))
+        return codes, pd.MultiIndex.from_arrays([uniques])
+    # number each key, combine the numbers, then number the combinations
+    level_codes, levels = zip(*(_factorize(np.asarray(g)) for g in groups))
+    combined = np.zeros(len(level_codes[0]), dtype=np.int64)
+    for codes, level in zip(level_codes, levels):
+        combined = combined * len(level) + codes
+    codes, uniques = pd.factorize(combined, sort=True)
+    keys = []
+    for level in reversed(levels):
+        uniques, key_codes = np.divmod(uniques, len(level))
+        keys.append(np.asarray(level)[key_codes])
+    return codes, pd.MultiIndex.from_arrays(keys[::-1])
+
+
+def _integer_bincount(codes, values, length, largest):
+    """Return exact int64 sums of int64 `values` by `codes`
+
+    `np.bincount` sums in float64, which is exact while every partial sum
+    is a whole number below 2 ** 53; larger values are split into 26 bit
+    digits, summed separately and recombined.  `largest` is the most
+    values any code has.
+    """
+    if _bound(values) * max(largest, 1) < 2 ** 53:
+        return np.bincount(codes, weights=values, minlength=length).astype(np.int64)
+    high, low = values >> 26, values & (2 ** 26 - 1)
+    return _integer_bincount(codes, high, length, largest) * 2 ** 26 + _integer_bincount(codes, low, length, largest)
+
+
+def _fractions(price_pence, quantity, qtyval, percent_off=None):
+    """Return int64 (numerator, denominator) arrays of each row's cost in pence
+    """
+    price, price_scale = integers(price_pence)
+    if price_scale != 1:
+        raise ValueError("Pack prices must be whole pence")
+    quantity, quantity_scale = integers(quantity)
+    qtyval, qtyval_scale = integers(qtyval)
+    if (qtyval <= 0).any():
+        raise ValueError("Pack sizes must be positive")
+    # price * (q / qs) / (v / vs) = price * q * vs / (v * qs)
+    numerator_bound = _bound(price) * _bound(quantity) * qtyval_scale
+    denominator_bound = _bound(qtyval) * quantity_scale
+    _check(numerator_bound)
+    _check(denominator_bound)
+    numerator = price * quantity
+    if qtyval_scale > 1:
+        numerator *= qtyval_scale
+    denominator = qtyval * quantity_scale if quantity_scale > 1 else qtyval
+    if percent_off is not None:
+        keep, keep_scale = integers(100 - np.asarray(percent_off, dtype=np.float64))
+        _check(numerator_bound * _bound(keep))
+        _check(denominator_bound * 100 * keep_scale)
+        numerator = numerator * keep
+        denominator = denominator * (100 * keep_scale)
+    return numerator, denominator
+
+
+def pack_costs(price_pence, quantity, qtyval, percent_off=None):
+    """Return the exact cost of `quantity` units at `price_pence` per pack of `qtyval`
+
+    `price_pence` must be whole pence; `quantity` and `qtyval` may have
+    decimals (see `integers`).  `percent_off` (a number or an array, e.g.
+    the NADP) is taken off each cost.
+    """
+    return Amounts.from_fraction(*_fractions(price_pence, quantity, qtyval, percent_off))
+
+
+def group_costs(groups, price_pence, quantity, qtyval, percent_off=None):
+    """Return (sorted unique groups, Amounts) of the total `pack_costs` per group
+
+    Rows are put into cells by group, pack size and discount, `price x
+    quantity` is summed exactly per cell (in int64, see
+    `_integer_bincount`), and only those sums are divided by the pack
+    size and discounted, so there's one division per cell rather than
+    per row.
+
+    With quantities scaled to whole numbers (see `integers`), this
+    raises OverflowError unless
+
+        max |price| x max |quantity| x scale x rows in the largest cell < 2 ** 62
+
+    e.g. prices up to £1,000 a pack and 2 decimal place quantities up to
+    1e6 allow about 460,000 rows in a cell; the discount doesn't count
+    towards it.  The cells' denominators (pack size x quantity scale x
+    100 x discount scale, over their common multiple) are checked too.
+    """
+    codes, keys = _group_codes(groups)
+    price, price_scale = integers(price_pence)
+    if price_scale != 1:
+        raise ValueError("Pack prices must be whole pence")
+    units, units_scale = integers(quantity)
+    packs, pack_scale = integers(qtyval)
+    pack_codes, packs = _factorize(packs)
+    if (packs <= 0).any():
+        raise ValueError("Pack sizes must be positive")
+    if percent_off is None:
+        keep_codes, keeps, keep_scale = np.zeros(len(codes), dtype=np.int64), np.array([1]), None
+    else:
+        keep, keep_scale = integers(100 - np.asarray(percent_off, dtype=np.float64))
+        keep_codes, keeps = _factorize(np.broadcast_to(keep, codes.shape))
+
+    # number the (group, pack, discount) cells that have rows
+    combined = (codes.astype(np.int64) * len(packs) + pack_codes) * len(keeps) + keep_codes
+    cell_codes, cells = _factorize(combined)
+    largest = int(np.bincount(cell_codes, minlength=len(cells)).max(initial=0))
+    _check(_bound(price) * _bound(units) * max(largest, 1))
+    sums = _integer_bincount(cell_codes, price * units, len(cells), largest)
+
+    cells, keep_of_cell = np.divmod(cells, len(keeps))
+    group_of_cell, pack_of_cell = np.divmod(cells, len(packs))
+    # price x (units / units_scale) / (pack / pack_scale)
+    costs = Amounts.from_fraction(sums, packs[pack_of_cell].astype(np.int64) * units_scale)
+    if keep_scale is not None:
+        costs = costs.multiply(keeps[keep_of_cell].astype(np.int64) * pack_scale, 100 * keep_scale)
+    elif pack_scale > 1:
+        costs = costs.multiply(pack_scale)
+    # every group has at least one cell, so the cells' groups are 0 ... len(keys) - 1
+    return keys, costs.group_sum(group_of_cell)[1]
+
+
+def group_totals(df, by, price_col, quantity_col, qtyval_col="qtyval", percent_off=None, name="cost"):
+    """Return the exact cost of each row of `df` totalled by the `by` columns
+
+    The result has the `by` columns, `<name>_pence` (int64, rounded once
+    per group) and `<name>` in pounds.  `percent_off` (a number or a
+    column name, e.g. the NADP) is taken off each row's cost.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    if isinstance(percent_off, str):
+        percent_off = df[percent_off].to_numpy()
+    keys, totals = group_costs(
+        [df[column].to_numpy() for column in by] if len(by) > 1 else df[by[0]].to_numpy(),
+        df[price_col].to_numpy(),
+        df[quantity_col].to_numpy(),
+        df[qtyval_col].to_numpy(),
+        percent_off,
+    )
+    result = pd.DataFrame({column: keys.get_level_values(i) for i, column in enumerate(by)}, copy=False)
+    result[f"{name}_pence"] = totals.pence()
+    result[name] = result[f"{name}_pence"] / 100
+    return result
@@ -0,0 +1,225 @@
+"""Additional cost of Drug Tariff price changes after concessions end
+
+"Post price concession changes" compares the mean Drug Tariff price of
+a pack in the 3 months before a concession starts with the mean in the 3
+months after it ends, and multiplies the difference by the number of
+packs prescribed in the 3 months after it ends (`3_m_additional_cost`).
+
+This module does the same for several post-concession horizons (e.g. 1,
+3, 6 and 12 months of prescribing) and several pre/post price window
+lengths in one go.  Prices and quantities are laid out as dense month
+arrays once, and every episode x horizon x window combination is looked
+up by integer month offsets and broadcast in NumPy, rather than merged.
+
+The result is driven by the episodes, so bnf_code/months without an
+episode don't appear (the notebook's right merge to `rx_df` adds a row
+with a NaN vmpp for each of them).
+
+"""
+import numpy as np
+import pandas as pd
+
+from lib import monthtime
+from lib.rolling import build_quantity_grid, rolling_sum
+
+HORIZONS = (1, 3, 6, 12)
+PRICE_WINDOWS = (3,)
+
+
+def _code_index(grid, codes):
+    """Return (column index, found) for each code in `codes`
+    """
+    codes = np.asarray(codes)
+    if not len(grid.codes):
+        return np.zeros(codes.shape, dtype=np.int64), np.zeros(codes.shape, dtype=bool)
+    idx = np.clip(np.searchsorted(grid.codes, codes), 0, len(grid.codes) - 1)
+    return idx, grid.codes[idx] == codes
+
+
+def _lookup(grid, table, months, codes):
+    """Return `table[month, code]` for each (month ordinal, code) pair
+
+    `table` is indexed like `grid.values`; pairs whose month or code
+    isn't in the grid give NaN.
+
+    """
+    months = np.asarray(months, dtype=np.int64)
+    code_idx, found = _code_index(grid, codes)
+    month_idx = months - (grid.months[0] if len(grid.months) else 0)
+    ok = found & (month_idx >= 0) & (month_idx < table.shape[0])
+    result = np.full(months.shape, np.nan)
+    result[ok] = table[month_idx[ok], code_idx[ok]]
+    return result
+
+
+def window_mean_prices(tariff_df, width, month_col="date", vmpp_col="vmpp", price_col="price_pence"):
+    """Return (grid, means) where `means` is a trailing `width` month mean
+
+    `means[m]` is the mean price over months `m - width + 1` to `m`, and
+    is NaN unless a price exists for every one of those months, matching
+    `rolling(width, width).mean()` in the notebook.
+
+    """
+    grid = build_quantity_grid(tariff_df, month_col=month_col, code_col=vmpp_col, value_col=price_col)
+    sums = rolling_sum(grid.values, width, "backward")
+    counts = rolling_sum(grid.observed, width, "backward")
+    means = np.where(counts == width, sums / width, np.nan)
+    return grid, means
+
+
+def post_concession_costs(
+    episodes,
+    tariff_df,
+    rx_df,
+    horizons=HORIZONS,
+    price_windows=PRICE_WINDOWS,
+    rx_month_col="month",
+    rx_quantity_col="quantity",
+    complete_only=True,
+):
+    """Return the tidy additional cost table for every episode
+
+    `episodes` comes from `lib.episodes.find_episodes`.  `tariff_df` is
+    the Drug Tariff price history (`vmpp`, `date`, `price_pence`,
+    `bnf_code`, `nm`, `unit_qty`, as fetched in the post-concession
+    notebook), and `rx_df` is monthly prescribing at BNF code level
+    (`rx_month_col`, `bnf_code`, `rx_quantity_col`).
+
+    For a price window of `w` months the pre-concession price is the mean
+    over the `w` months before `first_month`, and the post-concession
+    price is the mean over the `w` months after `last_month`.  For a
+    horizon of `h` months the quantity is the total prescribed in the `h`
+    months after `last_month`.  The additional cost (in pounds) is
+
+        quantity / unit_qty * (post_pc_price - pre_pc_price) / 100
+
+    There is one row per episode, horizon and price window.  Ongoing
+    episodes are skipped, and with `complete_only` rows are dropped where
+    there isn't enough price or prescribing data to cover the windows.
+
+    """
+    return pd.concat(
+        iter_post_concession_costs(
+            episodes,
+            tariff_df,
+            rx_df,
+            horizons=horizons,
+            price_windows=price_windows,
+            rx_month_col=rx_month_col,
+            rx_quantity_col=rx_quantity_col,
+            complete_only=complete_only,
+        ),
+        ignore_index=True,
+    )
+
+
+def iter_post_concession_costs(
+    episodes,
+    tariff_df,
+    rx_df,
+    horizons=HORIZONS,
+    price_windows=PRICE_WINDOWS,
+    rx_month_col="month",
+    rx_quantity_col="quantity",
+    complete_only=True,
+    chunk_size=None,
+):
+    """Yield the rows of `post_concession_costs` for `chunk_size` episodes at a time
+
+    The price and prescribing arrays are built once; only the table for
+    the current chunk of episodes is held in memory, so results can be
+    written out (see `lib.export`) as they're produced.  With no
+    `chunk_size` there's a single chunk.
+
+    """
+    horizons = np.asarray(horizons, dtype=np.int64)
+    price_windows = np.asarray(price_windows, dtype=np.int64)
+
+    meta = tariff_df.drop_duplicates("vmpp", keep="last").set_index("vmpp")[
+        ["bnf_code", "nm", "unit_qty"]
+    ]
+    episodes = episodes[~episodes["ongoing"]] if "ongoing" in episodes else episodes
+    episodes = episodes.join(meta, on="vmpp", how="inner").reset_index(drop=True)
+
+    price_means = [window_mean_prices(tariff_df, int(width)) for width in price_windows]
+
+    # a code with no prescribing at all has no column, and counts as zero
+    rx_grid = build_quantity_grid(
+        rx_df, month_col=rx_month_col, code_col="bnf_code", value_col=rx_quantity_col
+    )
+    cumulative = np.zeros((rx_grid.values.shape[0] + 1, len(rx_grid.codes)))
+    np.cumsum(rx_grid.values, axis=0, out=cumulative[1:])
+
+    step = chunk_size or max(len(episodes), 1)
+    for start in range(0, max(len(episodes), 1), step):
+        yield _episode_costs(
+            episodes.iloc[start : start + step],
+            price_windows,
+            price_means,
+            horizons,
+            rx_grid,
+            cumulative,
+            complete_only,
+        )
+
+
+def _episode_costs(episodes, price_windows, price_means, horizons, rx_grid, cumulative, complete_only):
+    """Return the tidy cost table for `episodes`, given the prepared arrays
+    """
+    vmpps = episodes["vmpp"].to_numpy()
+    bnf_codes = episodes["bnf_code"].to_numpy()
+    unit_qty = pd.to_numeric(episodes["unit_qty"]).to_numpy(dtype=np.float64)
+    first = monthtime.to_months(episodes["first_month"])
+    last = monthtime.to_months(episodes["last_month"])
+
+    # prices: (episodes, windows)
+    pre = np.empty((len(episodes), len(price_windows)))
+    post = np.empty_like(pre)
+    for j, (width, (price_grid, means)) in enumerate(zip(price_windows, price_means)):
+        pre[:, j] = _lookup(price_grid, means, first - 1, vmpps)
+        post[:, j] = _lookup(price_grid, means, last + width, vmpps)
+
+    # quantities: (episodes, horizons), from one cumulative sum of the grid
+    n_months = rx_grid.values.shape[0]
+    code_idx, found = _code_index(rx_grid, bnf_codes)
+    rx_start = last + 1
+    lo = (rx_start - (rx_grid.months[0] if n_months else 0))[:, None]
+    hi = lo + horizons[None, :]
+    covered = (lo >= 0) & (hi <= n_months)
+    lo = np.clip(lo, 0, n_months)
+    hi = np.clip(hi, 0, n_months)
+    cols = code_idx[:, None]
+    quantity = np.where(found[:, None], cumulative[hi, cols] - cumulative[lo, cols], 0.0)
+    quantity[~covered] = np.nan
+
+    # costs: (episodes, horizons, windows)
+    price_change = post - pre
+    cost = 0.01 * (quantity / unit_qty[:, None])[:, :, None] * price_change[:, None, :]
+
+    e_idx, h_idx, w_idx = (a.ravel() for a in np.indices(cost.shape))
+    costs = episodes.iloc[e_idx].reset_index(drop=True)
+    costs["horizon"] = horizons[h_idx]
+    costs["price_window"] = price_windows[w_idx]
+    costs["rx_start_month"] = monthtime.to_timestamps(rx_start[e_idx])
+    costs["quantity"] = quantity[e_idx, h_idx]
+    costs["pre_pc_price"] = pre[e_idx, w_idx]
+    costs["post_pc_price"] = post[e_idx, w_idx]
+    costs["perc_difference"] = costs["post_pc_price"] / costs["pre_pc_price"] - 1
+    costs["additional_cost"] = cost.ravel()
+    if complete_only:
+        costs = costs[costs["additional_cost"].notna()].reset_index(drop=True)
+    return costs
+
+
+def monthly_totals(costs):
+    """Return total additional cost per month, horizon and price window
+
+    The month is `rx_start_month`, the first month after the concession
+    ended, as in the notebook's `rx_sum_df`.
+
+    """
+    return (
+        costs.groupby(["rx_start_month", "horizon", "price_window"])["additional_cost"]
+        .sum()
+        .reset_index()
+    )
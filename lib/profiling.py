@@ -0,0 +1,397 @@
+"""Per-stage profiling of the pipeline
+
+When a monthly run is slow it isn't obvious whether the time goes on
+warehouse queries, CSV parsing, the month grids or drawing charts.  With
+profiling switched on every instrumented stage records:
+
+* `wall_seconds` and `cpu_seconds` (CPU time of the thread running it;
+  for stages run with `processes=True`, of the whole process plus the
+  worker processes that finished during the stage)
+* `peak_rss_delta_bytes` - how far the stage raised the process's peak
+  resident memory (0 if an earlier stage already went higher)
+* `rows_in` and `rows_out` - rows of the frames it was given and returned
+* `cache` - "hit" or "miss", for stages that can be served from a cache
+
+Each record is appended to a JSON-lines trace file as the stage ends,
+and the totals per stage can be written as a Prometheus textfile (for
+node_exporter's textfile collector).  Switch it on from the command line:
+
+    python -m lib --profile trace.jsonl --prometheus lib.prom run
+
+or in a notebook:
+
+    %load_ext lib.profiling
+    %profile_stages on trace.jsonl
+    ...
+    %profile_stages summary
+
+The `lib.dag` stages, CSV reads, chart rendering and report sections are
+instrumented already.  In a notebook `instrument_notebook()` (run by
+`%profile_stages on`) also wraps `bq.cached_read`, `pd.read_html` (the
+NADP scrape), `pd.merge`, `DataFrame.merge` and the aggregations and
+`transform` of `DataFrameGroupBy` and `SeriesGroupBy`; wrap anything else with `stage` or `profiled`.  Switched off, a stage costs one attribute check.
+
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRIC_PREFIX = "price_concessions_stage"
+
+
+def peak_rss():
+    """Return the peak resident memory of this process in bytes, or None
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_cpu_time():
+    """Return the CPU seconds of this process and its finished child processes
+
+    Child processes count once they've exited and been waited for, as a
+    `ProcessPoolExecutor`'s workers are when the `with` block ends.
+    """
+    seconds = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds += children.ru_utime + children.ru_stime
+    return seconds
+
+
+def rows(value):
+    """Return the number of rows in `value`, or None if it isn't tabular
+
+    Frames, Series and arrays count their rows; tuples, lists and dicts
+    the total of the tabular values they hold.
+    """
+    if hasattr(value, "shape") and getattr(value, "ndim", 0) >= 1:
+        return int(value.shape[0])
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        counts = [rows(v) for v in value]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+    return None
+
+
+class Record:
+    """What one run of a stage did; fill in `rows_out` and `cache` as you go
+    """
+
+    def __init__(self, name, rows_in=None, cache=None, **extra):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.cache = cache
+        self.extra = extra
+
+    def fields(self):
+        fields = OrderedDict(stage=self.name)
+        fields.update(getattr(self, "timings", {}))
+        fields.update(rows_in=self.rows_in, rows_out=self.rows_out, cache=self.cache)
+        fields.update(self.extra)
+        return fields
+
+
+class Profiler:
+    """Collects stage records, and writes them to a trace file if given
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_path = None
+        self.prometheus_path = None
+        self.records = []
+        self._lock = threading.Lock()
+
+    def enable(self, trace_path=None, prometheus_path=None):
+        """Start recording; append records to `trace_path` as they finish
+        """
+        self.trace_path = trace_path
+        self.prometheus_path = prometheus_path
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording, and write the Prometheus textfile if one was asked for
+        """
+        if self.enabled and self.prometheus_path:
+            write_prometheus(self.prometheus_path, self.records)
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None, cache=None, processes=False, **extra):
+        """Time the block as stage `name`, yielding its `Record`
+
+        CPU time is the running thread's, or with `processes` the whole
+        process's and its workers' (see `process_cpu_time`), for stages
+        that hand their work to a process pool.
+        """
+        record = Record(name, rows_in, cache, **extra)
+        if not self.enabled:
+            yield record
+            return
+        cpu_time = process_cpu_time if processes else time.thread_time
+        rss_before = peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = cpu_time()
+        started = time.time()
+        try:
+            yield record
+        finally:
+            rss_after = peak_rss()
+            record.timings = OrderedDict(
+                started=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(started)),
+                wall_seconds=round(time.perf_counter() - wall_start, 6),
+                cpu_seconds=round(cpu_time() - cpu_start, 6),
+                peak_rss_delta_bytes=None if rss_before is None else rss_after - rss_before,
+            )
+            self._add(record)
+
+    def _add(self, record):
+        fields = record.fields()
+        with self._lock:
+            self.records.append(fields)
+            if self.trace_path:
+                with open(self.trace_path, "a") as f:
+                    f.write(json.dumps(fields, default=str) + "\n")
+
+
+PROFILER = Profiler()
+
+
+def stage(name, rows_in=None, cache=None, processes=False, **extra):
+    """Time a block as stage `name` with the shared profiler:
+
+        with profiling.stage("merge_nadp", rows_in=len(df)) as record:
+            df = df.merge(nadp_df, on="month")
+            record.rows_out = len(df)
+
+    Pass `processes=True` if the block runs work in other processes.
+    """
+    return PROFILER.stage(name, rows_in, cache, processes, **extra)
+
+
+def profiled(name=None):
+    """Decorator recording each call of a function as a stage
+
+    Rows in are counted over the arguments, rows out over the result.
+    """
+
+    def decorator(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            with PROFILER.stage(label, rows_in=rows(list(args) + list(kwargs.values()))) as record:
+                result = function(*args, **kwargs)
+                record.rows_out = rows(result)
+            return result
+
+        wrapper.__wrapped_by_profiling__ = True
+        return wrapper
+
+    return decorator
+
+
+def summary(records=None):
+    """Return the records totalled per stage, as a DataFrame, slowest first
+    """
+    import pandas as pd
+
+    df = pd.DataFrame(PROFILER.records if records is None else records)
+    if df.empty:
+        return df
+    for column in ("rows_in", "rows_out", "peak_rss_delta_bytes"):
+        df[column] = pd.to_numeric(df[column])
+    totals = df.groupby("stage").agg(
+        calls=("stage", "size"),
+        wall_seconds=("wall_seconds", "sum"),
+        cpu_seconds=("cpu_seconds", "sum"),
+        peak_rss_delta_bytes=("peak_rss_delta_bytes", "max"),
+        rows_in=("rows_in", lambda c: c.sum(min_count=1)),
+        rows_out=("rows_out", lambda c: c.sum(min_count=1)),
+        cache_hits=("cache", lambda c: int((c == "hit").sum())),
+        cache_misses=("cache", lambda c: int((c == "miss").sum())),
+    )
+    return totals.sort_values("wall_seconds", ascending=False)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_prometheus(path, records=None):
+    """Write the per-stage totals to `path` in the Prometheus text format
+
+    The file is replaced atomically, as the textfile collector expects.
+    """
+    totals = summary(records)
+    metrics = [
+        ("wall_seconds_total", "counter", "Wall time spent in the stage", "wall_seconds"),
+        ("cpu_seconds_total", "counter", "CPU time spent in the stage", "cpu_seconds"),
+        ("peak_rss_delta_bytes", "gauge", "Largest rise in peak resident memory", "peak_rss_delta_bytes"),
+        ("rows_in_total", "counter", "Rows passed to the stage", "rows_in"),
+        ("rows_out_total", "counter", "Rows returned by the stage", "rows_out"),
+        ("calls_total", "counter", "Times the stage ran", "calls"),
+        ("cache_hits_total", "counter", "Times the stage was served from a cache", "cache_hits"),
+        ("cache_misses_total", "counter", "Times the stage missed its cache", "cache_misses"),
+    ]
+    lines = []
+    for suffix, kind, description, column in metrics:
+        metric = f"{METRIC_PREFIX}_{suffix}"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, value in (totals[column].items() if len(totals) else []):
+            if value == value:  # skip NaN
+                lines.append(f'{metric}{{stage="{_label(name)}"}} {float(value):g}')
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def _patch(owner, attribute, wrapper_factory):
+    """Replace `owner.attribute` with a wrapper, once
+    """
+    original = getattr(owner, attribute)
+    if getattr(original, "__wrapped_by_profiling__", False):
+        return
+    wrapper = functools.wraps(original)(wrapper_factory(original))
+    wrapper.__wrapped_by_profiling__ = True
+    setattr(owner, attribute, wrapper)
+
+
+def _cached_read(original):
+    def cached_read(sql, csv_path=None, use_cache=True, **kwargs):
+        if not PROFILER.enabled:
+            return original(sql, csv_path=csv_path, use_cache=use_cache, **kwargs)
+        hit = bool(use_cache and csv_path and os.path.exists(csv_path))
+        name = f"bq.cached_read:{os.path.basename(csv_path)}" if csv_path else "bq.cached_read"
+        with PROFILER.stage(name, cache="hit" if hit else "miss") as record:
+            df = original(sql, csv_path=csv_path, use_cache=use_cache, **kwargs)
+            record.rows_out = rows(df)
+        return df
+
+    return cached_read
+
+
+# groupby classes, and their methods, `instrument_notebook` records as stages
+GROUPBY_CLASSES = ("DataFrameGroupBy", "SeriesGroupBy")
+GROUPBY_AGGREGATIONS = (
+    "agg",
+    "aggregate",
+    "count",
+    "first",
+    "last",
+    "max",
+    "mean",
+    "median",
+    "min",
+    "nunique",
+    "prod",
+    "size",
+    "std",
+    "sum",
+    "transform",
+    "var",
+)
+
+_calls = threading.local()
+
+
+def _pandas_call(name, frame_of=None):
+    """Return a wrapper factory recording calls of a pandas function as stage `name`
+
+    Rows in are counted over the arguments, or over `frame_of(self)`.
+    A call made while another wrapped pandas call is running (pandas'
+    `agg` calling `sum`, say) isn't recorded again.
+    """
+
+    def factory(original):
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled or getattr(_calls, "active", False):
+                return original(*args, **kwargs)
+            rows_in = rows(frame_of(args[0])) if frame_of else rows(list(args) + list(kwargs.values()))
+            _calls.active = True
+            try:
+                with PROFILER.stage(name, rows_in=rows_in) as record:
+                    result = original(*args, **kwargs)
+                    record.rows_out = rows(result)
+            finally:
+                _calls.active = False
+            return result
+
+        return wrapper
+
+    return factory
+
+
+def instrument_notebook():
+    """Wrap the notebooks' warehouse reads, scrapes, merges and groupbys as stages
+
+    `ebmdatalab.bq.cached_read` (if installed) records a cache hit when
+    its CSV already exists and `use_cache` is set.  Groupby aggregations
+    and transforms are recorded as e.g. `DataFrameGroupBy.sum` or
+    `SeriesGroupBy.transform`, with the rows of the grouped frame or
+    Series as rows in.
+    """
+    import pandas as pd
+
+    try:
+        from ebmdatalab import bq
+    except ImportError:
+        bq = None
+    if bq is not None:
+        _patch(bq, "cached_read", _cached_read)
+    _patch(pd, "read_html", _pandas_call("pd.read_html"))
+    _patch(pd, "merge", _pandas_call("pd.merge"))
+    _patch(pd.DataFrame, "merge", _pandas_call("DataFrame.merge"))
+    for class_name in GROUPBY_CLASSES:
+        groupby = getattr(pd.core.groupby, class_name)
+        for method in GROUPBY_AGGREGATIONS:
+            if hasattr(groupby, method):
+                _patch(groupby, method, _pandas_call(f"{class_name}.{method}", lambda grouped: grouped.obj))
+
+
+def profile_magic(line):
+    """%profile_stages on [TRACE] [PROMETHEUS] | off | summary | reset
+    """
+    words = line.split()
+    command = words[0] if words else "summary"
+    if command == "on":
+        instrument_notebook()
+        PROFILER.enable(*words[1:3])
+        return None
+    if command == "off":
+        PROFILER.disable()
+        return None
+    if command == "reset":
+        PROFILER.reset()
+        return None
+    if command == "summary":
+        return summary()
+    raise ValueError(f"Unknown %profile_stages command {command!r}; use on, off, summary or reset")
+
+
+def load_ipython_extension(ipython):
+    """Register `%profile_stages` (see `profile_magic`) with `%load_ext lib.profiling`
+    """
+    ipython.register_magic_function(profile_magic, "line", "profile_stages")
@@ -0,0 +1,204 @@
+"""Reconcile warehouse quantities with OpenPrescribing concession exports
+
+"priceconcessions with check on OP" compares the quantities in
+`ncso_df.csv` with a `price-concessions-cost-*.csv` export downloaded
+from OpenPrescribing, one hardcoded month at a time (giving
+`june_difference.csv` and `july_difference.csv`).  This finds every
+export in a directory, takes the organisation and month from each file
+name, and joins them all to the warehouse data on (org, month,
+bnf_code) in one go:
+
+    python -m lib.reconcile --data-dir data
+
+writes the differences (one row per organisation, month and BNF code,
+with the same columns as the per-month files plus `org`, `month` and
+`source`) to the month-partitioned store (see `lib.store`) as
+`<store>/op_differences/YYYY-MM.csv`, replacing the months it
+reconciled and keeping the others, then reads them back to write
+`op_differences_summary.csv` (one row per organisation and month
+reconciled so far).
+
+The warehouse extract is national, so unless it has an `org` column its
+rows are taken to be `--org` (default "nhs-england"); exports for other
+organisations are skipped, with a warning.
+
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from lib import store
+
+EXPORT_PATTERN = "price-concessions-cost-*.csv"
+EXPORT_RE = re.compile(r"price-concessions-cost-(?P<org>.+)-(?P<month>\d{4}-\d{2}-\d{2})\.csv$")
+
+# the organisation `ncso_df.csv` covers
+NATIONAL_ORG = "nhs-england"
+
+# the differences' name in the partitioned store
+DIFFERENCES_NAME = "op_differences"
+
+
+def month_starts(values):
+    """Return timezone-naive month start timestamps for date-like values
+    """
+    months = pd.to_datetime(pd.Series(values), utc=True).dt.tz_convert(None)
+    return months.dt.to_period("M").dt.to_timestamp()
+
+
+def find_exports(directory, pattern=EXPORT_PATTERN):
+    """Return (path, org, month) for each export file in `directory`
+    """
+    exports = []
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        match = EXPORT_RE.search(os.path.basename(path))
+        if match is None:
+            continue
+        exports.append((path, match.group("org"), pd.Timestamp(match.group("month"))))
+    return exports
+
+
+def load_exports(exports):
+    """Return all the exports as one frame, with `month` and `org` columns
+    """
+    frames = []
+    for path, org, month in exports:
+        df = pd.read_csv(path, usecols=["BNF code", "Presentation", "Quantity"])
+        df["month"] = month
+        df["org"] = org
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=["BNF code", "Presentation", "Quantity", "month", "org"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def differences(ncso_df, op_df, org=NATIONAL_ORG):
+    """Return warehouse vs OpenPrescribing quantities for every organisation and month
+
+    `ncso_df` has `month`, `bnf_name`, `bnf_code`, `quantity` and
+    optionally `org` (otherwise all its rows are `org`); `op_df` is from
+    `load_exports`.  Only (org, month) pairs that have an export are
+    compared, and exports for organisations the warehouse data doesn't
+    cover are skipped with a warning.  Rows in either source but not the
+    other are kept, and `source` says which ("both", "bq_only" or
+    "op_only"); `difference` is `bq_quantity - op_quantity`, treating a
+    missing side as zero.
+
+    """
+    keys = ["org", "month", "bnf_code"]
+    op = op_df.rename(
+        columns={"BNF code": "bnf_code", "Presentation": "op_name", "Quantity": "op_quantity"}
+    )
+    op["month"] = month_starts(op["month"])
+
+    bq = ncso_df[["month", "bnf_name", "bnf_code", "quantity"]].rename(
+        columns={"quantity": "bq_quantity"}
+    )
+    bq = bq.assign(
+        org=ncso_df["org"].to_numpy() if "org" in ncso_df else org,
+        month=month_starts(bq["month"]).to_numpy(),
+    )
+    uncovered = sorted(set(op["org"]) - set(bq["org"]))
+    if uncovered:
+        warnings.warn(f"No warehouse data for {', '.join(uncovered)}; skipping their exports")
+        op = op[~op["org"].isin(uncovered)]
+    duplicated = op.duplicated(keys)
+    if duplicated.any():
+        example = op.loc[duplicated, keys].iloc[0].tolist()
+        raise ValueError(f"Exports repeat (org, month, BNF code) rows, e.g. {example}")
+    exported = pd.MultiIndex.from_frame(op[["org", "month"]].drop_duplicates())
+    bq = bq[pd.MultiIndex.from_frame(bq[["org", "month"]]).isin(exported)]
+
+    merged = bq.merge(
+        op[keys + ["op_name", "op_quantity"]],
+        on=keys,
+        how="outer",
+        indicator="source",
+    )
+    merged["source"] = merged["source"].map(
+        {"both": "both", "left_only": "bq_only", "right_only": "op_only"}
+    )
+    merged["bnf_name"] = merged["bnf_name"].fillna(merged["op_name"])
+    merged["difference"] = merged["bq_quantity"].fillna(0) - merged["op_quantity"].fillna(0)
+    return (
+        merged[["org", "month", "bnf_name", "bnf_code", "bq_quantity", "op_quantity", "difference", "source"]]
+        .sort_values(["org", "month", "difference"], kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def summarise(diff_df):
+    """Return per-organisation and month summary statistics of a differences table
+    """
+    matched = diff_df["source"] == "both"
+    abs_diff = diff_df["difference"].abs().where(matched)
+    grouped = diff_df.assign(
+        matched=matched,
+        bq_only=diff_df["source"] == "bq_only",
+        op_only=diff_df["source"] == "op_only",
+        abs_difference=abs_diff,
+        exact=matched & (diff_df["difference"] == 0),
+    ).groupby(["org", "month"])
+    summary = grouped.agg(
+        codes=("bnf_code", "size"),
+        matched=("matched", "sum"),
+        exact=("exact", "sum"),
+        bq_only=("bq_only", "sum"),
+        op_only=("op_only", "sum"),
+        bq_quantity=("bq_quantity", "sum"),
+        op_quantity=("op_quantity", "sum"),
+        difference=("difference", "sum"),
+        mean_abs_difference=("abs_difference", "mean"),
+        max_abs_difference=("abs_difference", "max"),
+    )
+    summary["perc_difference"] = summary["difference"] / summary["op_quantity"].replace(0, np.nan)
+    return summary.reset_index()
+
+
+def reconcile(ncso_df, directory, pattern=EXPORT_PATTERN, org=NATIONAL_ORG):
+    """Return (differences, summary) for every export in `directory`
+    """
+    diff_df = differences(ncso_df, load_exports(find_exports(directory, pattern)), org)
+    return diff_df, summarise(diff_df)
+
+
+def write_differences(diff_df, store_dir, name=DIFFERENCES_NAME):
+    """Write `diff_df` to `store_dir` a month per file, and return the summary of every month stored
+
+    Months already stored that `diff_df` doesn't have are kept.
+    """
+    store.write_partitioned(diff_df, store_dir, name, replace=False)
+    return summarise(store.read_partitioned(store_dir, name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=os.path.join("..", "data"))
+    parser.add_argument("--ncso", help="warehouse extract (default <data-dir>/ncso_df.csv)")
+    parser.add_argument("--store", help="partitioned store for the differences (default <data-dir>/store)")
+    parser.add_argument("--summary", help="summary CSV (default <data-dir>/op_differences_summary.csv)")
+    parser.add_argument("--org", default=NATIONAL_ORG, help="organisation the warehouse extract covers")
+    args = parser.parse_args(argv)
+
+    ncso_path = args.ncso or os.path.join(args.data_dir, "ncso_df.csv")
+    store_dir = args.store or os.path.join(args.data_dir, "store")
+    summary_output = args.summary or os.path.join(args.data_dir, f"{DIFFERENCES_NAME}_summary.csv")
+
+    ncso_df = pd.read_csv(ncso_path, usecols=["month", "bnf_name", "bnf_code", "quantity"])
+    diff_df = differences(ncso_df, load_exports(find_exports(args.data_dir)), org=args.org)
+    if diff_df.empty:
+        print(f"No {EXPORT_PATTERN} exports found in {args.data_dir}", file=sys.stderr)
+        return 1
+    summary = write_differences(diff_df, store_dir)
+    summary.to_csv(summary_output, index=False)
+    print(summary.to_string(index=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
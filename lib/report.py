@@ -0,0 +1,365 @@
+"""Static HTML accuracy report, built from the cached results
+
+The notebooks are the only way to see the forecast accuracy results,
+and producing them means re-running every cell against BigQuery.  This
+builds a single self-contained HTML file (charts embedded as PNG data
+URIs, no external assets) from the cached CSVs alone:
+
+    python -m lib.report --data-dir data --output report/index.html
+
+Sections are:
+
+* monthly % difference, current method and monthly NADP
+* % difference per financial year for every methodology
+* the BNF codes contributing most to the error over the last 12 months
+* the same error by BNF chapter
+* additional cost in the months after price concessions end
+
+Each section's HTML is kept in a cache directory beside the report,
+keyed by a hash of the tables it's built from, so a monthly update only
+redraws the sections whose data changed.
+
+"""
+import argparse
+import base64
+import hashlib
+import html
+import json
+import os
+import sys
+
+import pandas as pd
+
+from lib import bnf, charts, features, forecast, ingest, profiling
+
+CACHE_DIR = ".report_cache"
+MANIFEST_FILE = "sections.json"
+
+# bumped when the section layout changes, so cached sections are rebuilt
+REPORT_VERSION = 1
+
+TOP_CONTRIBUTORS = 20
+
+# the post-concession costs that are cached, as (horizon, price window)
+CACHED_POST_CONCESSION = {"3_months_post": (3, 3)}
+
+# exit status when an input file is missing, as for `python -m lib run`
+EXIT_MISSING_INPUT = 3
+
+
+def top_contributors(predicted_df, n=TOP_CONTRIBUTORS, months=12):
+    """Return the `n` BNF codes with the largest absolute prediction error
+
+    Errors are summed over the last `months` months of `predicted_df`
+    (from `forecast.predict_costs`); `share` is each code's difference
+    as a proportion of the total absolute difference.
+    """
+    last = predicted_df["month"].max()
+    recent = predicted_df[predicted_df["month"] > last - pd.DateOffset(months=months)]
+    by_code = recent.groupby(["bnf_code", "bnf_name"], as_index=False)[
+        ["actual_cost", "predicted_actual_cost", "prediction_difference"]
+    ].sum()
+    by_code["share"] = by_code["prediction_difference"] / by_code["prediction_difference"].abs().sum()
+    order = by_code["prediction_difference"].abs().sort_values(ascending=False, kind="stable").index
+    return by_code.loc[order[:n]].reset_index(drop=True)
+
+
+def error_by_level(predicted_df, level="chapter", months=12):
+    """Return the prediction error summed by BNF `level` over the last `months` months
+
+    Like `top_contributors`, but rolled up the BNF hierarchy (see
+    `bnf.Hierarchy`), largest absolute difference first.
+    """
+    last = predicted_df["month"].max()
+    recent = predicted_df[predicted_df["month"] > last - pd.DateOffset(months=months)]
+    columns = ["actual_cost", "predicted_actual_cost", "prediction_difference"]
+    by_level = bnf.Hierarchy(recent["bnf_code"]).rollup(recent["bnf_code"], recent[columns], level).reset_index()
+    by_level["share"] = by_level["prediction_difference"] / by_level["prediction_difference"].abs().sum()
+    order = by_level["prediction_difference"].abs().sort_values(ascending=False, kind="stable").index
+    return by_level.loc[order].reset_index(drop=True)
+
+
+def load_tables(data_dir, bank_holidays=None):
+    """Return the report's input tables from the cached CSVs in `data_dir`
+
+    Bank holidays are read from `data_dir` (see
+    `features.read_bank_holidays`) unless `bank_holidays` is given.
+    """
+    predicted = forecast.predict_costs(ingest.read_cache("ncso_df", data_dir))
+    monthly = forecast.monthly_totals(predicted)
+
+    if bank_holidays is None:
+        bank_holidays = features.read_bank_holidays(data_dir)
+    weights = forecast.weightings(
+        monthly["month"],
+        ingest.read_cache("nadp_fixed", data_dir),
+        bank_holidays,
+        pd.read_csv(os.path.join(data_dir, "annual_profile_df.csv")),
+    )
+    reweighted = forecast.reweight(monthly, weights)
+
+    post = []
+    for name, (horizon, price_window) in CACHED_POST_CONCESSION.items():
+        if not os.path.exists(os.path.join(data_dir, f"{name}.csv")):
+            continue
+        df = ingest.read_cache(name, data_dir)
+        post.append(
+            df.groupby("rx_merge_date", as_index=False)[f"{horizon}_m_additional_cost"]
+            .sum()
+            .rename(columns={"rx_merge_date": "rx_start_month", f"{horizon}_m_additional_cost": "additional_cost"})
+            .assign(horizon=horizon, price_window=price_window)
+        )
+
+    return {
+        "monthly": reweighted,
+        "fy": forecast.financial_year_totals(reweighted),
+        "contributors": top_contributors(predicted),
+        "chapters": error_by_level(predicted, "chapter"),
+        "post_concession": pd.concat(post, ignore_index=True) if post else None,
+    }
+
+
+def _percent(value):
+    return "" if pd.isna(value) else f"{value:.2%}"
+
+
+def _pounds(value):
+    return "" if pd.isna(value) else f"£{value:,.0f}"
+
+
+def _table(df, columns, formatters):
+    """Return `columns` of `df` as an HTML table, renamed {column: heading}
+    """
+    return df[list(columns)].to_html(
+        index=False,
+        header=list(columns.values()),
+        formatters={c: formatters[c] for c in columns if c in formatters},
+        border=0,
+        classes="results",
+    )
+
+
+def _chart(name, chart_dir):
+    """Return an <img> for chart `name`, embedded as a PNG data URI
+    """
+    with open(os.path.join(chart_dir, f"{name}.png"), "rb") as f:
+        data = base64.b64encode(f.read()).decode("ascii")
+    return f'<img src="data:image/png;base64,{data}" alt="{name.replace("_", " ")}">'
+
+
+def monthly_section(tables, chart_dir):
+    """Monthly chart, and a table of the last 12 months
+    """
+    monthly = tables["monthly"].tail(12).assign(month=lambda df: df["month"].dt.strftime("%b %Y"))
+    columns = {
+        "month": "Month",
+        "actual_cost": "Actual cost",
+        "predicted_actual_cost": "Predicted cost",
+        "perc_difference": "% difference",
+        "nadp_perc_difference": "% difference (monthly NADP)",
+    }
+    formatters = {
+        "actual_cost": _pounds,
+        "predicted_actual_cost": _pounds,
+        "perc_difference": _percent,
+        "nadp_perc_difference": _percent,
+    }
+    return _chart("monthly_perc_difference", chart_dir) + _table(monthly, columns, formatters)
+
+
+def fy_section(tables, chart_dir):
+    """Financial year chart, and a table of % difference by methodology
+    """
+    fy = tables["fy"]
+    columns = {"financial_year": "Financial year ending", "months": "Months", "perc_difference": "Current method"}
+    for method in forecast.METHODS:
+        if f"{method}_perc_difference" in fy:
+            columns[f"{method}_perc_difference"] = method.replace("_", " + ")
+    formatters = {c: _percent for c in columns if c.endswith("perc_difference")}
+    return _chart("fy_methods", chart_dir) + _table(fy, columns, formatters)
+
+
+def contributors_section(tables, chart_dir):
+    """Table of the BNF codes contributing most to the error
+    """
+    columns = {
+        "bnf_code": "BNF code",
+        "bnf_name": "Presentation",
+        "actual_cost": "Actual cost",
+        "predicted_actual_cost": "Predicted cost",
+        "prediction_difference": "Difference",
+        "share": "Share of error",
+    }
+    formatters = {
+        "actual_cost": _pounds,
+        "predicted_actual_cost": _pounds,
+        "prediction_difference": _pounds,
+        "share": _percent,
+    }
+    return _table(tables["contributors"], columns, formatters)
+
+
+def chapters_section(tables, chart_dir):
+    """Table of the error by BNF chapter
+    """
+    columns = {
+        "chapter": "BNF chapter",
+        "actual_cost": "Actual cost",
+        "predicted_actual_cost": "Predicted cost",
+        "prediction_difference": "Difference",
+        "share": "Share of error",
+    }
+    formatters = {
+        "actual_cost": _pounds,
+        "predicted_actual_cost": _pounds,
+        "prediction_difference": _pounds,
+        "share": _percent,
+    }
+    return _table(tables["chapters"], columns, formatters)
+
+
+def post_concession_section(tables, chart_dir):
+    """Chart of additional cost after concessions end
+    """
+    return _chart("post_concession_costs", chart_dir)
+
+
+# section name -> (heading, section function, tables it uses, charts it embeds)
+SECTIONS = {
+    "monthly": ("Monthly accuracy", monthly_section, ["monthly"], ["monthly_perc_difference"]),
+    "fy": ("Accuracy by financial year", fy_section, ["fy"], ["fy_methods"]),
+    "contributors": (
+        "Largest contributors to the error (last 12 months)",
+        contributors_section,
+        ["contributors"],
+        [],
+    ),
+    "chapters": (
+        "Error by BNF chapter (last 12 months)",
+        chapters_section,
+        ["chapters"],
+        [],
+    ),
+    "post_concession": (
+        "Additional cost after price concessions end",
+        post_concession_section,
+        ["post_concession"],
+        ["post_concession_costs"],
+    ),
+}
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 1200px; margin: 2em auto; color: #222; }}
+img {{ max-width: 100%; }}
+table.results {{ border-collapse: collapse; margin: 1em 0; font-size: 0.9em; }}
+table.results th, table.results td {{ padding: 0.3em 0.8em; text-align: right; border-bottom: 1px solid #ddd; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>Built {built} from the cached data; latest month {latest}.</p>
+{sections}
+</body>
+</html>
+"""
+
+
+def section_hash(name, tables):
+    """Return a hash of the tables section `name` is built from
+    """
+    digest = hashlib.sha256(f"{name}:{REPORT_VERSION}:{charts.CHART_VERSION}".encode("utf8"))
+    for table in SECTIONS[name][2]:
+        df = tables.get(table)
+        if df is None:
+            return None
+        digest.update(",".join(map(str, df.columns)).encode("utf8"))
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def build_report(tables, output, title="Price concession forecast accuracy", force=False):
+    """Write the report for `tables` to `output`, and return {section: status}
+
+    Status is "built", "unchanged" (reused from the cache) or "no data".
+    """
+    cache_dir = os.path.join(os.path.dirname(output) or ".", CACHE_DIR)
+    chart_dir = os.path.join(cache_dir, "charts")
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    status = {}
+    stale = []
+    for name in SECTIONS:
+        digest = section_hash(name, tables)
+        fragment = os.path.join(cache_dir, f"{name}.html")
+        if digest is None:
+            status[name] = "no data"
+        elif not force and manifest.get(name) == digest and os.path.exists(fragment):
+            status[name] = "unchanged"
+        else:
+            stale.append(name)
+
+    chart_names = [c for name in stale for c in SECTIONS[name][3]]
+    if chart_names:
+        charts.render_all(tables, chart_dir, names=chart_names, formats=("png",), force=force)
+
+    for name in stale:
+        heading, build, table_names, _ = SECTIONS[name]
+        with profiling.stage(f"report:{name}", rows_in=profiling.rows([tables[t] for t in table_names])):
+            body = f'<section id="{name}">\n<h2>{html.escape(heading)}</h2>\n{build(tables, chart_dir)}\n</section>\n'
+        with open(os.path.join(cache_dir, f"{name}.html"), "w") as f:
+            f.write(body)
+        manifest[name] = section_hash(name, tables)
+        status[name] = "built"
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    sections = []
+    for name in SECTIONS:
+        if status[name] == "no data":
+            continue
+        with open(os.path.join(cache_dir, f"{name}.html")) as f:
+            sections.append(f.read())
+    latest = tables["monthly"]["month"].max()
+    page = PAGE.format(
+        title=html.escape(title),
+        built=pd.Timestamp.now().strftime("%d %B %Y"),
+        latest=latest.strftime("%B %Y") if pd.notna(latest) else "none",
+        sections="\n".join(sections),
+    )
+    with open(output, "w") as f:
+        f.write(page)
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=os.path.join("..", "data"))
+    parser.add_argument("--output", default=os.path.join("report", "index.html"))
+    parser.add_argument("--force", action="store_true", help="rebuild every section")
+    args = parser.parse_args(argv)
+
+    try:
+        tables = load_tables(args.data_dir)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return EXIT_MISSING_INPUT
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    status = build_report(tables, args.output, force=args.force)
+    for name, state in status.items():
+        print(f"{name}: {state}")
+    print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
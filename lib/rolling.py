@@ -0,0 +1,144 @@
+"""Rolling prescribing-quantity windows, computed locally
+
+`rx_qty.csv` is produced in BigQuery with a window function along the
+lines of
+
+    SUM(quantity) OVER (PARTITION BY bnf_code
+                        ORDER BY DATE_DIFF(month, '2000-01-01', MONTH)
+                        RANGE BETWEEN 0 PRECEDING AND 2 FOLLOWING)
+
+which fixes both the width (3 months) and direction (forwards) of the
+window.  The functions here do the same job from a cached long-format
+prescribing aggregate (one row per month and BNF code), so a 6 or 12
+month window - or a backward or centred one - doesn't need a new
+warehouse query.
+
+The long data is first laid out as a dense month x bnf_code array
+(missing months count as zero quantity, which matches the `RANGE`
+semantics of the SQL).  Every rolling sum is then a difference of two
+rows of a single cumulative sum along the month axis.
+
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from lib import monthtime
+
+DIRECTIONS = ("forward", "backward", "centred")
+
+# `months` are month ordinals (see `lib.monthtime`) for each row
+# of `values`, `codes` are the BNF codes for each column, and `observed`
+# flags the cells that had a row in the source data.
+QuantityGrid = namedtuple("QuantityGrid", ["months", "codes", "values", "observed"])
+
+
+def build_quantity_grid(
+    df, month_col="month", code_col="bnf_code", value_col="quantity"
+):
+    """Lay out a long (month, bnf_code, quantity) frame as a dense array
+
+    Rows are every month from the earliest to the latest in `df`, and
+    columns are the sorted unique BNF codes.  Duplicate (month, code)
+    rows are summed, and cells with no source row are zero.
+
+    """
+    ordinals = monthtime.to_months(df[month_col])
+    codes, code_idx = np.unique(df[code_col].to_numpy(), return_inverse=True)
+    first = ordinals.min() if len(ordinals) else 0
+    n_months = (ordinals.max() - first + 1) if len(ordinals) else 0
+    month_idx = ordinals - first
+
+    values = np.zeros((n_months, len(codes)), dtype=np.float64)
+    np.add.at(values, (month_idx, code_idx), df[value_col].to_numpy(dtype=np.float64))
+    observed = np.zeros(values.shape, dtype=bool)
+    observed[month_idx, code_idx] = True
+
+    months = np.arange(first, first + n_months, dtype=monthtime.DTYPE)
+    return QuantityGrid(months, codes, values, observed)
+
+
+def window_bounds(width, direction="forward"):
+    """Return the (start, end) month offsets of a window, inclusive
+
+    A forward window of width 3 is (0, 2), i.e. this month and the two
+    following; a backward one is (-2, 0).  Centred windows of even width
+    lean forwards, so width 4 is (-1, 2).
+
+    """
+    if width < 1:
+        raise ValueError(f"Window width must be at least 1, not {width}")
+    if direction == "forward":
+        return 0, width - 1
+    if direction == "backward":
+        return -(width - 1), 0
+    if direction == "centred":
+        return -((width - 1) // 2), width // 2
+    raise ValueError(f"Unknown window direction {direction!r}; use one of {DIRECTIONS}")
+
+
+def rolling_sum(values, width, direction="forward", complete_only=True):
+    """Return rolling sums of `width` months over axis 0 of `values`
+
+    Uses one cumulative sum, so the cost doesn't depend on `width`.
+    Where the window runs off either end of the array, the result is NaN
+    if `complete_only` (like `rolling(width, width)`), otherwise the sum
+    of the months that are available.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    start, end = window_bounds(width, direction)
+    n = values.shape[0]
+
+    cumulative = np.zeros((n + 1,) + values.shape[1:], dtype=np.float64)
+    np.cumsum(values, axis=0, out=cumulative[1:])
+
+    rows = np.arange(n)
+    lo = rows + start
+    hi = rows + end + 1
+    result = cumulative[np.clip(hi, 0, n)] - cumulative[np.clip(lo, 0, n)]
+    if complete_only:
+        incomplete = (lo < 0) | (hi > n)
+        result[incomplete] = np.nan
+    return result
+
+
+def rolling_quantity(
+    df,
+    width=3,
+    direction="forward",
+    month_col="month",
+    code_col="bnf_code",
+    value_col="quantity",
+    observed_only=True,
+    complete_only=True,
+):
+    """Return rolling quantity sums for a long prescribing frame
+
+    The result has one row per month and BNF code, with the rolling sum
+    in a `roll_<width>m_quantity` column, so a forward 3 month window
+    reproduces the columns of `rx_qty.csv` (with `month_col` renamed to
+    `date_3m_start` by the caller if needed).  With `observed_only` only
+    months that appear in `df` for that code are returned, as the SQL
+    does; with `complete_only` windows running past the ends of the data
+    are dropped, which replaces the "limit df to ensure that always 3
+    full months of data" step in the notebook.
+
+    """
+    grid = build_quantity_grid(
+        df, month_col=month_col, code_col=code_col, value_col=value_col
+    )
+    sums = rolling_sum(grid.values, width, direction, complete_only=complete_only)
+
+    keep = grid.observed if observed_only else np.ones(sums.shape, dtype=bool)
+    keep = keep & ~np.isnan(sums)
+    month_idx, code_idx = np.nonzero(keep)
+
+    return pd.DataFrame(
+        {
+            month_col: monthtime.to_timestamps(grid.months[month_idx]),
+            code_col: grid.codes[code_idx],
+            f"roll_{width}m_quantity": sums[month_idx, code_idx],
+        }
+    )
@@ -0,0 +1,204 @@
+"""Share loaded frames between notebook kernels and worker processes
+
+With `priceconcessions.ipynb` and `Post price concession changes.ipynb`
+open at once, each kernel parses and holds its own copy of `ncso_df`,
+`rx_df` and the rest, and every parallel worker would load another.
+Here a frame is published once, as one array file per column in shared
+memory (`/dev/shm` where there is one), and other processes attach to
+it by name and version:
+
+    frames = sharedstore.FrameStore()
+    ncso_df = frames.load("ncso_df", lambda: ingest.read_cache("ncso_df", "../data"),
+                          version=sharedstore.file_version("../data/ncso_df.csv"))
+
+The first `load` calls the loader and publishes the result; later calls,
+in any process, memory-map the published columns.  Mapped pages are
+shared by every process that attaches, so memory use stays flat however
+many kernels or workers read the frame.  Attached columns are read-only:
+pandas operations that change a frame make their own copy, as usual.
+Before pandas 2 the DataFrame constructor copies columns of the same
+dtype into one block, so there an attached frame is a private copy
+(still without re-parsing the source).
+
+Columns are stored as their NumPy arrays (numbers, bools, datetimes and
+timedeltas), nullable integers, floats and bools as values plus mask,
+and strings as categorical codes with their categories alongside (so
+string columns come back as categoricals).  A frame with any other kind
+of column, or an index other than the default range, is refused.
+
+Publishing a version removes the earlier ones; processes attached to
+them keep their maps until they let go.  Otherwise published frames
+live until they're removed (`remove`) or the machine restarts; files,
+unlike `multiprocessing.shared_memory` segments, aren't unlinked when
+the publishing process exits.
+
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+META_FILE = "meta.json"
+LATEST_FILE = "LATEST"
+
+# nullable arrays stored as values plus mask (FloatingArray is pandas 1.2+)
+MASKED_ARRAYS = tuple(
+    getattr(pd.arrays, name) for name in ("IntegerArray", "FloatingArray", "BooleanArray") if hasattr(pd.arrays, name)
+)
+
+
+def default_root():
+    """Return `SHARED_FRAMES_DIR`, or a per-user directory in /dev/shm (or the temp dir)
+    """
+    if os.environ.get("SHARED_FRAMES_DIR"):
+        return os.environ["SHARED_FRAMES_DIR"]
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(base, f"price-concessions-{user}")
+
+
+def file_version(path):
+    """Return a version for a frame loaded from `path`, from its size and modification time
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _encode(series):
+    """Return ({part: array}, column metadata) for one column
+    """
+    values = series.array
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM":
+        return {"data": series.to_numpy()}, {"kind": "numpy"}
+    if isinstance(values, pd.Categorical):
+        return {"codes": np.asarray(values.codes)}, {
+            "kind": "categorical",
+            "categories": values.categories.tolist(),
+            "ordered": bool(values.ordered),
+        }
+    if isinstance(values, MASKED_ARRAYS):
+        numpy_dtype = np.dtype(values.dtype.type)
+        data = values.to_numpy(dtype=numpy_dtype, na_value=numpy_dtype.type(0))
+        return {"data": data, "mask": np.asarray(values.isna())}, {"kind": "masked", "dtype": str(values.dtype)}
+    if pd.api.types.infer_dtype(series, skipna=True) in ("string", "empty"):
+        return _encode(series.astype("category"))
+    raise TypeError(f"Can't share column {series.name!r} of {series.dtype}")
+
+
+def _decode(parts, meta):
+    if meta["kind"] == "categorical":
+        categories = pd.Index(meta["categories"], dtype=object if not meta["categories"] else None)
+        return pd.Categorical.from_codes(parts["codes"], categories=categories, ordered=meta["ordered"])
+    if meta["kind"] == "masked":
+        dtype = pd.api.types.pandas_dtype(meta["dtype"])
+        return dtype.construct_array_type()(parts["data"], parts["mask"], copy=False)
+    return parts["data"]
+
+
+class FrameStore:
+    """Frames published as memory-mapped columns under `root`
+    """
+
+    def __init__(self, root=None):
+        self.root = root or default_root()
+
+    def _path(self, name, version):
+        return os.path.join(self.root, name, str(version))
+
+    def publish(self, name, df, version):
+        """Write `df` as version `version` of `name` (if it isn't there already)
+
+        It becomes the latest version, and the others are removed.
+        """
+        path = self._path(name, version)
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+                raise ValueError("Only frames with the default index can be shared; use reset_index()")
+            os.makedirs(os.path.join(self.root, name), exist_ok=True)
+            tmp_path = tempfile.mkdtemp(prefix=f".{version}.", dir=os.path.join(self.root, name))
+            try:
+                columns = []
+                for i, column in enumerate(df.columns):
+                    if not isinstance(column, str):
+                        raise TypeError(f"Column names must be strings, not {column!r}")
+                    parts, meta = _encode(df[column])
+                    for part, values in parts.items():
+                        np.save(os.path.join(tmp_path, f"{i}.{part}.npy"), np.ascontiguousarray(values))
+                    columns.append(dict(meta, name=column, parts=list(parts)))
+                with open(os.path.join(tmp_path, META_FILE), "w") as f:
+                    json.dump({"rows": len(df), "columns": columns}, f)
+                try:
+                    os.rename(tmp_path, path)
+                except OSError:
+                    # another process published the same version first
+                    if not os.path.exists(os.path.join(path, META_FILE)):
+                        raise
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        latest = os.path.join(self.root, name, LATEST_FILE)
+        with open(latest + f".{os.getpid()}", "w") as f:
+            f.write(str(version))
+        os.replace(latest + f".{os.getpid()}", latest)
+        for superseded in self.versions(name):
+            if superseded != str(version):
+                self.remove(name, superseded)
+        return path
+
+    def attach(self, name, version=None):
+        """Return version `version` (default the latest published) of `name`
+
+        Its columns are read-only memory maps of the published arrays.
+        """
+        if version is None:
+            with open(os.path.join(self.root, name, LATEST_FILE)) as f:
+                version = f.read().strip()
+        path = self._path(name, version)
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        columns = {}
+        for i, column in enumerate(meta["columns"]):
+            parts = {part: np.load(os.path.join(path, f"{i}.{part}.npy"), mmap_mode="r") for part in column["parts"]}
+            columns[column["name"]] = _decode(parts, column)
+        return pd.DataFrame(columns, index=pd.RangeIndex(meta["rows"]), copy=False)
+
+    def load(self, name, loader, version):
+        """Attach `name` at `version`, publishing `loader()` first if needed
+        """
+        if not self.has(name, version):
+            self.publish(name, loader(), version)
+        return self.attach(name, version)
+
+    def has(self, name, version):
+        return os.path.exists(os.path.join(self._path(name, version), META_FILE))
+
+    def versions(self, name):
+        """Return the published versions of `name`
+        """
+        directory = os.path.join(self.root, name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(v for v in os.listdir(directory) if os.path.exists(os.path.join(directory, v, META_FILE)))
+
+    def names(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(n for n in os.listdir(self.root) if self.versions(n))
+
+    def remove(self, name, version=None):
+        """Remove one version of `name`, or all of them
+
+        Processes already attached keep their maps until they let go.
+        """
+        if version is None:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        else:
+            shutil.rmtree(self._path(name, version), ignore_errors=True)
+
+    def nbytes(self, name=None):
+        """Return the bytes published, for `name` or every frame
+        """
+        directory = self.root if name is None else os.path.join(self.root, name)
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(directory) for f in files)
@@ -0,0 +1,183 @@
+"""Month-partitioned storage for the cached extracts
+
+The cached CSVs (`ncso_df.csv`, `rx_qty.csv`, `tariff.csv`, ...) hold
+the whole history, and the notebooks filter them by month with full
+scans (`dt.strftime(...) == "2022-07-01"`, `.between`, `query("... <
+@max_date")`).  Here each extract is split into one CSV per month with a
+small JSON index beside them:
+
+    <store>/ncso_df/index.json
+    <store>/ncso_df/2022-06.csv
+    <store>/ncso_df/2022-07.csv
+    ...
+
+so reading a month range only opens the files for those months.  Frames
+that are read back are sorted by month, and `month_slice` finds a range
+in a sorted frame by binary search rather than by comparing every row.
+
+    python -m lib.store build --data-dir data --store data/store
+
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from lib import monthtime
+
+INDEX_FILE = "index.json"
+
+# cached extract -> the column holding its month
+MONTH_COLUMNS = {
+    "ncso_df": "month",
+    "ncso_dates": "month",
+    "pc_df": "month",
+    "rx_qty": "date_3m_start",
+    "tariff": "date",
+}
+
+
+def read_index(store, name):
+    """Return the index of a partitioned extract
+    """
+    with open(os.path.join(store, name, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def write_partitioned(df, store, name, month_col="month", replace=True):
+    """Write `df` to `store` as one CSV per month, and return the index
+
+    Rows are sorted by month once and split at the month boundaries.  With
+    `replace` any existing partitions for `name` are removed first;
+    otherwise only the months in `df` are overwritten, so new months can
+    be added to an existing store.
+
+    """
+    directory = os.path.join(store, name)
+    os.makedirs(directory, exist_ok=True)
+
+    index = {"month_col": month_col, "columns": list(df.columns), "partitions": {}}
+    if not replace and os.path.exists(os.path.join(directory, INDEX_FILE)):
+        index["partitions"] = read_index(store, name)["partitions"]
+    elif replace:
+        for old in os.listdir(directory):
+            if old.endswith(".csv"):
+                os.remove(os.path.join(directory, old))
+
+    ordinals = monthtime.to_months(df[month_col])
+    order = np.argsort(ordinals, kind="stable")
+    ordinals = ordinals[order]
+    df = df.iloc[order]
+    boundaries = np.flatnonzero(np.diff(ordinals)) + 1
+    starts = np.r_[0, boundaries] if len(ordinals) else np.array([], dtype=np.int64)
+    ends = np.r_[boundaries, len(ordinals)] if len(ordinals) else starts
+
+    for start, end in zip(starts, ends):
+        key = monthtime.to_strings([ordinals[start]])[0]
+        filename = f"{key}.csv"
+        df.iloc[start:end].to_csv(os.path.join(directory, filename), index=False)
+        index["partitions"][key] = {"file": filename, "rows": int(end - start)}
+
+    index["partitions"] = dict(sorted(index["partitions"].items()))
+    with open(os.path.join(directory, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+def available_months(store, name):
+    """Return the partition names ("YYYY-MM") stored for `name`
+    """
+    return list(read_index(store, name)["partitions"])
+
+
+def read_partitioned(store, name, start=None, end=None, columns=None, parse_months=True):
+    """Return the rows of `name` for months `start` to `end` inclusive
+
+    `start` and `end` are anything `pd.Timestamp` accepts (e.g.
+    "2022-07"); either can be None for an open range.  Only the partition
+    files in the range are read.  With `parse_months` the month column
+    is converted to timezone-naive month start timestamps.  The result
+    is sorted by month.
+
+    """
+    index = read_index(store, name)
+    month_col = index["month_col"]
+    lo = monthtime.to_month(start) if start is not None else None
+    hi = monthtime.to_month(end) if end is not None else None
+
+    usecols = None if columns is None else list(dict.fromkeys([month_col] + list(columns)))
+    frames = []
+    for key, partition in index["partitions"].items():
+        ordinal = monthtime.to_month(key)
+        if (lo is not None and ordinal < lo) or (hi is not None and ordinal > hi):
+            continue
+        frames.append(pd.read_csv(os.path.join(store, name, partition["file"]), usecols=usecols))
+
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    else:
+        # the same columns as a read of a partition would give
+        df = pd.DataFrame(columns=index["columns"] if usecols is None else usecols)
+    if parse_months:
+        df[month_col] = monthtime.to_timestamps(monthtime.to_months(df[month_col]))
+    return df
+
+
+def month_slice(df, start=None, end=None, month_col="month"):
+    """Return the rows of `df` with `month_col` from `start` to `end` inclusive
+
+    `df` must be sorted by `month_col` (as `read_partitioned` returns it),
+    which can hold timestamps or month ordinals; the range is found with
+    two binary searches.
+
+    """
+    months = df[month_col].to_numpy()
+    if not np.issubdtype(months.dtype, np.integer):
+        months = months.astype("datetime64[M]")
+        start = None if start is None else np.datetime64(pd.Timestamp(start), "M")
+        end = None if end is None else np.datetime64(pd.Timestamp(end), "M")
+    lo = 0 if start is None else np.searchsorted(months, start, "left")
+    hi = len(months) if end is None else np.searchsorted(months, end, "right")
+    return df.iloc[lo:hi]
+
+
+def build_store(data_dir, store, names=None):
+    """Partition each cached extract in `data_dir` that exists into `store`
+    """
+    built = {}
+    for name, month_col in MONTH_COLUMNS.items():
+        if names is not None and name not in names:
+            continue
+        path = os.path.join(data_dir, f"{name}.csv")
+        if not os.path.exists(path):
+            continue
+        index = write_partitioned(pd.read_csv(path), store, name, month_col=month_col)
+        built[name] = index
+    return built
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="partition the cached extracts")
+    build_parser.add_argument("--data-dir", default=os.path.join("..", "data"))
+    build_parser.add_argument("--store", help="output directory (default <data-dir>/store)")
+    build_parser.add_argument("names", nargs="*", help=f"extracts to build (default all of {list(MONTH_COLUMNS)})")
+    args = parser.parse_args(argv)
+
+    store = args.store or os.path.join(args.data_dir, "store")
+    built = build_store(args.data_dir, store, names=args.names or None)
+    if not built:
+        print(f"No cached extracts found in {args.data_dir}", file=sys.stderr)
+        return 1
+    for name, index in built.items():
+        rows = sum(p["rows"] for p in index["partitions"].values())
+        print(f"{name}: {rows:,} rows in {len(index['partitions'])} months")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
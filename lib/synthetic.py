@@ -0,0 +1,371 @@
+"""Seeded synthetic concession, tariff and prescribing data
+
+The only test inputs in `data/` are a handful of hand-made
+`test_cons*.csv` files.  This generates data at any scale (up to e.g.
+100k VMPPs over 20 years) in the same shapes as the cached BigQuery
+extracts, together with the concession episodes and post-concession
+costs that were used to generate them, so the episode detection and cost
+pipelines can be checked against a known answer as well as timed.
+
+    from lib import synthetic
+    data = synthetic.generate(n_vmpps=1000, n_years=5, seed=1)
+    synthetic.write_synthetic(data, "/tmp/synthetic")
+
+All the generation is done on month x vmpp / month x bnf_code arrays;
+long frames are only built at the end.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from lib.packs import select_packs
+from lib import monthtime
+from lib.rolling import rolling_sum
+
+# pack sizes, roughly in proportion to how common they are in dm+d
+PACK_SIZES = np.array([7, 14, 28, 30, 56, 60, 84, 100, 112, 500])
+PACK_WEIGHTS = np.array([2, 3, 40, 10, 15, 8, 8, 6, 4, 4], dtype=np.float64)
+
+# BNF chapters, weighted towards the ones with most concessions
+CHAPTERS = np.array(["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "13"])
+CHAPTER_WEIGHTS = np.array([8, 14, 6, 20, 4, 8, 3, 2, 5, 6, 2, 2], dtype=np.float64)
+
+# items dispensed each month relative to a flat 1/12th (cf. annual_profile_df.csv)
+MONTH_PROFILE = np.array(
+    [1.03, 0.93, 1.04, 0.98, 1.01, 1.00, 1.03, 0.99, 0.98, 1.05, 1.01, 1.02]
+)
+
+# the frames `generate` returns that have the schema of a cached extract
+CACHE_SCHEMAS = {
+    "ncso_dates": ["vmpp", "month", "concession_bool"],
+    "pc_df": [
+        "month",
+        "name",
+        "bnf_code",
+        "vmpp_code",
+        "pc_price_pence",
+        "dt_price_pence",
+        "qtyval",
+        "increased_ppu",
+    ],
+    "rx_qty": ["date_3m_start", "bnf_code", "roll_3m_quantity"],
+    "tariff": ["bnf_code", "nm", "unit_qty", "vmpp", "date", "price_pence"],
+    "ncso_df": [
+        "month",
+        "bnf_name",
+        "bnf_code",
+        "quantity",
+        "quantity_2_months_previously",
+        "nic",
+        "actual_cost",
+        "normal_nic_per_unit",
+        "predicted_nic_per_unit",
+    ],
+    "nadp_fixed": ["month", "nadp"],
+    "annual_profile_df": ["mon", "proportion"],
+}
+
+
+def _bnf_codes(rng, n_codes):
+    """Return `n_codes` unique, plausibly-structured 15 character BNF codes
+
+    Chapter, section and paragraph are random; the chemical, product and
+    strength parts are spelt out from a serial number, so codes are
+    unique for up to 26 ** 5 products.
+
+    """
+    chapters = rng.choice(CHAPTERS, size=n_codes, p=CHAPTER_WEIGHTS / CHAPTER_WEIGHTS.sum())
+    sections = rng.integers(1, 13, size=n_codes)
+    paragraphs = rng.integers(1, 8, size=n_codes)
+    serial = np.arange(n_codes)
+    letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    digits = [letters[(serial // 26 ** i) % 26] for i in range(5)]
+    return np.array(
+        [
+            f"{c}{s:02d}{p:02d}0{d0}{d1}A{d2}{d3}{d4}{d3}{d4}"
+            for c, s, p, d0, d1, d2, d3, d4 in zip(chapters, sections, paragraphs, *digits)
+        ]
+    )
+
+
+def _categorical(idx, values):
+    """Return `values[idx]` as a Categorical, which is much smaller than an
+    object array of repeated strings and writes the same CSV
+    """
+    categories, inverse = np.unique(values, return_inverse=True)
+    return pd.Categorical.from_codes(inverse[idx], categories=categories)
+
+
+def _bank_holidays(first_year, last_year):
+    """Return the fixed-rule English bank holidays (Easter is left out)
+    """
+    dates = []
+    for year in range(first_year, last_year + 1):
+        may = pd.date_range(f"{year}-05-01", f"{year}-05-31", freq="W-MON")
+        august = pd.date_range(f"{year}-08-01", f"{year}-08-31", freq="W-MON")
+        dates += [f"{year}-01-01", may[0], may[-1], august[-1], f"{year}-12-25", f"{year}-12-26"]
+    return pd.DataFrame({"date": pd.to_datetime(dates)})
+
+
+def _episodes(rng, n_vmpps, n_months, concession_share, mean_length, mean_gap):
+    """Return (vmpp index, first month, last month) arrays of episodes
+
+    Episodes for each VMPP are laid end to end with at least one clear
+    month in between, so each one is a separate run.  Episodes running
+    past the end of the data are truncated there.
+
+    """
+    has_concessions = rng.random(n_vmpps) < concession_share
+    max_k = max(1, n_months // 6)
+    counts = np.minimum(1 + rng.poisson(1.5, size=n_vmpps), max_k) * has_concessions
+
+    gaps = 1 + rng.geometric(1 / mean_gap, size=(n_vmpps, max_k))
+    lengths = np.minimum(rng.geometric(1 / mean_length, size=(n_vmpps, max_k)), 24)
+    gaps[:, 0] = rng.integers(0, n_months, size=n_vmpps)
+    starts = np.cumsum(gaps, axis=1) + np.cumsum(lengths, axis=1) - lengths
+    valid = (np.arange(max_k)[None, :] < counts[:, None]) & (starts < n_months)
+
+    vmpp_idx, k = np.nonzero(valid)
+    first = starts[vmpp_idx, k]
+    last = np.minimum(first + lengths[vmpp_idx, k] - 1, n_months - 1)
+    return vmpp_idx, first, last
+
+
+def generate(
+    n_vmpps=1000,
+    n_years=5,
+    start="2014-01",
+    seed=0,
+    packs_per_code=1.3,
+    concession_share=0.3,
+    mean_length=4,
+    mean_gap=18,
+    post_effect=0.25,
+    rx_from=None,
+):
+    """Return a dict of synthetic frames
+
+    The cached-extract frames (see `CACHE_SCHEMAS`) are `ncso_dates`,
+    `pc_df`, `rx_qty` and `tariff` for the post-concession analysis, and
+    `ncso_df`, `nadp_fixed` and `annual_profile_df` for the forecasts.
+    Also returned are `rx` (monthly quantity per BNF code, the input to
+    `lib.rolling`), `bank_holidays`, and the ground
+    truth: `episodes` (one row per concession, with `ongoing` set where
+    it runs to the end of the data) and `costs` (the 3 month additional
+    cost of each complete episode, computed straight from the generated
+    arrays as defined in `lib.postconcession`).
+
+    Drug Tariff prices drift slowly with occasional steps, and after each
+    concession ends the price steps up by a random factor averaging
+    `post_effect`.  `rx_qty` is only written from `rx_from` (a month
+    string, default the start of the data), like the `month >=
+    '2022-04-01'` filter in the notebook's SQL.
+
+    """
+    rng = np.random.default_rng(seed)
+    month0 = monthtime.to_month(start)
+    first_year = int(monthtime.year(month0))
+    n_months = int(n_years * 12)
+    months = monthtime.to_timestamps(np.arange(month0, month0 + n_months))
+    month_strings = np.asarray(months.strftime("%Y-%m-%d"))
+
+    # products and packs
+    n_codes = max(1, int(round(n_vmpps / packs_per_code)))
+    n_codes = min(n_codes, n_vmpps)
+    # every code has at least one pack
+    vmpp_code_idx = np.sort(
+        np.concatenate([np.arange(n_codes), rng.integers(0, n_codes, size=n_vmpps - n_codes)])
+    )
+    codes = _bnf_codes(rng, n_codes)
+    vmpps = 900000000000000 + np.arange(n_vmpps, dtype=np.int64) * 1000 + 1
+    qtyval = rng.choice(PACK_SIZES, size=n_vmpps, p=PACK_WEIGHTS / PACK_WEIGHTS.sum())
+    names = np.array([f"Synthetic drug {i} tablets" for i in range(n_codes)])
+    vmpp_names = np.array([f"{names[c]} {q} tablet" for c, q in zip(vmpp_code_idx, qtyval)])
+
+    # concession episodes, and a post-concession price step for each
+    ep_vmpp, ep_first, ep_last = _episodes(
+        rng, n_vmpps, n_months, concession_share, mean_length, mean_gap
+    )
+    ep_effect = rng.gamma(2.0, post_effect / 2.0, size=len(ep_vmpp))
+    ep_uplift = 1.2 + rng.gamma(2.0, 0.6, size=len(ep_vmpp))
+
+    # Drug Tariff prices in pence, built from log increments
+    log_steps = rng.normal(0, 0.01, size=(n_months, n_vmpps)).astype(np.float32)
+    jumps = rng.random((n_months, n_vmpps), dtype=np.float32) < 0.01
+    log_steps[jumps] += rng.normal(0, 0.2, size=jumps.sum()).astype(np.float32)
+    after = ep_last + 1
+    ok = after < n_months
+    np.add.at(log_steps, (after[ok], ep_vmpp[ok]), np.log1p(ep_effect[ok]).astype(np.float32))
+    base = rng.lognormal(np.log(300), 1.0, size=n_vmpps).astype(np.float32)
+    prices = np.maximum(1, np.rint(base * np.exp(np.cumsum(log_steps, axis=0)))).astype(np.int64)
+    del log_steps, jumps
+
+    # monthly quantity per BNF code
+    seasonal = MONTH_PROFILE[monthtime.month(np.arange(month0, month0 + n_months)) - 1]
+    volume = rng.lognormal(np.log(20000), 1.5, size=n_codes)
+    noise = rng.gamma(50.0, 1 / 50.0, size=(n_months, n_codes))
+    quantity = np.rint(seasonal[:, None] * volume[None, :] * noise)
+    del noise
+
+    # concession months: one row per episode month
+    lengths = ep_last - ep_first + 1
+    row_ep = np.repeat(np.arange(len(ep_vmpp)), lengths)
+    row_month = ep_first[row_ep] + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    row_vmpp = ep_vmpp[row_ep]
+    dt_price = prices[row_month, row_vmpp]
+    pc_price = np.rint(dt_price * ep_uplift[row_ep]).astype(np.int64)
+
+    ncso_dates = pd.DataFrame(
+        {"vmpp": vmpps[row_vmpp], "month": _categorical(row_month, month_strings), "concession_bool": 1}
+    )
+    pc_df = pd.DataFrame(
+        {
+            "month": _categorical(row_month, month_strings),
+            "name": names[vmpp_code_idx[row_vmpp]],
+            "bnf_code": codes[vmpp_code_idx[row_vmpp]],
+            "vmpp_code": vmpps[row_vmpp],
+            "pc_price_pence": pc_price,
+            "dt_price_pence": dt_price,
+            "qtyval": qtyval[row_vmpp],
+            "increased_ppu": (pc_price - dt_price) / qtyval[row_vmpp],
+        }
+    ).sort_values(["month", "bnf_code", "vmpp_code"], kind="stable")
+
+    # forecast inputs: one pack per code and month, as the notebook's SQL,
+    # with actual cost discounted by that month's NADP
+    nadp = np.clip(7.2 + np.cumsum(rng.normal(0, 0.1, size=n_months)), 5.0, 11.0).round(2)
+    rows = select_packs(pc_df.assign(row=pc_df.index))["row"].to_numpy()
+    rows = rows[row_month[rows] >= 2]
+    c_month = row_month[rows]
+    c_vmpp = row_vmpp[rows]
+    c_code = vmpp_code_idx[c_vmpp]
+    c_qty = quantity[c_month, c_code]
+    nic_per_unit = pc_price[rows] / (100 * qtyval[c_vmpp])
+    nic = c_qty * nic_per_unit
+    ncso_df = pd.DataFrame(
+        {
+            "month": _categorical(c_month, np.char.add(month_strings.astype(str), " 00:00:00+00:00")),
+            "bnf_name": names[c_code],
+            "bnf_code": codes[c_code],
+            "quantity": c_qty,
+            "quantity_2_months_previously": quantity[c_month - 2, c_code],
+            "nic": nic,
+            "actual_cost": nic * (1 - nadp[c_month] / 100) * rng.normal(1, 0.01, size=len(c_month)),
+            "normal_nic_per_unit": dt_price[rows] / (100 * qtyval[c_vmpp]),
+            "predicted_nic_per_unit": nic_per_unit,
+        }
+    )
+    nadp_fixed = pd.DataFrame({"month": month_strings, "nadp": nadp})
+    annual_profile_df = pd.DataFrame({"mon": np.arange(1, 13), "proportion": MONTH_PROFILE})
+    bank_holidays = _bank_holidays(first_year, first_year + int(np.ceil(n_years)) + 1)
+
+    # tariff history, for VMPPs that have ever had a concession (as the SQL)
+    conc_vmpps = np.unique(ep_vmpp)
+    t_month, t_col = np.divmod(np.arange(n_months * len(conc_vmpps)), len(conc_vmpps))
+    t_vmpp = conc_vmpps[t_col]
+    tariff = pd.DataFrame(
+        {
+            "bnf_code": _categorical(vmpp_code_idx[t_vmpp], codes),
+            "nm": _categorical(t_vmpp, vmpp_names),
+            "unit_qty": qtyval[t_vmpp],
+            "vmpp": vmpps[t_vmpp],
+            "date": _categorical(t_month, month_strings),
+            "price_pence": prices[t_month, t_vmpp],
+        }
+    )
+
+    # prescribing, long, and the forward 3 month sums the SQL produces for
+    # codes with a concession pack
+    rx = pd.DataFrame(
+        {
+            "month": np.repeat(months.to_numpy(), n_codes),
+            "bnf_code": _categorical(np.tile(np.arange(n_codes), n_months), codes),
+            "quantity": quantity.ravel(),
+        }
+    )
+    conc_codes = np.unique(vmpp_code_idx[conc_vmpps])
+    roll = rolling_sum(quantity[:, conc_codes], 3, "forward", complete_only=False)
+    rx_start = 0
+    if rx_from is not None:
+        rx_start = min(max(0, monthtime.to_month(rx_from) - month0), n_months)
+    rx_qty = pd.DataFrame(
+        {
+            "date_3m_start": _categorical(
+                np.repeat(np.arange(rx_start, n_months), len(conc_codes)), month_strings
+            ),
+            "bnf_code": _categorical(np.tile(conc_codes, n_months - rx_start), codes),
+            "roll_3m_quantity": roll[rx_start:].ravel(),
+        }
+    ).iloc[::-1].reset_index(drop=True)
+
+    # ground truth
+    episodes = pd.DataFrame(
+        {
+            "vmpp": vmpps[ep_vmpp],
+            "first_month": months[ep_first],
+            "last_month": months[ep_last],
+            "months": lengths,
+            "ongoing": ep_last == n_months - 1,
+            "bnf_code": codes[vmpp_code_idx[ep_vmpp]],
+            "unit_qty": qtyval[ep_vmpp],
+            "post_effect": ep_effect,
+        }
+    ).sort_values(["vmpp", "first_month"]).reset_index(drop=True)
+
+    complete = (ep_first >= 3) & (ep_last + 3 < n_months)
+    e = np.flatnonzero(complete)
+    window = np.arange(1, 4)
+    pre = prices[ep_first[e, None] - window[None, :], ep_vmpp[e, None]].mean(axis=1)
+    post = prices[ep_last[e, None] + window[None, :], ep_vmpp[e, None]].mean(axis=1)
+    qty = quantity[ep_last[e, None] + window[None, :], vmpp_code_idx[ep_vmpp[e]][:, None]].sum(axis=1)
+    costs = pd.DataFrame(
+        {
+            "vmpp": vmpps[ep_vmpp[e]],
+            "first_month": months[ep_first[e]],
+            "last_month": months[ep_last[e]],
+            "bnf_code": codes[vmpp_code_idx[ep_vmpp[e]]],
+            "quantity": qty,
+            "pre_pc_price": pre,
+            "post_pc_price": post,
+            "additional_cost": 0.01 * qty / qtyval[ep_vmpp[e]] * (post - pre),
+        }
+    ).sort_values(["vmpp", "first_month"]).reset_index(drop=True)
+
+    return {
+        "ncso_dates": ncso_dates.reset_index(drop=True),
+        "pc_df": pc_df.reset_index(drop=True),
+        "rx_qty": rx_qty,
+        "tariff": tariff,
+        "rx": rx,
+        "episodes": episodes,
+        "costs": costs,
+        "ncso_df": ncso_df,
+        "nadp_fixed": nadp_fixed,
+        "annual_profile_df": annual_profile_df,
+        "bank_holidays": bank_holidays,
+    }
+
+
+def write_synthetic(data, directory, names=None):
+    """Write the frames in `data` as `<name>.csv` files in `directory`
+
+    By default only the cached-extract frames are written, with the same
+    file names and columns as in `data/` (`tariff.csv`, `pc_df.csv`
+    etc.), so a notebook or pipeline can be pointed at `directory`
+    instead.  Returns the paths written.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    if names is None:
+        names = list(CACHE_SCHEMAS)
+    paths = []
+    for name in names:
+        path = os.path.join(directory, f"{name}.csv")
+        df = data[name]
+        if name in CACHE_SCHEMAS:
+            df = df[CACHE_SCHEMAS[name]]
+        df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
@@ -4,6 +4,30 @@
 # It allows us to tell nbval (the py.text plugin we use to run
 # notebooks and check their output is unchanged) to skip comparing
 # notebook outputs for particular mimetypes.
+#
+# It also points the notebook kernels at local fixtures instead of
+# BigQuery and the web (see lib/fixtures.py), and gives them a cache of
+# parsed fixtures shared by every notebook in the session.  Fixtures
+# come from data/ unless NOTEBOOK_FIXTURES says otherwise; set
+# NOTEBOOK_FIXTURES= (empty) to run against the real services.
+# Notebooks whose BigQuery snapshots haven't been recorded yet are
+# skipped, naming the missing files.
+
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pytest_configure(config):
+    # Kernels inherit the environment of the pytest process (or xdist
+    # worker) that starts them
+    os.environ.setdefault("NOTEBOOK_FIXTURES", os.path.join(ROOT, "data"))
+    if os.environ["NOTEBOOK_FIXTURES"] and config.cache is not None:
+        os.environ.setdefault(
+            "NOTEBOOK_FIXTURES_CACHE", str(config.cache.makedir("notebook_fixtures"))
+        )
 
 
 def pytest_collectstart(collector):
@@ -16,3 +40,21 @@ def pytest_collectstart(collector):
         # responsive plot sizing makes output different in test
         # environment
         collector.skip_compare += ("application/vnd.plotly.v1+json", "stderr")
+
+
+def pytest_collection_modifyitems(config, items):
+    fixture_dir = os.environ.get("NOTEBOOK_FIXTURES")
+    if not fixture_dir:
+        return
+    from lib import fixtures
+
+    if os.environ.get(fixtures.RECORD_ENV):
+        return
+    for item in items:
+        path = str(item.fspath)
+        if not path.endswith(".ipynb"):
+            continue
+        missing = fixtures.missing_snapshots(path, fixture_dir)
+        if missing:
+            reason = f"no fixture for {', '.join(missing)}; record it with {fixtures.RECORD_ENV}=1"
+            item.add_marker(pytest.mark.skip(reason=reason))
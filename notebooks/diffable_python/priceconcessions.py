@@ -32,14 +32,12 @@ import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.dates import DateFormatter
 import matplotlib.ticker as ticker
 import matplotlib.dates as mdates
 # %matplotlib inline
-from ebmdatalab import bq
-from ebmdatalab import charts
-import lxml
 import datetime
+from lib import lazy_import
+bq = lazy_import("ebmdatalab.bq")  # only loaded when a query runs
 
 # We need to import data from BigQuery to undertake the analysis.
 #
@@ -160,19 +158,6 @@ ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
 ax.yaxis.set_major_formatter(ticker.PercentFormatter(1, decimals=None)) ##sets y axis labels as percent (and formats correctly i.e. x100)
 ax.set_title('Percentage difference between forecasted price concession costs and actual spend')
 
-# +
-x = [datetime.datetime(2010, 12, 1, 10, 0),
-    datetime.datetime(2011, 1, 4, 9, 0),
-    datetime.datetime(2011, 5, 5, 9, 0)]
-y = [4, 9, 2]
-
-ax = plt.subplot(111)
-ax.bar(x, y, width=10)
-ax.xaxis_date()
-
-plt.show()
-# -
-
 # As we can see from the chart above, on a monthly basis the price concession data is usually accurate to within 5%.  The tool usually *overestimates* (i.e. a negative percentage) in February of each year, due to the difference in working or dispensing days between the actual month and the month used for prediction (December).  
 
 # ### Impact within Year
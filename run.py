@@ -1,13 +1,19 @@
 """A cross-platform script to build and start a notebook, open a web
 browser on the correct port, and handle shutdowns gracefully
 
+The image is tagged with a hash of the files it's built from, so it's
+only rebuilt when one of them changes, and a container already running
+for this directory is reused rather than started again.
+
 """
+import hashlib
 import os
 import signal
 import subprocess
 import socket
 import sys
 import time
+import urllib.error
 import urllib.request
 import webbrowser
 
@@ -15,26 +21,57 @@ tag = "datalab-notebook"
 current_dir = os.getcwd()
 target_dir = "/home/app/notebook"
 
+# the files the image is built from (see the COPY lines in the Dockerfile)
+build_inputs = [
+    "Dockerfile",
+    "requirements.txt",
+    os.path.join("config", "kernel.json"),
+    "bq-service-account.json",
+]
+
+# label marking a container with the directory it was started for
+dir_label = "org.ebmdatalab.notebook-dir"
+
 
-def await_jupyter_http(port):
-    """Wait up to 10 seconds for Jupyter to be available
+def build_hash():
+    """Return a hash of the contents of the files the image is built from
+    """
+    digest = hashlib.sha256()
+    for name in build_inputs:
+        digest.update(name.encode("utf8"))
+        if os.path.exists(name):
+            with open(name, "rb") as f:
+                digest.update(f.read())
+        else:
+            digest.update(b"(missing)")
+    return digest.hexdigest()[:16]
+
+
+def await_jupyter_http(port, timeout=120, container_id=None):
+    """Wait up to `timeout` seconds for Jupyter's API to answer
+
+    Polls with exponential backoff (starting at 50ms, at most 1s apart),
+    and gives up early if `container_id` stops running.
     """
     print(f"Waiting for Jupyter to be ready on port {port}")
-    timeout = 10
-    increment = 0.1
-    counter = 0
-    url = f"http://localhost:{port}"
-    while counter < (timeout / increment):
+    url = f"http://localhost:{port}/api"
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
         try:
-            with urllib.request.urlopen(url, timeout=timeout):
+            with urllib.request.urlopen(url, timeout=2):
                 return
-        except ConnectionResetError:
-            counter += 1
-            time.sleep(increment)
-        except socket.timeout:
-            break
-
-    raise SystemError(f"Unable to reach Jupyter at {url}")
+        except urllib.error.HTTPError:
+            # the server is up, even if it won't answer this request
+            return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        if container_id is not None and not docker_running(container_id):
+            raise SystemError(f"The container stopped before Jupyter was ready; see `docker logs {container_id}`")
+        if time.monotonic() + delay > deadline:
+            raise SystemError(f"Unable to reach Jupyter at {url}")
+        time.sleep(delay)
+        delay = min(delay * 2, 1)
 
 
 def stream_subprocess_output(cmd):
@@ -54,34 +91,88 @@ def stream_subprocess_output(cmd):
             raise subprocess.CalledProcessError(cmd=cmd, returncode=p.returncode)
 
 
+def docker_image_exists(image):
+    """Return whether `image` (name:tag) is already built
+    """
+    completed_process = subprocess.run(
+        ["docker", "image", "inspect", image], capture_output=True
+    )
+    return completed_process.returncode == 0
+
+
 def docker_build(tag):
-    """Build container for Dockerfile in current directory
+    """Build container for Dockerfile in current directory, unless an
+    image built from the same files exists; return the image name
+
     """
+    image = f"{tag}:{build_hash()}"
+    if docker_image_exists(image):
+        print(f"Using existing docker image {image}")
+        return image
     print(
         "Building docker image. This may take some time (particularly on the first run)..."
     )
-    buildcmd = ["docker", "build", "-t", tag, "-f", "Dockerfile", "."]
+    buildcmd = ["docker", "build", "-t", image, "-t", tag, "-f", "Dockerfile", "."]
     stream_subprocess_output(buildcmd)
+    return image
+
+
+def docker_running(container_id):
+    """Return whether the container is still running
+    """
+    completed_process = subprocess.run(
+        ["docker", "inspect", "--format", "{{.State.Running}}", container_id],
+        capture_output=True,
+    )
+    return completed_process.stdout.decode("utf8").strip() == "true"
+
+
+def docker_find(image):
+    """Return the id of a running container of `image` for this
+    directory, or None
+
+    """
+    completed_process = subprocess.run(
+        [
+            "docker",
+            "ps",
+            "--quiet",
+            "--filter",
+            f"label={dir_label}={current_dir}",
+            "--filter",
+            f"ancestor={image}",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    container_ids = completed_process.stdout.decode("utf8").split()
+    return container_ids[0] if container_ids else None
 
 
-def docker_run(tag):
-    """Run docker in background, and install signal handler to stop it
-    again
+def docker_run(image):
+    """Run docker in background (or reuse a container already running
+    for this directory), and install signal handler to stop it again
 
     """
-    print("Running docker...")
-    runcmd = [
-        "docker",
-        "run",
-        "--detach",  # in the background, so we can find out the port it's bound to
-        "--rm",  # clean up the container after it's stopped
-        "--mount",
-        f"source={current_dir},dst={target_dir},type=bind",
-        "--publish-all",
-        tag,
-    ]
-    completed_process = subprocess.run(runcmd, check=True, capture_output=True)
-    container_id = completed_process.stdout.decode("utf8").strip()
+    container_id = docker_find(image)
+    if container_id:
+        print(f"Reusing running container {container_id}")
+    else:
+        print("Running docker...")
+        runcmd = [
+            "docker",
+            "run",
+            "--detach",  # in the background, so we can find out the port it's bound to
+            "--rm",  # clean up the container after it's stopped
+            "--label",
+            f"{dir_label}={current_dir}",
+            "--mount",
+            f"source={current_dir},dst={target_dir},type=bind",
+            "--publish-all",
+            image,
+        ]
+        completed_process = subprocess.run(runcmd, check=True, capture_output=True)
+        container_id = completed_process.stdout.decode("utf8").strip()
 
     def stop_handler(sig, frame):
         print("Stopping docker...")
@@ -99,16 +190,17 @@ def docker_port(container_id):
     completed_process = subprocess.run(
         ["docker", "port", container_id], check=True, capture_output=True
     )
-    port_mapping = completed_process.stdout.decode("utf8").strip()
+    # one line per address, e.g. "8888/tcp -> 0.0.0.0:49153"
+    port_mapping = completed_process.stdout.decode("utf8").strip().splitlines()[0]
     port = port_mapping.split(":")[-1]
     return port
 
 
 def main():
-    docker_build(tag)
-    container_id = docker_run(tag)
+    image = docker_build(tag)
+    container_id = docker_run(image)
     port = docker_port(container_id)
-    await_jupyter_http(port)
+    await_jupyter_http(port, container_id=container_id)
     webbrowser.open(f"http://localhost:{port}", new=2)  # Open in a new tab
     print(
         "To stop this docker container, use Ctrl+ C, or the File -> Shut Down menu in Jupyter Lab"
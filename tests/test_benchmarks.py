@@ -0,0 +1,32 @@
+"""Benchmark stages count the rows of their own inputs"""
+import pytest
+
+from lib import benchmarks, synthetic
+
+PARAMS = {"n_vmpps": 30, "n_years": 3}
+
+
+@pytest.fixture(scope="module")
+def measured():
+    return benchmarks.run_scale(PARAMS, repeat=1, seed=3)
+
+
+def test_rows_in_are_the_declared_inputs(measured):
+    data = synthetic.generate(seed=3, **PARAMS)
+    assert list(measured) == [name for name, _, _ in benchmarks.stages(None, data)]
+    assert measured["cache_load"]["rows_in"] == sum(len(data[name]) for name in synthetic.CACHE_SCHEMAS)
+    assert measured["episode_detection"]["rows_in"] == len(data["ncso_dates"])
+    assert measured["forecast"]["rows_in"] == len(data["ncso_df"])
+    assert measured["bnf_rollups"]["rows_in"] == len(data["ncso_df"])
+    assert measured["pre_post_merges"]["rows_in"] == (
+        measured["episode_detection"]["rows_out"] + len(data["tariff"]) + len(data["rx"])
+    )
+    assert measured["fy_rollups"]["rows_in"] == measured["reweighting"]["rows_out"]
+
+
+def test_compare_flags_slower_stages(measured):
+    base = {"scales": {"small": {"stages": measured}}}
+    slower = {name: dict(m, seconds=m["seconds"] + 1) for name, m in measured.items()}
+    regressions = benchmarks.compare(base, {"scales": {"small": {"stages": slower}}})
+    assert {r["stage"] for r in regressions} == set(measured)
+    assert benchmarks.compare(base, base) == []
@@ -0,0 +1,48 @@
+"""BNF hierarchy rollups agree with a groupby on code prefixes"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import bnf
+
+CODES = ["0407010H0AAAMAM", "0407010B0AAAIAI", "0403010B0AAAIAI", "0205052V0AAAAAA", "0407020Q0AAACAC"]
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    n = 500
+    return pd.DataFrame(
+        {
+            "month": rng.choice(pd.date_range("2023-01-01", periods=6, freq="MS"), n),
+            "bnf_code": rng.choice(CODES, n),
+            "actual_cost": rng.random(n) * 100,
+        }
+    )
+
+
+@pytest.mark.parametrize("level", list(bnf.LEVELS))
+def test_rollups_match_groupby(df, level):
+    hierarchy = bnf.Hierarchy(df["bnf_code"])
+    prefixes = df["bnf_code"].str[: bnf.LEVELS[level]]
+    expected = df.groupby(prefixes)["actual_cost"].sum()
+    result = hierarchy.rollup(hierarchy.positions(df["bnf_code"]), df["actual_cost"], level)
+    assert result.index.tolist() == expected.index.tolist()
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy())
+
+    expected = df.assign(**{level: prefixes}).groupby(["month", level], as_index=False)["actual_cost"].sum()
+    result = hierarchy.rollup_frame(df, level, "actual_cost", by="month")
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_drill_down():
+    hierarchy = bnf.Hierarchy(CODES)
+    assert hierarchy.children("04").tolist() == ["0403", "0407"]
+    assert hierarchy.members("0407", "chemical").tolist() == ["0407010B0", "0407010H0", "0407020Q0"]
+    assert hierarchy.labels["chapter"][hierarchy.parents("section", "chapter")].tolist() == ["02", "04", "04"]
+
+
+def test_unknown_codes_raise():
+    hierarchy = bnf.Hierarchy(CODES[:2])
+    with pytest.raises(KeyError):
+        hierarchy.rollup(CODES, np.ones(len(CODES)))
@@ -0,0 +1,34 @@
+"""Charts rendered before a failure are kept in the manifest"""
+import pandas as pd
+import pytest
+
+from lib import charts
+
+
+def _line(df):
+    fig, ax = charts._figure()
+    ax.plot(df["x"], df["y"])
+    return fig
+
+
+def _broken(df):
+    raise RuntimeError("can't draw this")
+
+
+@pytest.fixture
+def fake_charts(monkeypatch):
+    monkeypatch.setattr(
+        charts,
+        "CHARTS",
+        {"line": (_line, "points", ["x", "y"]), "broken": (_broken, "points", ["x", "y"])},
+    )
+
+
+def test_failure_keeps_rendered_charts(tmp_path, fake_charts):
+    tables = {"points": pd.DataFrame({"x": [1, 2, 3], "y": [2.0, 1.0, 3.0]})}
+    with pytest.raises(RuntimeError):
+        charts.render_all(tables, str(tmp_path), formats=("png",), workers=1)
+    assert list(charts.read_manifest(str(tmp_path))) == ["line.png"]
+
+    status = charts.render_all(tables, str(tmp_path), names=["line"], formats=("png",), workers=1)
+    assert status == {"line.png": "unchanged"}
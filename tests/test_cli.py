@@ -0,0 +1,37 @@
+"""Global options work in front of every subcommand, and missing inputs stop the run"""
+import os
+import shutil
+
+import pytest
+
+from lib import cli
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.mark.parametrize("global_options", [[], ["--log-format", "json"], ["-v", "--profile", "{tmp}/trace.jsonl"]])
+def test_delegated_subcommands_after_global_options(tmp_path, global_options):
+    argv = [option.format(tmp=tmp_path) for option in global_options]
+    argv += ["store", "build", "--data-dir", DATA, "--store", str(tmp_path / "store")]
+    assert cli.main(argv) == cli.EXIT_OK
+    assert (tmp_path / "store").is_dir()
+
+
+def test_split_delegated():
+    assert cli.split_delegated(["--log-format", "json", "cube", "--help"])[1:] == ("cube", ["--help"])
+    # an option's value isn't a subcommand
+    assert cli.split_delegated(["--profile", "store"]) is None
+    assert cli.split_delegated(["run", "--data-dir", "store"]) is None
+    # bad global options aren't delegated (and don't exit)
+    assert cli.split_delegated(["--log-format", "xml", "store"]) is None
+    assert cli.split_delegated(["--profile"]) is None
+
+
+def test_missing_bank_holidays_is_a_missing_input(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for name in ("ncso_df", "nadp_fixed", "annual_profile_df"):
+        shutil.copy(os.path.join(DATA, f"{name}.csv"), data_dir)
+    argv = ["run", "--data-dir", str(data_dir), "--output-dir", str(tmp_path / "out"), "--no-cache"]
+    assert cli.main(argv) == cli.EXIT_MISSING_INPUT
+    assert not (tmp_path / "out").exists()
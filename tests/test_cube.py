@@ -0,0 +1,75 @@
+"""Cube lookups, lags, rolling windows and totals match a pandas pivot of the extract"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import cube, ingest, monthtime
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture(scope="module")
+def ncso_df():
+    return ingest.read_cache("ncso_df", DATA_DIR, usecols=["month", "bnf_code", "quantity", "nic", "actual_cost"])
+
+
+@pytest.fixture(scope="module")
+def built(tmp_path_factory):
+    return cube.build(DATA_DIR, str(tmp_path_factory.mktemp("cube") / "cube"))
+
+
+def pivot(df, column):
+    table = df.pivot_table(index="month", columns="bnf_code", values=column, aggfunc="sum")
+    months = pd.date_range(df["month"].min(), df["month"].max(), freq="MS")
+    return table.reindex(index=months, columns=sorted(df["bnf_code"].unique())).fillna(0.0)
+
+
+def test_layers_are_the_sources(built):
+    assert built.layers == ["quantity", "net_cost", "actual_cost"]
+    assert set(built.layers) == set(cube.LAYERS)
+
+
+def test_grid(ncso_df, built):
+    expected = pivot(ncso_df, "quantity")
+    grid = built.grid("quantity")
+    assert grid.codes.tolist() == expected.columns.tolist()
+    assert monthtime.to_timestamps(grid.months).tolist() == expected.index.tolist()
+    np.testing.assert_array_equal(grid.values, expected.to_numpy())
+    observed = ncso_df.assign(row=True).pivot_table(index="month", columns="bnf_code", values="row", aggfunc="any")
+    np.testing.assert_array_equal(grid.observed, observed.reindex_like(expected).fillna(False).to_numpy(dtype=bool))
+
+
+def test_get(ncso_df, built):
+    expected = pivot(ncso_df, cube.SOURCES["ncso_df"]["net_cost"])
+    sample = ncso_df.sample(50, random_state=0)
+    np.testing.assert_array_equal(
+        built.get("net_cost", sample["month"], sample["bnf_code"]),
+        [expected.at[m, c] for m, c in zip(sample["month"], sample["bnf_code"])],
+    )
+    # a month before the cube, and a code that isn't in it
+    got = built.get("net_cost", pd.to_datetime(["2016-12-01", "2017-01-01"]), [sample["bnf_code"].iloc[0], "X"])
+    assert np.isnan(got).all()
+
+
+def test_lag(ncso_df, built):
+    expected = pivot(ncso_df, "quantity")
+    np.testing.assert_array_equal(built.lag("quantity", 2), expected.shift(2).to_numpy())
+    np.testing.assert_array_equal(built.lag("quantity", -1), expected.shift(-1).to_numpy())
+
+
+def test_rolling(ncso_df, built):
+    expected = pivot(ncso_df, "quantity")
+    # this month and the next two, as the rx_qty query
+    forward = expected.rolling(3, 3).sum().shift(-2).to_numpy()
+    np.testing.assert_allclose(built.rolling("quantity", 3), forward, rtol=1e-12)
+
+
+@pytest.mark.parametrize("level", ["chapter", "section"])
+def test_totals(ncso_df, built, level):
+    expected = pivot(ncso_df, "actual_cost")
+    expected = expected.T.groupby(expected.columns.str[: cube.BNF_LEVELS[level]]).sum().T
+    totals = built.totals("actual_cost", level=level)
+    assert totals.columns.tolist() == expected.columns.tolist()
+    np.testing.assert_allclose(totals.to_numpy(), expected.to_numpy(), rtol=1e-12)
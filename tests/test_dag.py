@@ -0,0 +1,47 @@
+"""Stage keys follow the library code, and the cache holds several inputs per stage"""
+import importlib
+import sys
+
+import pytest
+
+from lib import dag
+
+
+@pytest.fixture
+def helpers(tmp_path, monkeypatch):
+    package = tmp_path / "helpers"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "maths.py").write_text("def scale(x):\n    return x * 2\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield package
+    for name in [n for n in sys.modules if n.split(".")[0] == "helpers"]:
+        del sys.modules[name]
+
+
+def _pipeline(cache_dir):
+    from helpers import maths
+
+    pipeline = dag.Pipeline(cache_dir=str(cache_dir), code=("helpers",), keep=2)
+    pipeline.add("scaled", lambda x: maths.scale(x), inputs=["x"])
+    return pipeline
+
+
+def test_library_changes_invalidate_stages(tmp_path, helpers):
+    assert _pipeline(tmp_path / "cache").run({"x": 3})["scaled"] == 6
+    (helpers / "maths.py").write_text("def scale(x):\n    return x * 10\n")
+    importlib.reload(sys.modules["helpers.maths"])
+    pipeline = _pipeline(tmp_path / "cache")
+    assert pipeline.run({"x": 3})["scaled"] == 30
+    assert pipeline.last_run == {"scaled": "ran"}
+
+
+def test_switching_between_inputs_reuses_the_cache(tmp_path, helpers):
+    for x in (1, 2):
+        _pipeline(tmp_path / "cache").run({"x": x})
+    pipeline = _pipeline(tmp_path / "cache")
+    pipeline.run({"x": 1})
+    assert pipeline.last_run == {"scaled": "cached"}
+    # only `keep` entries are kept per stage
+    pipeline.run({"x": 3})
+    assert len(list((tmp_path / "cache").iterdir())) == 2
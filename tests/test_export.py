@@ -0,0 +1,65 @@
+"""Each export writer reads back what was written, chunk by chunk"""
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import export
+
+
+@pytest.fixture
+def frame():
+    n = 25
+    return pd.DataFrame(
+        {
+            "bnf_code": [f"0{i:04d}" for i in range(n)],
+            "month": pd.date_range("2022-01-01", periods=n, freq="MS"),
+            "quantity": np.arange(n, dtype=np.float64) * 1.5,
+            "packs": np.arange(n, dtype=np.int64),
+        }
+    ).assign(quantity=lambda df: df["quantity"].where(df.index % 7 != 3))
+
+
+def test_infer_format():
+    assert export.infer_format("x.csv.gz") == ("csv", "gzip")
+    assert export.infer_format("X.Parquet") == ("parquet", None)
+    with pytest.raises(ValueError):
+        export.infer_format("x.json")
+
+
+@pytest.mark.parametrize("name", ["out.csv", "out.csv.gz", "out.csv.xz"])
+def test_csv(tmp_path, frame, name):
+    path = str(tmp_path / name)
+    # later chunks in a different column order still line up with the header
+    pieces = [chunk if i == 0 else chunk[chunk.columns[::-1]] for i, chunk in enumerate(export.chunks(frame, 10))]
+    assert len(pieces) == 3
+    assert export.write_chunks(pieces, path) == len(frame)
+    if name.endswith(".gz"):
+        with gzip.open(path, "rt") as f:
+            assert f.readline().strip() == ",".join(frame.columns)
+    result = pd.read_csv(path, dtype={"bnf_code": str}, parse_dates=["month"])
+    pd.testing.assert_frame_equal(result, frame, check_dtype=False)
+
+
+def test_parquet(tmp_path, frame):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "out.parquet")
+    assert export.write_chunks(export.chunks(frame, 10), path, compression="zstd") == len(frame)
+    import pyarrow.parquet
+
+    assert pyarrow.parquet.ParquetFile(path).num_row_groups == 3
+    pd.testing.assert_frame_equal(pd.read_parquet(path), frame, check_dtype=False)
+
+
+def test_xlsx_starts_a_new_sheet_when_full(tmp_path, frame, monkeypatch):
+    openpyxl = pytest.importorskip("openpyxl")
+    monkeypatch.setattr(export, "XLSX_MAX_ROWS", 11)
+    path = str(tmp_path / "out.xlsx")
+    assert export.write_chunks(export.chunks(frame, 10), path) == len(frame)
+    assert openpyxl.load_workbook(path, read_only=True).sheetnames == ["data", "data_2", "data_3"]
+    sheets = pd.read_excel(path, sheet_name=None, dtype={"bnf_code": str}, engine="openpyxl")
+    assert [len(sheet) for sheet in sheets.values()] == [10, 10, 5]
+    result = pd.concat(sheets.values(), ignore_index=True)
+    pd.testing.assert_frame_equal(result, frame, check_dtype=False)
+
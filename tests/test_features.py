@@ -0,0 +1,34 @@
+"""Bank holidays come from the cached CSV or the saved gov.uk JSON, never silently from nowhere"""
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from lib import features
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def test_reads_the_saved_json():
+    holidays = features.read_bank_holidays(DATA)
+    dates = holidays.dt.strftime("%Y-%m-%d").tolist()
+    assert "2022-09-19" in dates  # the State Funeral
+    assert "2022-11-30" not in dates  # St Andrew's Day is Scotland only
+
+
+def test_csv_comes_first(tmp_path):
+    (tmp_path / features.BANK_HOLIDAYS_FILE).write_text("date\n2022-12-26\n")
+    shutil.copy(features.bank_holidays_path(DATA), tmp_path)
+    assert features.read_bank_holidays(str(tmp_path)).tolist() == [pd.Timestamp("2022-12-26")]
+
+
+def test_missing_holidays_raise(tmp_path):
+    assert features.bank_holidays_path(str(tmp_path)) is None
+    with pytest.raises(FileNotFoundError):
+        features.read_bank_holidays(str(tmp_path))
+
+
+def test_holidays_change_the_work_days():
+    counts = features.day_counts(["2022-08-01", "2022-09-01"], features.read_bank_holidays(DATA))
+    assert (counts["nobhworkdays"] - counts["workdays"]).tolist() == [1, 1]
@@ -0,0 +1,63 @@
+"""The notebook fixtures serve URLs and snapshots without the network"""
+import os
+import socket
+
+import pandas as pd
+import pytest
+
+from lib import fixtures
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+BANK_HOLIDAYS = "https://www.gov.uk/bank-holidays.json"
+
+
+@pytest.fixture
+def installed(monkeypatch, tmp_path):
+    for reader in fixtures.URL_READERS:
+        monkeypatch.setattr(pd, reader, getattr(pd, reader))
+    monkeypatch.setattr(socket, "socket", socket.socket)
+    (tmp_path / "ncso_df.csv").write_text("month,quantity\n2023-01-01,1\n")
+    with open(fixtures.url_fixture_path(str(tmp_path), "read_json", BANK_HOLIDAYS), "w") as f:
+        f.write('{"england-and-wales": {"division": "england-and-wales", "events": [{"date": "2023-01-02"}]}}')
+    assert fixtures.install(str(tmp_path), record=False)
+    return tmp_path
+
+
+def test_read_json_reads_the_url_fixture(installed):
+    bh = pd.read_json(BANK_HOLIDAYS, orient="index")
+    assert pd.json_normalize(bh.iloc[0]["events"])["date"].tolist() == ["2023-01-02"]
+
+
+def test_missing_url_fixture_raises(installed):
+    with pytest.raises(fixtures.MissingFixture):
+        pd.read_json("https://example.com/missing.json")
+
+
+def test_cached_read_serves_snapshot(installed):
+    cached_read = fixtures.cached_read(str(installed))
+    assert cached_read("SELECT 1", csv_path="../data/ncso_df.csv")["quantity"].tolist() == [1]
+    with pytest.raises(fixtures.MissingFixture):
+        cached_read("SELECT 1", csv_path="../data/tariff.csv")
+
+
+def test_remote_connections_are_refused(installed):
+    with socket.socket() as s, pytest.raises(fixtures.MissingFixture):
+        s.connect(("192.0.2.1", 443))
+
+
+def test_committed_fixtures_cover_the_notebook_urls():
+    bh = pd.read_json(fixtures.url_fixture_path(DATA, "read_json", BANK_HOLIDAYS), orient="index")
+    assert "2022-09-19" in pd.json_normalize(bh.iloc[0]["events"])["date"].tolist()
+    nadp_url = "https://www.nhsbsa.nhs.uk/prescription-data/understanding-our-data/financial-forecasting"
+    with open(fixtures.html_fixture_path(DATA, nadp_url), encoding="utf8") as f:
+        assert "National Average Discount Percentage" in f.read()
+
+
+def test_notebooks_without_their_snapshots_are_skipped(tmp_path):
+    notebook = "notebooks/Post price concession changes.ipynb"
+    # no tariff.csv snapshot has been recorded from BigQuery
+    assert fixtures.missing_snapshots(notebook, DATA) == ["tariff.csv"]
+    assert fixtures.missing_snapshots("notebooks/priceconcessions.ipynb", DATA) == []
+    for name in fixtures.NOTEBOOK_SNAPSHOTS["Post price concession changes.ipynb"]:
+        (tmp_path / name).write_text("")
+    assert fixtures.missing_snapshots(notebook, str(tmp_path)) == []
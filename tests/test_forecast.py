@@ -0,0 +1,53 @@
+"""Months without a weighting only lose the methods that need it"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import forecast
+
+
+@pytest.fixture
+def monthly():
+    months = pd.date_range("2022-01-01", periods=6, freq="MS")
+    return pd.DataFrame(
+        {
+            "month": months,
+            "actual_cost": np.full(6, 110.0),
+            "predicted_actual_cost": np.full(6, 100.0),
+            "prediction_difference": np.full(6, 10.0),
+        }
+    )
+
+
+@pytest.fixture
+def weights(monthly):
+    # the NADP stops after March 2022
+    return pd.DataFrame(
+        {
+            "month": monthly["month"],
+            "nadp_weighting": [1.1, 1.1, 1.1, np.nan, np.nan, np.nan],
+            "profile_weighting": np.ones(6),
+        }
+    )
+
+
+def test_reweight_keeps_months_missing_a_weighting(monthly, weights):
+    methods = {"nadp": ["nadp_weighting"], "profile": ["profile_weighting"]}
+    with pytest.warns(UserWarning, match="nadp in: 2022-04, 2022-05, 2022-06"):
+        df = forecast.reweight(monthly, weights, methods)
+    assert len(df) == 6
+    assert df["predicted_actual_cost"].notna().all()
+    assert df["profile_perc_difference"].notna().all()
+    assert df["nadp_perc_difference"].isna().tolist() == [False] * 3 + [True] * 3
+    np.testing.assert_allclose(df["nadp_predicted_actual_cost"][:3], 110.0)
+
+
+def test_financial_year_totals_leave_incomplete_methods_empty(monthly, weights):
+    methods = {"nadp": ["nadp_weighting"], "profile": ["profile_weighting"]}
+    with pytest.warns(UserWarning):
+        fy = forecast.financial_year_totals(forecast.reweight(monthly, weights, methods))
+    # FY ending 2022 (Jan - Mar) has the NADP throughout; FY ending 2023 doesn't
+    assert fy["financial_year"].tolist() == [2022, 2023]
+    assert fy["months"].tolist() == [3, 3]
+    assert fy["nadp_perc_difference"].isna().tolist() == [False, True]
+    np.testing.assert_allclose(fy["profile_perc_difference"], 10 / 110)
@@ -0,0 +1,93 @@
+"""The computational core imports quickly, without plotting or warehouse clients
+
+Each check runs in a fresh interpreter, so modules already imported by
+pytest don't hide the cost.  The budget is for `lib`'s own import time
+on top of NumPy and pandas (which the core can't do without); set
+`LIB_IMPORT_BUDGET` (seconds) to change it on a slow machine.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE = [
+    "lib.monthtime",
+    "lib.ingest",
+    "lib.rolling",
+    "lib.bnf",
+    "lib.episodes",
+    "lib.packs",
+    "lib.postconcession",
+    "lib.features",
+    "lib.forecast",
+    "lib.dag",
+    "lib.export",
+]
+
+# top-level packages the core mustn't import itself
+OPTIONAL = [
+    "matplotlib",
+    "seaborn",
+    "ebmdatalab",
+    "google",
+    "pandas_gbq",
+    "lxml",
+    "bs4",
+    "html5lib",
+    "IPython",
+    "openpyxl",
+    "plotly",
+]
+
+BUDGET = float(os.environ.get("LIB_IMPORT_BUDGET", "0.25"))
+
+SCRIPT = """
+import json, sys, time
+import numpy, pandas
+baseline = set(sys.modules)
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "new": sorted(set(sys.modules) - baseline)}}))
+"""
+
+
+def _import(modules):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    completed = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(modules=modules)],
+        env=env,
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout)
+
+
+def test_core_imports_no_optional_packages():
+    result = _import(CORE)
+    loaded = sorted({name.split(".")[0] for name in result["new"]} & set(OPTIONAL))
+    assert loaded == []
+
+
+def test_core_import_time_within_budget():
+    # best of three, to ride out a busy machine
+    seconds = min(_import(CORE)["seconds"] for _ in range(3))
+    assert seconds < BUDGET, f"importing the core took {seconds:.3f}s (budget {BUDGET}s)"
+
+
+def test_cli_starts_without_pandas():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    completed = subprocess.run(
+        [sys.executable, "-c", "import sys, lib.cli; print(sorted({'numpy', 'pandas'} & set(sys.modules)))"],
+        env=env,
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert completed.stdout.strip() == "[]"
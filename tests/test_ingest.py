@@ -0,0 +1,65 @@
+"""Fixed-format date parsing agrees with pd.to_datetime and rejects drifted formats"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import ingest, monthtime
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def test_layout():
+    width, fields, literals = ingest.layout("%d/%m/%Y")
+    assert width == 10
+    assert fields == {"d": (0, 2), "m": (3, 5), "Y": (6, 10)}
+    assert literals == [(2, "/"), (5, "/")]
+    with pytest.raises(ValueError):
+        ingest.layout("%b %Y")
+
+
+def test_parse_dates():
+    values = ["2017-01-01 00:00:00+00:00", "2022-12-01 00:00:00+00:00", None, "2017-01-01 00:00:00+00:00"]
+    parsed = ingest.parse_dates(values, ingest.SCHEMAS["ncso_df"]["month"])
+    expected = pd.to_datetime(values, utc=True).tz_localize(None).to_numpy()
+    np.testing.assert_array_equal(parsed, expected)
+
+    days = ingest.parse_dates(["10/11/1999", "29/02/2000"], "%d/%m/%Y", unit="D")
+    assert pd.DatetimeIndex(days).strftime("%Y-%m-%d").tolist() == ["1999-11-10", "2000-02-29"]
+    months = ingest.parse_dates(["10/11/1999"], "%d/%m/%Y")
+    assert pd.DatetimeIndex(months).strftime("%Y-%m-%d").tolist() == ["1999-11-01"]
+
+
+@pytest.mark.parametrize(
+    "value, fmt, unit",
+    [
+        ("2022-1-01", "%Y-%m-%d", "M"),
+        ("2022-01-01 ", "%Y-%m-%d", "M"),
+        ("2022/01/01", "%Y-%m-%d", "M"),
+        ("2022-13-01", "%Y-%m-%d", "M"),
+        ("20x2-01-01", "%Y-%m-%d", "M"),
+        ("30/02/2022", "%d/%m/%Y", "D"),
+    ],
+)
+def test_drifted_formats_raise(value, fmt, unit):
+    with pytest.raises(ValueError):
+        ingest.parse_dates([value], fmt, unit=unit)
+
+
+def test_parse_months():
+    months = ingest.parse_months(["2022-07-01", "2022-01-01", "2022-07-01"], "%Y-%m-%d")
+    assert months.tolist() == monthtime.to_months(["2022-07", "2022-01", "2022-07"]).tolist()
+    with pytest.raises(ValueError):
+        ingest.parse_months(["2022-07-01", None], "%Y-%m-%d")
+
+
+def test_read_cache():
+    df = ingest.read_cache("ncso_df", DATA, usecols=["month", "bnf_code"])
+    expected = pd.to_datetime(pd.read_csv(os.path.join(DATA, "ncso_df.csv"), usecols=["month"])["month"], utc=True)
+    np.testing.assert_array_equal(df["month"].to_numpy(), expected.dt.tz_localize(None).to_numpy())
+
+    ordinals = ingest.read_cache("test_cons", DATA, ordinals=True)
+    assert ordinals["month"].dtype == monthtime.DTYPE
+    with pytest.raises(KeyError):
+        ingest.read_cache("unknown", DATA)
@@ -0,0 +1,56 @@
+"""Memoised cells replay the state they leave behind"""
+import json
+import os
+import socket
+
+import pandas as pd
+import pytest
+
+from lib import memo
+
+
+def test_item_and_attribute_assignments_count_as_outputs():
+    loaded, stored = memo.cell_names('df["p"] = df["q"] * 2\nother.loc[0, "x"] = 1\nobj.attr = y\ndel frame["z"]')
+    assert {"df", "other", "obj", "frame"} <= stored
+    assert {"df", "other", "obj", "y", "frame"} <= loaded
+
+
+@pytest.fixture
+def shell(tmp_path):
+    interactiveshell = pytest.importorskip("IPython.core.interactiveshell")
+    shell = interactiveshell.InteractiveShell.instance()
+    memo.load_ipython_extension(shell)
+    yield lambda cell: shell.run_cell_magic("memo", f"--dir {tmp_path}", cell), shell.user_ns
+    interactiveshell.InteractiveShell.clear_instance()
+
+
+@pytest.mark.parametrize(
+    "cell",
+    ['df["p"] = df["q"] * 2', 'df.loc[:, "p"] = df["q"] * 2', 'df.insert(1, "p", df["q"] * 2)'],
+)
+def test_replay_restores_mutated_frames(shell, cell):
+    run, namespace = shell
+    for _ in range(2):  # run, then replay from the cache
+        namespace["df"] = pd.DataFrame({"q": [1, 2]})
+        run(cell)
+        assert namespace["df"].columns.tolist() == ["q", "p"]
+
+
+def test_unfingerprintable_inputs_run_uncached(shell, tmp_path):
+    run, namespace = shell
+    with socket.socket() as connection:
+        namespace.update(connection=connection, calls=[])
+        run("calls.append(connection.family)")
+        run("calls.append(connection.family)")
+        assert len(namespace["calls"]) == 2
+    assert memo.Store(str(tmp_path)).entries() == []
+
+
+def test_frames_are_stored_as_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame({"vmpp": [1, 2], "month": pd.to_datetime(["2022-01-01", "2022-02-01"]), "price": [1.5, None]})
+    store = memo.Store(str(tmp_path))
+    store.put("key", {"df": df})
+    with open(os.path.join(str(tmp_path), "key", memo.MANIFEST_FILE)) as f:
+        assert json.load(f)["df"]["format"] == "parquet"
+    pd.testing.assert_frame_equal(store.get("key")[0]["df"], df)
@@ -0,0 +1,45 @@
+"""Month ordinals round-trip and do month arithmetic like pd.DateOffset"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import monthtime
+
+
+def test_round_trip():
+    months = monthtime.to_months(["2022-01-15", "2022-03-01", "1999-12-31"])
+    assert months.dtype == np.int32
+    assert months.tolist() == [24264, 24266, 23999]
+    assert monthtime.to_strings(months).tolist() == ["2022-01", "2022-03", "1999-12"]
+    assert monthtime.to_timestamps(months).strftime("%Y-%m-%d").tolist() == ["2022-01-01", "2022-03-01", "1999-12-01"]
+    assert monthtime.from_year_month([2022], [3]).tolist() == [24266]
+    assert monthtime.year(months).tolist() == [2022, 2022, 1999]
+    assert monthtime.month(months).tolist() == [1, 3, 12]
+
+
+def test_timezones_and_missing():
+    aware = pd.Series(pd.to_datetime(["2022-03-31 23:30"]).tz_localize("Europe/London"))
+    assert monthtime.to_months(aware).tolist() == [24266]
+    with pytest.raises(ValueError):
+        monthtime.to_months(["2022-01-01", None])
+
+
+def test_arithmetic_matches_date_offset():
+    start = pd.Timestamp("2021-11-01")
+    ordinal = monthtime.to_month(start)
+    for months in (-14, -1, 0, 2, 3, 25):
+        expected = monthtime.to_month(start + pd.DateOffset(months=months))
+        assert monthtime.shift([ordinal], months).tolist() == [expected]
+        assert monthtime.diff(expected, ordinal) == months
+    assert monthtime.month_range("2021-11", "2022-02").tolist() == [24262, 24263, 24264, 24265]
+
+
+def test_financial_year():
+    months = monthtime.to_months(["2022-03-01", "2022-04-01", "2023-03-01"])
+    assert monthtime.financial_year(months).tolist() == [2022, 2023, 2023]
+    assert monthtime.financial_year(months, first_month=1).tolist() == [2022, 2022, 2023]
+
+
+def test_lag_is_by_month_not_position():
+    values = pd.Series([1.0, 2.0, 4.0], index=[24266, 24264, 24267])
+    assert monthtime.lag(values, [24268, 24266, 24265], 2).tolist() == [1.0, 2.0, pytest.approx(np.nan, nan_ok=True)]
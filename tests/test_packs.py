@@ -0,0 +1,62 @@
+"""Pack selection picks one pack per month and BNF code under each policy"""
+import pandas as pd
+import pytest
+
+from lib.packs import compare_policies, group_argmax, select_packs
+
+
+@pytest.fixture
+def pc_df():
+    # code A has a 28 and a 56 pack in July; code B one pack
+    return pd.DataFrame(
+        {
+            "month": ["2022-07-01", "2022-07-01", "2022-07-01", "2022-08-01"],
+            "name": ["A 28", "A 56", "B 100", "A 28"],
+            "bnf_code": ["A", "A", "B", "A"],
+            "vmpp_code": [1, 2, 3, 1],
+            "qtyval": [28, 56, 100, 28],
+            "pc_price_pence": [280.0, 1120.0, 500.0, 560.0],
+            "dt_price_pence": [140.0, 560.0, 400.0, 140.0],
+        }
+    )
+
+
+@pytest.fixture
+def pack_quantities():
+    return pd.DataFrame({"vmpp_code": [1, 2, 3], "quantity": [30.0, 10.0, 5.0]})
+
+
+def test_max_increase(pc_df):
+    df = select_packs(pc_df)
+    # A in July: 140 / 28 = 5 a unit for the 28 pack, 560 / 56 = 10 for the 56
+    assert df["vmpp_code"].tolist() == [2, 3, 1]
+    assert df["pc_ppu"].tolist() == [20.0, 5.0, 20.0]
+
+
+def test_most_prescribed(pc_df, pack_quantities):
+    df = select_packs(pc_df, "most_prescribed", pack_quantities)
+    assert df["vmpp_code"].tolist() == [1, 3, 1]
+    with pytest.raises(ValueError):
+        select_packs(pc_df, "most_prescribed")
+
+
+def test_weighted(pc_df, pack_quantities):
+    df = select_packs(pc_df, "weighted", pack_quantities)
+    assert df["bnf_code"].tolist() == ["A", "B", "A"]
+    # (30 x 10 + 10 x 20) / 40
+    assert df["pc_ppu"].tolist() == [12.5, 5.0, 20.0]
+    assert df["packs"].tolist() == [2, 1, 1]
+    assert "vmpp_code" not in df
+
+
+def test_ties_break_on_smallest_tiebreak():
+    assert group_argmax([0, 0, 1, 1], [1.0, 1.0, float("nan"), 2.0], tiebreak=[5, 4, 0, 1]).tolist() == [1, 3]
+
+
+def test_compare_policies(pc_df, pack_quantities):
+    df = compare_policies(pc_df, pack_quantities)
+    assert len(df) == 3
+    assert df["pc_ppu_max_increase"].tolist() == [20.0, 5.0, 20.0]
+    assert df["pc_ppu_most_prescribed"].tolist() == [10.0, 5.0, 20.0]
+    with pytest.raises(ValueError):
+        select_packs(pc_df, "cheapest")
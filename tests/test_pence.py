@@ -0,0 +1,80 @@
+"""Integer-pence costs are exact, whatever the order of the rows"""
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from lib import pence
+
+
+def _exact(price, quantity, qtyval, percent_off=0):
+    return [
+        Fraction(int(p)) * Fraction(str(q)) / Fraction(str(v)) * (100 - Fraction(str(percent_off))) / 100
+        for p, q, v in zip(price, quantity, qtyval)
+    ]
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    n = 2000
+    return {
+        "group": rng.integers(0, 12, n),
+        "price": rng.integers(1, 40000, n),
+        "quantity": rng.integers(0, 10 ** 6, n) + rng.choice([0, 0.5], n),
+        "qtyval": rng.choice([28, 56, 13.5, 2.5, 100, 66], n),
+    }
+
+
+def test_pack_costs_are_exact(rows):
+    costs = pence.pack_costs(rows["price"], rows["quantity"], rows["qtyval"])
+    assert costs.fractions() == _exact(rows["price"], rows["quantity"], rows["qtyval"])
+
+
+def test_group_costs_match_row_by_row_sums(rows):
+    keys, totals = pence.group_costs(rows["group"], rows["price"], rows["quantity"], rows["qtyval"], 7.2)
+    exact = _exact(rows["price"], rows["quantity"], rows["qtyval"], 7.2)
+    expected = [sum((c for c, g in zip(exact, rows["group"]) if g == key), Fraction(0)) for key in keys]
+    assert totals.fractions() == expected
+    # and the per-row route gives the same
+    row_totals = pence.pack_costs(rows["price"], rows["quantity"], rows["qtyval"]).discount(7.2).group_sum(rows["group"])[1]
+    assert row_totals.fractions() == expected
+
+
+def test_totals_do_not_depend_on_row_order(rows):
+    order = np.random.default_rng(1).permutation(len(rows["group"]))
+    _, totals = pence.group_costs(rows["group"], rows["price"], rows["quantity"], rows["qtyval"])
+    _, shuffled = pence.group_costs(*(rows[k][order] for k in ("group", "price", "quantity", "qtyval")))
+    assert totals.fractions() == shuffled.fractions()
+
+
+def test_pence_round_half_to_even():
+    amounts = pence.Amounts.from_fraction([5, 7, -5, 1, 2], [2, 2, 2, 3, 3])
+    assert amounts.pence().tolist() == [2, 4, -2, 0, 1]
+
+
+def test_overflow_raises():
+    with pytest.raises(OverflowError):
+        pence.pack_costs([2 ** 40], [2 ** 30], [1])
+
+
+def test_fractional_prices_are_refused():
+    with pytest.raises(ValueError):
+        pence.pack_costs([10.5], [1], [28])
+
+
+def test_group_costs_with_decimal_quantities_and_discounts():
+    # 2 decimal place quantities around 1e6 with 2 decimal place discounts per row
+    rng = np.random.default_rng(2)
+    n = 500
+    group = rng.integers(0, 5, n)
+    price = rng.integers(1, 100000, n)
+    quantity = np.round(rng.random(n) * 1e6, 2)
+    qtyval = rng.choice([28, 13.5, 100], n)
+    percent_off = rng.choice([7.25, 10.13, 0], n)
+    keys, totals = pence.group_costs(group, price, quantity, qtyval, percent_off)
+    exact = [
+        Fraction(int(p)) * Fraction(str(q)) / Fraction(str(v)) * (100 - Fraction(str(d))) / 100
+        for p, q, v, d in zip(price, quantity, qtyval, percent_off)
+    ]
+    assert totals.fractions() == [sum((c for c, g in zip(exact, group) if g == key), Fraction(0)) for key in keys]
@@ -0,0 +1,115 @@
+"""Episodes and post-concession costs, on a hand-worked example and against synthetic ground truth"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib import synthetic
+from lib.episodes import find_episodes
+from lib.postconcession import iter_post_concession_costs, monthly_totals, post_concession_costs
+
+KEY = ["vmpp", "first_month", "last_month"]
+MONTHS = pd.date_range("2022-01-01", "2022-12-01", freq="MS")
+
+
+@pytest.fixture
+def ncso_dates():
+    rows = [
+        (1, "2022-04-01"),
+        (1, "2022-05-01"),
+        (1, "2022-05-01"),  # duplicate month
+        (1, "2022-08-01"),
+        (2, "2022-07-01"),  # two separate one-month concessions
+        (2, "2022-10-01"),
+        (3, "2022-12-01"),  # reaches the latest month
+    ]
+    df = pd.DataFrame(rows, columns=["vmpp", "month"])
+    df["concession_bool"] = 1
+    return df
+
+
+@pytest.fixture
+def tariff():
+    # vmpp 1 (28 tablets): 100p before its concession, 150p during, 130p after
+    prices = [100, 100, 100, 150, 150, 130, 130, 130, 130, 130, 130, 130]
+    return pd.DataFrame(
+        {
+            "vmpp": 1,
+            "date": MONTHS.strftime("%Y-%m-%d"),
+            "price_pence": np.array(prices, dtype=np.float64),
+            "bnf_code": "X",
+            "nm": "X 28 tablets",
+            "unit_qty": 28,
+        }
+    )
+
+
+@pytest.fixture
+def rx():
+    return pd.DataFrame({"month": MONTHS, "bnf_code": "X", "quantity": 56.0})
+
+
+def test_episodes(ncso_dates):
+    episodes = find_episodes(ncso_dates)
+    assert episodes["vmpp"].tolist() == [1, 1, 2, 2, 3]
+    assert episodes["first_month"].dt.strftime("%Y-%m").tolist() == ["2022-04", "2022-08", "2022-07", "2022-10", "2022-12"]
+    assert episodes["months"].tolist() == [2, 1, 1, 1, 1]
+    assert episodes["ongoing"].tolist() == [False, False, False, False, True]
+
+
+def test_costs(ncso_dates, tariff, rx):
+    episodes = find_episodes(ncso_dates)
+    costs = post_concession_costs(episodes[:1], tariff, rx, horizons=(3, 12), price_windows=(3,))
+    # the 12 month horizon runs past the data, so only 3 months is complete
+    assert costs["horizon"].tolist() == [3]
+    row = costs.iloc[0]
+    assert row["rx_start_month"] == pd.Timestamp("2022-06-01")
+    assert (row["pre_pc_price"], row["post_pc_price"]) == (100.0, 130.0)
+    # 3 x 56 tablets = 6 packs, each 30p dearer
+    assert row["quantity"] == 168.0
+    assert row["additional_cost"] == pytest.approx(1.8)
+
+    partial = post_concession_costs(episodes[:1], tariff, rx, horizons=(12,), complete_only=False)
+    assert np.isnan(partial["additional_cost"]).all()
+
+    totals = monthly_totals(costs)
+    assert totals["additional_cost"].tolist() == [pytest.approx(1.8)]
+
+
+def test_ongoing_episodes_are_skipped(ncso_dates, tariff, rx):
+    episodes = find_episodes(ncso_dates)
+    ongoing = episodes[episodes["ongoing"]].assign(vmpp=1)
+    assert post_concession_costs(ongoing, tariff, rx).empty
+
+
+@pytest.fixture(scope="module")
+def generated():
+    return synthetic.generate(n_vmpps=200, n_years=4, seed=1)
+
+
+def test_synthetic_episodes(generated):
+    columns = KEY + ["months", "ongoing"]
+    found = find_episodes(generated["ncso_dates"]).sort_values(KEY).reset_index(drop=True)[columns]
+    pd.testing.assert_frame_equal(found, generated["episodes"][columns])
+
+
+def test_synthetic_costs(generated):
+    episodes = find_episodes(generated["ncso_dates"])
+    costs = post_concession_costs(episodes, generated["tariff"], generated["rx"], horizons=(3,), price_windows=(3,))
+    costs = costs.sort_values(KEY).reset_index(drop=True)
+    expected = generated["costs"]
+    pd.testing.assert_frame_equal(costs[KEY], expected[KEY])
+    for column in ["quantity", "pre_pc_price", "post_pc_price", "additional_cost"]:
+        np.testing.assert_allclose(costs[column], expected[column], err_msg=column)
+
+
+def test_synthetic_chunks(generated):
+    episodes = find_episodes(generated["ncso_dates"])
+    costs = post_concession_costs(episodes, generated["tariff"], generated["rx"])
+    assert sorted(costs["horizon"].unique()) == [1, 3, 6, 12]
+    chunked = pd.concat(
+        iter_post_concession_costs(episodes, generated["tariff"], generated["rx"], chunk_size=7), ignore_index=True
+    )
+    order = KEY + ["horizon", "price_window"]
+    pd.testing.assert_frame_equal(
+        chunked.sort_values(order).reset_index(drop=True), costs.sort_values(order).reset_index(drop=True)
+    )
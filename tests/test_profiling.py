@@ -0,0 +1,64 @@
+"""Notebook instrumentation records merges and groupbys, and pool stages count their workers' CPU"""
+import concurrent.futures
+
+import pandas as pd
+import pytest
+
+from lib import profiling
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    # let monkeypatch put the originals back after instrument_notebook replaces them
+    monkeypatch.setattr(pd, "read_html", pd.read_html)
+    monkeypatch.setattr(pd, "merge", pd.merge)
+    monkeypatch.setattr(pd.DataFrame, "merge", pd.DataFrame.merge)
+    for class_name in profiling.GROUPBY_CLASSES:
+        groupby = getattr(pd.core.groupby, class_name)
+        for method in profiling.GROUPBY_AGGREGATIONS:
+            if hasattr(groupby, method):
+                monkeypatch.setattr(groupby, method, getattr(groupby, method))
+    monkeypatch.setattr(profiling, "PROFILER", profiling.Profiler())
+    profiling.instrument_notebook()
+    profiling.PROFILER.enable()
+    yield profiling.PROFILER
+    profiling.PROFILER.disable()
+
+
+def test_merges_and_groupbys_are_stages(profiler):
+    left = pd.DataFrame({"month": [1, 1, 2], "cost": [1.0, 2.0, 3.0]})
+    right = pd.DataFrame({"month": [1, 2], "nadp": [0.1, 0.2]})
+    pd.merge(left, right, on="month")
+    merged = left.merge(right, on="month")
+    merged.groupby("month").agg(cost=("cost", "sum"))
+    merged.groupby("month")["cost"].sum()
+    merged.groupby("month")["cost"].transform(lambda c: c / c.sum())
+    merged["cost"].groupby(merged["month"]).transform("size")
+    merged.groupby("month").transform("sum")
+
+    stages = [(r["stage"], r["rows_in"], r["rows_out"]) for r in profiler.records]
+    assert stages == [
+        ("pd.merge", 5, 3),
+        ("DataFrame.merge", 5, 3),
+        ("DataFrameGroupBy.agg", 3, 2),
+        ("SeriesGroupBy.sum", 3, 2),
+        ("SeriesGroupBy.transform", 3, 3),
+        ("SeriesGroupBy.transform", 3, 3),
+        ("DataFrameGroupBy.transform", 3, 3),
+    ]
+
+
+def _spin(n):
+    return sum(i * i for i in range(n))
+
+
+def test_process_stage_counts_workers(profiler):
+    with profiling.stage("threads"):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as pool:
+            list(pool.map(_spin, [2_000_000] * 2))
+    with profiling.stage("processes", processes=True):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as pool:
+            list(pool.map(_spin, [2_000_000] * 2))
+    threads, processes = profiler.records
+    assert processes["cpu_seconds"] > 0.05
+    assert processes["cpu_seconds"] > 2 * threads["cpu_seconds"]
@@ -0,0 +1,65 @@
+"""Exports are reconciled per organisation, month and BNF code"""
+import pandas as pd
+import pytest
+
+from lib import reconcile, store
+
+
+def _export(directory, org, month, quantities):
+    pd.DataFrame(
+        {"BNF code": list(quantities), "Presentation": list(quantities), "Quantity": list(quantities.values())}
+    ).to_csv(directory / f"price-concessions-cost-{org}-{month}.csv", index=False)
+
+
+@pytest.fixture
+def ncso_df():
+    return pd.DataFrame(
+        {
+            "month": ["2022-06-01", "2022-06-01", "2022-07-01"],
+            "bnf_name": ["a", "b", "a"],
+            "bnf_code": ["A", "B", "A"],
+            "quantity": [10.0, 20.0, 30.0],
+        }
+    )
+
+
+def test_other_organisations_do_not_duplicate_rows(tmp_path, ncso_df):
+    _export(tmp_path, "nhs-england", "2022-06-01", {"A": 12, "B": 20})
+    _export(tmp_path, "some-icb", "2022-06-01", {"A": 1, "B": 2})
+    with pytest.warns(UserWarning, match="some-icb"):
+        diff_df, summary = reconcile.reconcile(ncso_df, tmp_path)
+    assert diff_df[["org", "bnf_code", "difference"]].values.tolist() == [
+        ["nhs-england", "A", -2.0],
+        ["nhs-england", "B", 0.0],
+    ]
+    assert summary[["org", "matched", "exact"]].values.tolist() == [["nhs-england", 2, 1]]
+
+
+def test_join_on_org_column(tmp_path, ncso_df):
+    two_orgs = pd.concat([ncso_df.assign(org="x"), ncso_df.assign(org="y", quantity=ncso_df["quantity"] * 2)])
+    _export(tmp_path, "x", "2022-06-01", {"A": 10, "B": 20})
+    _export(tmp_path, "y", "2022-06-01", {"A": 10, "B": 40})
+    diff_df, summary = reconcile.reconcile(two_orgs, tmp_path)
+    assert len(diff_df) == 4
+    assert (diff_df["source"] == "both").all()
+    assert summary.set_index("org")["difference"].to_dict() == {"x": 0.0, "y": 10.0}
+
+
+def test_main_writes_month_partitions(tmp_path, ncso_df):
+    ncso_df.to_csv(tmp_path / "ncso_df.csv", index=False)
+    _export(tmp_path, "nhs-england", "2022-06-01", {"A": 12, "B": 20})
+    _export(tmp_path, "nhs-england", "2022-07-01", {"A": 30})
+    assert reconcile.main(["--data-dir", str(tmp_path)]) == 0
+
+    store_dir = str(tmp_path / "store")
+    assert store.available_months(store_dir, "op_differences") == ["2022-06", "2022-07"]
+    _, expected = reconcile.reconcile(ncso_df, tmp_path)
+    summary = pd.read_csv(tmp_path / "op_differences_summary.csv", parse_dates=["month"])
+    pd.testing.assert_frame_equal(summary, expected, check_dtype=False)
+
+    # reconciling July again replaces it and keeps June
+    (tmp_path / "price-concessions-cost-nhs-england-2022-06-01.csv").unlink()
+    _export(tmp_path, "nhs-england", "2022-07-01", {"A": 25})
+    assert reconcile.main(["--data-dir", str(tmp_path)]) == 0
+    summary = pd.read_csv(tmp_path / "op_differences_summary.csv")
+    assert summary[["month", "difference"]].values.tolist() == [["2022-06-01", -2.0], ["2022-07-01", 5.0]]
@@ -0,0 +1,44 @@
+"""Report sections are reused from the cache until the tables they show change"""
+import os
+
+import pytest
+
+from lib import report
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+pytest.importorskip("matplotlib")
+
+
+@pytest.fixture(scope="module")
+def tables():
+    return report.load_tables(DATA_DIR)
+
+
+def test_sections_are_cached_until_their_tables_change(tables, tmp_path):
+    output = str(tmp_path / "index.html")
+    assert set(report.build_report(tables, output).values()) == {"built"}
+    assert set(report.build_report(tables, output).values()) == {"unchanged"}
+
+    fy = tables["fy"].copy()
+    fy.iloc[0, fy.columns.get_loc("actual_cost")] += 1
+    status = report.build_report(dict(tables, fy=fy), output)
+    assert status["fy"] == "built"
+    assert {name for name, state in status.items() if state != "unchanged"} == {"fy"}
+
+    assert set(report.build_report(dict(tables, fy=fy), output, force=True).values()) == {"built"}
+    with open(output) as f:
+        page = f.read()
+    assert all(f'<section id="{name}">' in page for name in report.SECTIONS)
+
+
+def test_missing_tables_leave_their_section_out(tables, tmp_path):
+    output = str(tmp_path / "index.html")
+    status = report.build_report(dict(tables, post_concession=None), output)
+    assert status["post_concession"] == "no data"
+    with open(output) as f:
+        assert 'id="post_concession"' not in f.read()
+
+
+def test_missing_inputs_exit(tmp_path):
+    assert report.main(["--data-dir", str(tmp_path), "--output", str(tmp_path / "index.html")]) == report.EXIT_MISSING_INPUT
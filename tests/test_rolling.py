@@ -0,0 +1,56 @@
+"""Rolling quantity windows match pandas' rolling sums over a dense month grid"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from lib.rolling import build_quantity_grid, rolling_quantity, rolling_sum, window_bounds
+
+
+@pytest.fixture
+def rx():
+    # B has no row for 2022-03, which counts as zero, and A two rows for 2022-02
+    return pd.DataFrame(
+        {
+            "month": ["2022-01-01", "2022-02-01", "2022-02-01", "2022-04-01", "2022-01-01", "2022-02-01", "2022-04-01"],
+            "bnf_code": ["A", "A", "A", "A", "B", "B", "B"],
+            "quantity": [1.0, 2.0, 3.0, 4.0, 10.0, 20.0, 40.0],
+        }
+    )
+
+
+def test_grid(rx):
+    grid = build_quantity_grid(rx)
+    assert grid.codes.tolist() == ["A", "B"]
+    assert len(grid.months) == 4
+    np.testing.assert_array_equal(grid.values, [[1, 10], [5, 20], [0, 0], [4, 40]])
+    assert grid.observed[:, 1].tolist() == [True, True, False, True]
+
+
+@pytest.mark.parametrize("direction", ["forward", "backward", "centred"])
+@pytest.mark.parametrize("width", [1, 2, 3, 4])
+def test_matches_pandas(direction, width):
+    values = np.random.default_rng(width).random((12, 3))
+    start, end = window_bounds(width, direction)
+    # a pandas trailing window ending at `end` months ahead
+    expected = pd.DataFrame(values).rolling(width, width).sum().shift(-end).to_numpy()
+    np.testing.assert_allclose(rolling_sum(values, width, direction), expected)
+
+
+def test_partial_windows():
+    values = np.array([1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(rolling_sum(values, 2, "forward", complete_only=False), [3, 5, 3])
+    with pytest.raises(ValueError):
+        window_bounds(0)
+    with pytest.raises(ValueError):
+        window_bounds(3, "sideways")
+
+
+def test_rolling_quantity(rx):
+    df = rolling_quantity(rx, width=2)
+    assert df.columns.tolist() == ["month", "bnf_code", "roll_2m_quantity"]
+    # only observed months with a complete window: 2022-04 runs off the end
+    assert df["month"].dt.strftime("%Y-%m").tolist() == ["2022-01", "2022-01", "2022-02", "2022-02"]
+    assert df["roll_2m_quantity"].tolist() == [6.0, 30.0, 5.0, 20.0]
+
+    every_month = rolling_quantity(rx, width=2, observed_only=False, complete_only=False)
+    assert len(every_month) == 8
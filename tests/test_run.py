@@ -0,0 +1,79 @@
+"""run.py reuses built images and running containers, and waits for Jupyter"""
+import http.server
+import socket
+import subprocess
+import threading
+
+import pytest
+
+import run
+
+
+class Docker:
+    """Records docker commands, answering them from `replies`"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.commands = []
+
+    def __call__(self, cmd, check=False, capture_output=False, **kwargs):
+        self.commands.append(cmd)
+        returncode, stdout = self.replies.get(cmd[1], (0, b""))
+        if check and returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        return subprocess.CompletedProcess(cmd, returncode, stdout=stdout, stderr=b"")
+
+
+def test_build_hash_follows_the_build_inputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "Dockerfile").write_text("FROM python:3.8\n")
+    (tmp_path / "requirements.txt").write_text("pandas==1.0.1\n")
+    before = run.build_hash()
+    assert run.build_hash() == before
+    (tmp_path / "requirements.txt").write_text("pandas==1.0.1\npolars==1.8.2\n")
+    assert run.build_hash() != before
+
+
+def test_existing_image_is_not_rebuilt(monkeypatch):
+    docker = Docker({"image": (0, b"[]")})
+    monkeypatch.setattr(subprocess, "run", docker)
+    monkeypatch.setattr(run, "stream_subprocess_output", lambda cmd: pytest.fail("rebuilt the image"))
+    assert run.docker_build("tag") == f"tag:{run.build_hash()}"
+
+
+def test_running_container_is_reused(monkeypatch):
+    docker = Docker({"ps": (0, b"abc123\n")})
+    monkeypatch.setattr(subprocess, "run", docker)
+    monkeypatch.setattr(run.signal, "signal", lambda *args: None)
+    assert run.docker_run("tag:hash") == "abc123"
+    assert [cmd[1] for cmd in docker.commands] == ["ps"]
+    assert f"label={run.dir_label}={run.current_dir}" in docker.commands[0]
+
+
+@pytest.fixture
+def server():
+    # any HTTP answer, even an error, means Jupyter is up
+    httpd = http.server.HTTPServer(("localhost", 0), http.server.BaseHTTPRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_waits_for_jupyter(server):
+    run.await_jupyter_http(server, timeout=5)
+
+
+@pytest.fixture
+def refused_port():
+    # bound but not listening, so connections are refused
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        yield s.getsockname()[1]
+
+
+def test_stops_waiting_when_the_container_stops(refused_port, monkeypatch):
+    monkeypatch.setattr(run, "docker_running", lambda container_id: False)
+    with pytest.raises(SystemError, match="docker logs abc123"):
+        run.await_jupyter_http(refused_port, timeout=5, container_id="abc123")
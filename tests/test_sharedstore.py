@@ -0,0 +1,83 @@
+"""Frames published to a FrameStore come back the same, in this process and others"""
+import concurrent.futures
+
+import pandas as pd
+import pytest
+
+from lib import sharedstore
+
+
+@pytest.fixture
+def frames(tmp_path):
+    return sharedstore.FrameStore(str(tmp_path / "frames"))
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {
+            "month": pd.to_datetime(["2022-06-01", "2022-07-01", "2022-07-01"]),
+            "bnf_code": ["A", "B", None],
+            "quantity": [1.5, 2.0, 3.0],
+            "items": pd.array([1, None, 3], dtype="Int64"),
+            "concession": [True, False, True],
+        }
+    )
+
+
+def test_round_trip(frames, df):
+    frames.publish("ncso_df", df, "v1")
+    attached = frames.attach("ncso_df")
+    # strings come back as categoricals
+    expected = df.assign(bnf_code=df["bnf_code"].astype("category"))
+    assert attached.columns.tolist() == expected.columns.tolist()
+    for column in expected:
+        assert attached[column].equals(expected[column]), column
+    if int(pd.__version__.split(".")[0]) >= 2:
+        # older pandas copies the columns as it builds the frame
+        assert not attached["quantity"].to_numpy().flags.writeable
+    assert frames.names() == ["ncso_df"]
+    assert frames.nbytes("ncso_df") > 0
+
+
+def test_load_publishes_once(frames, df):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return df
+
+    frames.load("ncso_df", loader, "v1")
+    frames.load("ncso_df", loader, "v1")
+    assert len(calls) == 1
+    frames.remove("ncso_df", "v1")
+    assert frames.versions("ncso_df") == []
+    frames.remove("ncso_df")
+    assert frames.names() == []
+
+
+def test_publishing_prunes_superseded_versions(frames, df):
+    old = frames.load("ncso_df", lambda: df, "v1")
+    frames.load("ncso_df", lambda: df.iloc[:2], "v2")
+    assert frames.versions("ncso_df") == ["v2"]
+    assert len(frames.attach("ncso_df")) == 2
+    # maps of a removed version stay readable
+    assert old["quantity"].sum() == 6.5
+
+
+def _total(root):
+    return float(sharedstore.FrameStore(root).attach("ncso_df", "v1")["quantity"].sum())
+
+
+def test_other_processes_attach(frames, df):
+    frames.publish("ncso_df", df, "v1")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(_total, frames.root).result() == 6.5
+
+
+def test_refuses_what_it_cant_share(frames, df):
+    with pytest.raises(ValueError):
+        frames.publish("indexed", df.set_index("bnf_code"), "v1")
+    with pytest.raises(TypeError):
+        frames.publish("mixed", pd.DataFrame({"x": [1, "a"]}), "v1")
+    assert not frames.has("mixed", "v1")
@@ -0,0 +1,33 @@
+"""Month-partitioned reads return the months asked for"""
+import pandas as pd
+import pytest
+
+from lib import store
+
+
+@pytest.fixture
+def partitioned(tmp_path):
+    df = pd.DataFrame(
+        {
+            "month": ["2022-07-01", "2022-06-01", "2022-07-01", "2022-09-01"],
+            "bnf_code": ["A", "A", "B", "A"],
+            "quantity": [1.0, 2.0, 3.0, 4.0],
+        }
+    )
+    store.write_partitioned(df, str(tmp_path), "ncso_df")
+    return str(tmp_path)
+
+
+def test_read_range(partitioned):
+    df = store.read_partitioned(partitioned, "ncso_df", "2022-07", "2022-09", columns=["quantity"])
+    assert df.columns.tolist() == ["month", "quantity"]
+    assert df["quantity"].tolist() == [1.0, 3.0, 4.0]
+    assert store.month_slice(df, "2022-08", "2022-09")["quantity"].tolist() == [4.0]
+
+
+@pytest.mark.parametrize("columns", [None, ["quantity"]])
+def test_range_without_partitions_is_empty(partitioned, columns):
+    df = store.read_partitioned(partitioned, "ncso_df", "2023-01", "2023-03", columns=columns)
+    assert df.empty
+    expected = ["month", "bnf_code", "quantity"] if columns is None else ["month", "quantity"]
+    assert df.columns.tolist() == expected
@@ -0,0 +1,38 @@
+"""Synthetic data is reproducible from its seed and shaped like the cached extracts"""
+import os
+
+import pandas as pd
+import pytest
+
+from lib import ingest, synthetic
+
+PARAMS = {"n_vmpps": 60, "n_years": 3}
+
+
+@pytest.fixture(scope="module")
+def generated():
+    return synthetic.generate(seed=5, **PARAMS)
+
+
+def test_same_seed_gives_identical_frames(generated):
+    again = synthetic.generate(seed=5, **PARAMS)
+    assert list(again) == list(generated)
+    for name, df in generated.items():
+        pd.testing.assert_frame_equal(again[name], df, obj=name)
+
+
+def test_other_seeds_differ(generated):
+    other = synthetic.generate(seed=6, **PARAMS)
+    assert not other["tariff"]["price_pence"].equals(generated["tariff"]["price_pence"])
+
+
+def test_written_like_the_cached_extracts(generated, tmp_path):
+    paths = synthetic.write_synthetic(generated, str(tmp_path))
+    assert [os.path.basename(p) for p in paths] == [f"{name}.csv" for name in synthetic.CACHE_SCHEMAS]
+    for name, columns in synthetic.CACHE_SCHEMAS.items():
+        if name in ingest.SCHEMAS:
+            df = ingest.read_cache(name, str(tmp_path))
+        else:
+            df = pd.read_csv(tmp_path / f"{name}.csv")
+        assert df.columns.tolist() == columns, name
+        assert len(df) == len(generated[name]), name